@@ -0,0 +1,111 @@
+import os
+import asyncio
+import logging
+import threading
+from glob import glob as glob_glob
+from re import split as re_split
+import url_checker
+import startup_cache
+from url_checker import AllowMatcher
+from shared_state import file_lock
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+ALLOWLIST_GLOB = "*_allowed_urls.txt"
+# Runtime additions/removals made with /addAllowedUrl and /removeAllowedUrl are persisted here.
+MANUAL_ALLOWLIST_FILE = "manual_allowed_urls.txt"
+ALLOWLIST_POLL_SECONDS = getattr(_config, "ALLOWLIST_POLL_SECONDS", 5)
+
+def load_allowed_urls(pattern=ALLOWLIST_GLOB):
+    all_urls = []
+    for file_path in sorted(glob_glob(pattern)):
+        with open(file_path, 'r') as file:
+            urls = re_split(r'\n+', file.read().strip())
+            all_urls.extend(url for url in urls if url.strip())
+    return all_urls
+
+def files_signature(pattern=ALLOWLIST_GLOB):
+    """(path, mtime, size) of every allowlist file, changes whenever a file is added, removed or edited."""
+    signature = []
+    for file_path in sorted(glob_glob(pattern)):
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+        signature.append((file_path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+class AllowList:
+    """
+    Holds the compiled AllowMatcher built from the allowlist files.
+    reload_if_changed() does the file reads and compilation and then swaps
+    the matcher in with a single assignment, so readers always see either the
+    old or the new matcher. It is meant to run off the event loop (see watch()).
+    """
+
+    def __init__(self, pattern=ALLOWLIST_GLOB):
+        self.pattern = pattern
+        self._lock = threading.Lock()
+        self.signature = None
+        self.matcher = AllowMatcher([])
+        self.reload_if_changed()
+
+    def reload_if_changed(self, force=False) -> bool:
+        with self._lock:
+            signature = files_signature(self.pattern)
+            if signature == self.signature and not force:
+                return False
+            sources = [file_path for file_path, _, _ in signature] + [url_checker.__file__, __file__]
+            matcher = startup_cache.cached(f"allowlist {self.pattern}", sources,
+                                           lambda: AllowMatcher(load_allowed_urls(self.pattern)))
+            self.matcher = matcher
+            self.signature = signature
+        logging.info(f"Allowlist loaded with {len(matcher)} URLs from {len(signature)} files")
+        return True
+
+    async def watch(self, interval=ALLOWLIST_POLL_SECONDS):
+        """Polls the allowlist files forever and reloads them in a worker thread when they change."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.reload_if_changed)
+            except Exception as e:
+                logging.error(f"Failed to reload allowlist: {e}")
+
+def _read_manual_urls():
+    if not os.path.exists(MANUAL_ALLOWLIST_FILE):
+        return []
+    with open(MANUAL_ALLOWLIST_FILE, 'r') as file:
+        return [url for url in re_split(r'\n+', file.read().strip()) if url.strip()]
+
+def _write_manual_urls(urls):
+    tmp_path = MANUAL_ALLOWLIST_FILE + ".tmp"
+    with open(tmp_path, 'w') as file:
+        file.write("\n".join(urls) + "\n")
+    os.replace(tmp_path, MANUAL_ALLOWLIST_FILE)
+
+def add_url(url: str) -> bool:
+    """Adds url to the manual allowlist file. Returns False if it is already there."""
+    url = url.strip()
+    with file_lock("manual_allowlist"):
+        urls = _read_manual_urls()
+        if url in urls:
+            return False
+        urls.append(url)
+        _write_manual_urls(urls)
+    return True
+
+def remove_url(url: str) -> bool:
+    """Removes url from the manual allowlist file. Returns False if it is not there."""
+    url = url.strip()
+    with file_lock("manual_allowlist"):
+        urls = _read_manual_urls()
+        if url not in urls:
+            return False
+        _write_manual_urls([u for u in urls if u != url])
+    return True
+
+ALLOWLIST = AllowList()
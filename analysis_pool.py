@@ -0,0 +1,212 @@
+"""
+Process pool backend for the URL analysis of long messages.
+
+Short messages are still checked inline, they take microseconds. Messages longer than
+ANALYSIS_POOL_MIN_LENGTH characters or with more than ANALYSIS_POOL_MIN_DOTS dots are sent
+to worker processes, so a few huge captions can't hold up every other update on the event loop.
+Workers get the compiled allowlist and group matchers once, when they start. A new pool is
+started whenever the allowlist or the groups data change.
+Enable it with ANALYSIS_BACKEND = "pool" in config.py.
+"""
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import url_checker
+from url_checker import contains_prohibited_url, VerdictCache, _MISSING
+from policy import POLICIES
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+ANALYSIS_BACKEND = getattr(_config, "ANALYSIS_BACKEND", "inline")
+ANALYSIS_POOL_WORKERS = getattr(_config, "ANALYSIS_POOL_WORKERS", max(1, (os.cpu_count() or 2) - 1))
+ANALYSIS_POOL_MIN_LENGTH = getattr(_config, "ANALYSIS_POOL_MIN_LENGTH", 1000)
+ANALYSIS_POOL_MIN_DOTS = getattr(_config, "ANALYSIS_POOL_MIN_DOTS", 40)
+# Seconds to wait for a worker's verdict on one message, time spent queued for a free worker
+# included. A message that times out is checked inline instead.
+ANALYSIS_POOL_TIMEOUT = getattr(_config, "ANALYSIS_POOL_TIMEOUT", 2.0)
+# Messages waiting for a worker before new ones are checked inline instead.
+ANALYSIS_POOL_MAX_PENDING = getattr(_config, "ANALYSIS_POOL_MAX_PENDING", ANALYSIS_POOL_WORKERS * 4)
+
+# --- worker side ---
+_worker_matchers = {}
+_worker_caches = {}
+
+def _init_worker(state: dict):
+    """Runs once in every worker with the classifier state of the pool's generation."""
+    url_checker.VALID_TLDS = state["tlds"]
+    _worker_matchers.update(state["matchers"])
+    _worker_caches.update({key: VerdictCache(url_checker.URL_CACHE_SIZE, 0) for key in state["matchers"]})
+
+def _ping() -> int:
+    return os.getpid()
+
+def _analyze(key: str, text: str, resolved):
+    return contains_prohibited_url(text, exempt_patterns=_worker_matchers[key], cache=_worker_caches[key], resolved=resolved)
+
+# --- event loop side ---
+class AnalysisPool:
+    def __init__(self, workers=ANALYSIS_POOL_WORKERS, min_length=ANALYSIS_POOL_MIN_LENGTH, min_dots=ANALYSIS_POOL_MIN_DOTS,
+                 timeout=ANALYSIS_POOL_TIMEOUT, max_pending=ANALYSIS_POOL_MAX_PENDING, start_method="spawn"):
+        self.workers = workers
+        self.min_length = min_length
+        self.min_dots = min_dots
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.context = multiprocessing.get_context(start_method)
+        self._executor = None
+        self._ready = False
+        self._sources = (None, None)
+        self._keys = {}
+        self._fingerprint = None
+        self.pending = 0
+        self.counts = {"inline": 0, "pool": 0, "warming_up": 0, "saturated": 0, "timeouts": 0, "restarts": 0}
+
+    def is_heavy(self, text: str) -> bool:
+        return len(text) >= self.min_length or text.count('.') >= self.min_dots
+
+    def _sync(self, channels_data, global_matcher, policies):
+        """
+        Points the pool at the global matcher and the matcher of every group with its own rules.
+        New objects with the same patterns (a reload that changed nothing, edits of other groups'
+        timings) keep the running workers, the pool only restarts when a matcher's patterns or the TLDs changed.
+        """
+        matchers = {"global": global_matcher}
+        keys = {id(global_matcher): ("global", global_matcher)}
+        for channel in (channels_data.channels if channels_data else []):
+            matcher = policies.get(channel.id, channels_data, global_matcher).matcher
+            if id(matcher) not in keys:
+                key = str(channel.id)
+                matchers[key] = matcher
+                keys[id(matcher)] = (key, matcher)
+        fingerprint = (url_checker.VALID_TLDS, sorted((key, matcher.key) for key, matcher in matchers.items()))
+        self._keys = keys
+        self._sources = (channels_data, global_matcher)
+        if fingerprint != self._fingerprint or self._executor is None:
+            self._fingerprint = fingerprint
+            self._start(matchers)
+
+    def _start(self, matchers: dict):
+        """Starts a pool whose workers know matchers."""
+        self.shutdown()
+        # Pickled once per worker start, shared objects (the global matcher inside group matchers) stay shared.
+        state = {"tlds": url_checker.VALID_TLDS, "matchers": matchers}
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=self.context,
+                                             initializer=_init_worker, initargs=(state,))
+        self._ready = False
+        self.counts["restarts"] += 1
+        executor = self._executor
+        warm_up = [executor.submit(_ping) for _ in range(self.workers)]
+
+        def mark_ready(_):
+            if executor is self._executor and all(future.done() for future in warm_up):
+                self._ready = not any(future.exception() for future in warm_up)
+        for future in warm_up:
+            future.add_done_callback(mark_ready)
+        logging.info(f"Analysis pool starting with {self.workers} workers and {len(matchers)} matchers")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._ready = False
+
+    def _inline(self, text, policy, resolved, counter="inline"):
+        self.counts[counter] += 1
+        return contains_prohibited_url(text, exempt_patterns=policy.matcher, cache=policy.cache, resolved=resolved)
+
+    async def contains_prohibited_url(self, text: str, policy, resolved, channels_data, global_matcher) -> bool:
+        """Same verdict as url_checker.contains_prohibited_url for policy, computed in a worker for heavy messages."""
+        if not self.is_heavy(text):
+            return self._inline(text, policy, resolved)
+        if self._sources[0] is not channels_data or self._sources[1] is not global_matcher:
+            self._sync(channels_data, global_matcher, POLICIES)
+        entry = self._keys.get(id(policy.matcher))
+        if entry is None or entry[1] is not policy.matcher:
+            return self._inline(text, policy, resolved)
+        if not self._ready:
+            return self._inline(text, policy, resolved, "warming_up")
+        if self.pending >= self.max_pending:
+            return self._inline(text, policy, resolved, "saturated")
+
+        cache = policy.cache
+        message_key = None
+        if not resolved:
+            cache.sync(policy.matcher)
+            message_key = cache.message_key(text)
+            verdict = cache.messages.get(message_key)
+            if verdict is not _MISSING:
+                return verdict
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            job = self._executor.submit(_analyze, entry[0], text, resolved)
+            self.pending += 1
+            self.counts["pool"] += 1
+            # A job keeps its worker busy after a timeout, so it counts as pending until it's really done.
+            job.add_done_callback(lambda _: self._job_done(loop))
+            verdict = await asyncio.wait_for(asyncio.wrap_future(job), self.timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"URL analysis of a {len(text)} character message timed out after {self.timeout}s, checking it inline")
+            return self._inline(text, policy, resolved, "timeouts")
+        except (BrokenProcessPool, RuntimeError) as e:
+            logging.error(f"Analysis pool failed ({e!r}), restarting it and checking inline")
+            self._sources = (None, None)
+            self._fingerprint = None
+            return self._inline(text, policy, resolved)
+        if message_key is not None:
+            cache.messages.put(message_key, verdict)
+        logging.debug(f"Pool analysis of {len(text)} characters took {(time.perf_counter() - start) * 1000:.1f} ms")
+        return verdict
+
+    def _job_done(self, loop):
+        """Done callback of a pool job, runs in the executor's thread (or the loop's, for cancelled jobs)."""
+        try:
+            loop.call_soon_threadsafe(self._decrement_pending)
+        except RuntimeError:
+            # The event loop is closed, nobody is counting anymore.
+            pass
+
+    def _decrement_pending(self):
+        self.pending -= 1
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "ready": self._ready, "pending": self.pending, **self.counts}
+
+ANALYSIS_POOL = AnalysisPool() if ANALYSIS_BACKEND == "pool" else None
+
+if __name__ == "__main__":
+    from allowlist import ALLOWLIST
+    import helpers
+
+    channels_data = helpers.load_channels()
+    chat_id = channels_data.channels[0].id if channels_data and channels_data.channels else "-1"
+    policy = POLICIES.get(chat_id, channels_data, ALLOWLIST.matcher)
+    pool = AnalysisPool(workers=2, max_pending=64)
+    words = ["see", "the", "answer", "is", "3.14", "e.g.", "page", "no.", "why", "ok", "sir", "integral"]
+    filler = " ".join(words[(j * 7) % len(words)] for j in range(1500))
+    texts = [f"{filler} sciastra.com/courses www.youtube.com/watch?v=67qgPFxt0QA n{i}" for i in range(20)]
+    texts[7] += " evil-spam.xyz/free"
+
+    async def demo():
+        await pool.contains_prohibited_url(texts[0], policy, None, channels_data, ALLOWLIST.matcher)
+        while not pool._ready:
+            await asyncio.sleep(0.05)
+        start = time.perf_counter()
+        verdicts = await asyncio.gather(*(pool.contains_prohibited_url(text, policy, None, channels_data, ALLOWLIST.matcher)
+                                          for text in texts))
+        elapsed = time.perf_counter() - start
+        expected = [url_checker.contains_prohibited_url(text, exempt_patterns=policy.matcher) for text in texts]
+        print(f"{len(texts)} messages of ~{len(texts[0])} characters in {elapsed * 1000:.1f} ms, "
+              f"same verdicts as inline: {verdicts == expected}, prohibited: {[i for i, v in enumerate(verdicts) if v]}")
+        print(pool.stats())
+        pool.shutdown()
+
+    asyncio.run(demo())
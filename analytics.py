@@ -0,0 +1,197 @@
+import os
+import csv
+import json
+import logging
+import datetime
+import tempfile
+import threading
+from collections import defaultdict
+
+from shared_state import file_lock
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# handle_message appends one JSON line per event to EVENTS_FILE, the aggregator reads it incrementally.
+ANALYTICS_ENABLED = getattr(_config, "ANALYTICS_ENABLED", True)
+EVENTS_FILE = getattr(_config, "ANALYTICS_EVENTS_FILE", "events.jsonl")
+STATE_FILE = getattr(_config, "ANALYTICS_STATE_FILE", "analytics_state.json")
+
+EVENT_TYPES = ("message", "deleted", "warned", "flood", "doubt", "timing", "query")
+
+_events_file = None
+_events_lock = threading.Lock()
+
+def emit_event(event: str, chat_id, user_id=None, mentors=None):
+    """
+    Appends an event to EVENTS_FILE. mentors is the list of mentor handles a doubt was routed to.
+    Never raises, analytics must not break moderation.
+    """
+    global _events_file
+    if not ANALYTICS_ENABLED:
+        return
+    record = {"ts": datetime.datetime.now().isoformat(timespec="seconds"), "event": event,
+              "chat_id": str(chat_id), "user_id": user_id}
+    if mentors:
+        record["mentors"] = list(mentors)
+    try:
+        with _events_lock:
+            if _events_file is None:
+                _events_file = open(EVENTS_FILE, "a", encoding="utf-8", buffering=1)
+            _events_file.write(json.dumps(record) + "\n")
+    except Exception as e:
+        logging.error(f"Failed to write analytics event: {e}")
+
+def bucket(hour: str, period: str) -> str:
+    """Rolls an 'YYYY-MM-DDTHH' hour up to 'hour', 'day', 'week' (ISO, e.g. 2025-W07) or 'month'."""
+    if period == "hour":
+        return hour
+    if period == "day":
+        return hour[:10]
+    if period == "month":
+        return hour[:7]
+    year, week, _ = datetime.date.fromisoformat(hour[:10]).isocalendar()
+    return f"{year}-W{week:02d}"
+
+class EventAggregator:
+    """
+    Pre-aggregated counters keyed by (hour, chat_id, mentor, event), mentor is "" for the totals.
+    update() only reads the bytes appended to EVENTS_FILE since the last checkpoint and then
+    saves the counters together with the new byte offset, so reports never rescan old events.
+    """
+
+    def __init__(self, events_file=EVENTS_FILE, state_file=STATE_FILE):
+        self.events_file = events_file
+        self.state_file = state_file
+        self.offset = 0
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+        self._state_mtime = None
+        self._load_state()
+
+    def _load_state(self):
+        try:
+            self._state_mtime = os.stat(self.state_file).st_mtime_ns
+            with open(self.state_file) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.offset = state.get("offset", 0)
+        self.counters = defaultdict(int)
+        for hour, chat_id, mentor, event, count in state.get("counters", []):
+            self.counters[(hour, chat_id, mentor, event)] = count
+
+    def _save_state(self):
+        state = {"offset": self.offset, "counters": [[*key, count] for key, count in sorted(self.counters.items())]}
+        tmp_path = self.state_file + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_file)
+        self._state_mtime = os.stat(self.state_file).st_mtime_ns
+
+    def _add(self, record: dict):
+        hour = record["ts"][:13]
+        chat_id = record.get("chat_id", "")
+        event = record.get("event", "")
+        # mentor "" holds the totals, events routed to mentors are also counted once per mentor.
+        self.counters[(hour, chat_id, "", event)] += 1
+        for mentor in record.get("mentors") or []:
+            self.counters[(hour, chat_id, mentor, event)] += 1
+
+    def update(self) -> int:
+        """Reads new events and checkpoints. Returns the number of events read."""
+        # The checkpoint is shared by all bot workers, start from another worker's newer one.
+        with self._lock, file_lock("analytics"):
+            try:
+                if os.stat(self.state_file).st_mtime_ns != self._state_mtime:
+                    self._load_state()
+            except OSError:
+                pass
+            try:
+                size = os.path.getsize(self.events_file)
+            except OSError:
+                return 0
+            if size < self.offset:
+                # The events file was rotated or truncated, start from its beginning.
+                self.offset = 0
+            if size == self.offset:
+                return 0
+            read = 0
+            with open(self.events_file, "rb") as f:
+                f.seek(self.offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # half written line, read it next time
+                    self.offset += len(line)
+                    try:
+                        self._add(json.loads(line))
+                        read += 1
+                    except (ValueError, KeyError):
+                        continue
+            self._save_state()
+            return read
+
+    def rows(self, period="hour", chat_id=None, since=None):
+        """Yields (bucket, chat_id, mentor, event, count) rolled up to period, sorted by bucket."""
+        rolled = defaultdict(int)
+        for (hour, chat, mentor, event), count in self.counters.items():
+            if chat_id is not None and chat != str(chat_id):
+                continue
+            if since is not None and hour < since:
+                continue
+            rolled[(bucket(hour, period), chat, mentor, event)] += count
+        for key in sorted(rolled):
+            yield (*key, rolled[key])
+
+    def summary(self, period="week", chat_id=None) -> str:
+        self.update()
+        current = bucket(datetime.datetime.now().strftime("%Y-%m-%dT%H"), period)
+        events = defaultdict(int)
+        doubts_per_mentor = defaultdict(int)
+        for period_bucket, _, mentor, event, count in self.rows(period, chat_id):
+            if period_bucket != current:
+                continue
+            if not mentor:
+                events[event] += count
+            elif event == "doubt":
+                doubts_per_mentor[mentor] += count
+        scope = f"chat {chat_id}" if chat_id is not None else "all chats"
+        response = f"Stats for {period} {current} ({scope}):\n"
+        for event in EVENT_TYPES:
+            if events.get(event):
+                response += f" - {event}: {events[event]}\n"
+        if doubts_per_mentor:
+            response += "Doubts per mentor:\n"
+            for mentor, count in sorted(doubts_per_mentor.items(), key=lambda item: -item[1]):
+                response += f" - {mentor}: {count}\n"
+        if not events and not doubts_per_mentor:
+            response += "No events recorded.\n"
+        return response
+
+    def export(self, period="day", file_format="csv", chat_id=None) -> str:
+        """Writes the rolled up counters to a temporary file and returns its path, the caller deletes it."""
+        self.update()
+        columns = [period, "chat_id", "mentor", "event", "count"]
+        if file_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        fd, path = tempfile.mkstemp(prefix=f"stats_{period}_", suffix=f".{file_format}")
+        os.close(fd)
+        try:
+            if file_format == "parquet":
+                rows = list(self.rows(period, chat_id))
+                table = pa.table({column: [row[i] for row in rows] for i, column in enumerate(columns)})
+                pq.write_table(table, path)
+            else:
+                with open(path, "w", newline="", encoding="utf-8") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(columns)
+                    writer.writerows(self.rows(period, chat_id))
+        except BaseException:
+            os.remove(path)
+            raise
+        return path
+
+ANALYTICS = EventAggregator()
@@ -0,0 +1,202 @@
+"""
+Benchmarks for the moderation and scheduling hot paths.
+
+    python benchmark.py                                 # run everything, write bench_results.json
+    python benchmark.py --out new.json --compare old.json --threshold 0.25
+
+With --compare every case that got slower than (1 + threshold) times the old
+median is reported as a regression and the exit code is 1.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import datetime
+import tempfile
+import statistics
+
+import helpers
+import models
+import query_log
+import shared_state
+from url_checker import contains_prohibited_url, AllowMatcher, VerdictCache
+from allowlist import load_allowed_urls
+
+random.seed(1234)
+
+WORDS = ["the", "doubt", "integral", "please", "explain", "why", "is", "this", "answer", "wrong", "sir",
+         "physics", "iiser", "exam", "kvpy", "3.14", "e.g.", "page", "no.", "ok"]
+SAMPLE_URLS = ["sciastra.com/courses", "https://www.youtube.com/watch?v=67qgPFxt0QA", "t.me/+GS7bI6CYIU5jYWU9",
+               "evil-spam.xyz/free", "bit.ly/abc123", "www.google.com/search?q=x"]
+
+def measure(func, min_time=0.2, repeat=5):
+    """Returns per call timings in microseconds (median and min of `repeat` rounds)."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat or number >= 1 << 20:
+            break
+        number *= 2
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number * 1e6)
+    return {"median_us": statistics.median(rounds), "min_us": min(rounds), "calls_per_round": number}
+
+def make_message(size: int, urls_per_100_chars: float) -> str:
+    words = []
+    length = 0
+    while length < size:
+        if random.random() < urls_per_100_chars / 100 * 6:
+            word = random.choice(SAMPLE_URLS)
+        else:
+            word = random.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+def make_channel(slots: int) -> dict:
+    timings = []
+    for i in range(slots):
+        start = (i * 37) % (24 * 60)
+        end = (start + 90) % (24 * 60)
+        time_str = f"{(start // 60) % 12 or 12}:{start % 60:02d} {'AM' if start < 720 else 'PM'} - " \
+                   f"{(end // 60) % 12 or 12}:{end % 60:02d} {'AM' if end < 720 else 'PM'}"
+        timings.append({"time": time_str, "name": f"Mentor {i}", "user_id": f"@mentor{i}"})
+    return {"id": "-100", "name": "bench", "subject": "bench", "timings": timings}
+
+def bench_url_checker(results, quick, work_dir):
+    matcher = AllowMatcher(load_allowed_urls())
+    sizes = (100, 1000, 4096)
+    densities = (0, 1, 5)
+    for size in sizes:
+        for density in densities:
+            texts = [make_message(size, density) for _ in range(20)]
+            it = iter(range(1 << 62))
+            results[f"contains_prohibited_url/size={size}/urls_per_100={density}"] = measure(
+                lambda: contains_prohibited_url(texts[next(it) % 20], exempt_patterns=matcher))
+            cache = VerdictCache()
+            results[f"contains_prohibited_url_cached/size={size}/urls_per_100={density}"] = measure(
+                lambda: contains_prohibited_url(texts[next(it) % 20], exempt_patterns=matcher, cache=cache))
+
+    text = make_message(500, 2)
+    for allowlist_size in (10, 100, 1000) if quick else (10, 100, 1000, 10000):
+        patterns = [f"site{i}.example.com/path{i}" for i in range(allowlist_size)]
+        results[f"allowlist_compile/size={allowlist_size}"] = measure(lambda: AllowMatcher(patterns), repeat=3)
+        matcher = AllowMatcher(patterns)
+        results[f"contains_prohibited_url/allowlist={allowlist_size}"] = measure(
+            lambda: contains_prohibited_url(text, exempt_patterns=matcher))
+
+    worst_cases = {"dotted": "a." * 2048, "no_spaces": "a" * 4096, "brackets": "[ " * 2048}
+    for name, text in worst_cases.items():
+        results[f"contains_prohibited_url/worst_case={name}"] = measure(
+            lambda: contains_prohibited_url(text, exempt_patterns=matcher))
+
+def bench_schedules(results, quick, work_dir):
+    now = datetime.datetime(2025, 12, 22, 15, 7)
+    for slots in (1, 10, 100) if quick else (1, 10, 100, 1000):
+        channel = models.Channel.from_dict(make_channel(slots))
+        results[f"get_active_incharges/slots={slots}"] = measure(lambda: helpers.get_active_incharges(channel, now))
+        results[f"get_next_incharges/slots={slots}"] = measure(lambda: helpers.get_next_incharges(channel, now))
+
+def bench_load_channels(results, quick, work_dir):
+    for channels in (1, 50) if quick else (1, 50, 500):
+        path = os.path.join(work_dir, f"channels_{channels}.json")
+        data = {"channels": [dict(make_channel(5), id=str(-1000 - i)) for i in range(channels)]}
+        with open(path, "w") as f:
+            json.dump(data, f, indent=4)
+        results[f"load_channels/channels={channels}"] = measure(lambda: helpers.load_channels(path))
+
+def bench_query_log(results, quick, work_dir):
+    # Ids come from a sequence in the shared state, so the run gets its own database instead of
+    # bumping the bot's. Only the first id of a day looks at the CSV, its size doesn't matter.
+    old = query_log.QUERIES_DIR, query_log.SHARED_STATE, shared_state.LOCKS_DIR
+    try:
+        query_log.QUERIES_DIR = os.path.join(work_dir, "queries")
+        query_log.SHARED_STATE = shared_state.SharedState(os.path.join(work_dir, "shared_state.sqlite3"))
+        shared_state.LOCKS_DIR = os.path.join(work_dir, "locks")
+        results["generate_query_id"] = measure(lambda: query_log.generate_query_id(42, "20250101"), repeat=3)
+        counter = iter(range(1 << 62))
+        results["log_query_to_csv"] = measure(
+            lambda: query_log.log_query_to_csv(f"new{next(counter)}", 42, "user", "20250101", "10:00:00",
+                                               -100, "bench", "#query text"), repeat=3)
+    finally:
+        query_log.QUERIES_DIR, query_log.SHARED_STATE, shared_state.LOCKS_DIR = old
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    regressions = []
+    for name, result in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        ratio = result["median_us"] / old["median_us"] if old["median_us"] else 1.0
+        marker = ""
+        if ratio > 1 + threshold:
+            marker = "  <-- REGRESSION"
+            regressions.append(name)
+        print(f"{name:70s} {old['median_us']:12.2f} -> {result['median_us']:12.2f} us  x{ratio:.2f}{marker}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the moderation and scheduling hot paths.")
+    parser.add_argument("--out", default="bench_results.json", help="where to write the results")
+    parser.add_argument("--compare", help="results file of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown before a case counts as a regression (0.25 = 25%%)")
+    parser.add_argument("--quick", action="store_true", help="skip the largest sizes")
+    parser.add_argument("--only", help="only run cases whose group name contains this string")
+    args = parser.parse_args()
+
+    groups = {
+        "url_checker": bench_url_checker,
+        "schedules": bench_schedules,
+        "load_channels": bench_load_channels,
+        "query_log": bench_query_log,
+    }
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix="bot_bench_")
+    try:
+        for group, bench in groups.items():
+            if args.only and args.only not in group:
+                continue
+            print(f"Running {group} benchmarks...")
+            bench(results, args.quick, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for name, result in sorted(results.items()):
+        print(f"{name:70s} {result['median_us']:12.2f} us")
+
+    output = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        print(f"\nComparison with {args.compare} (threshold {args.threshold:.0%}):")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) found.")
+            sys.exit(1)
+        print("No regressions.")
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,44 @@
+import os
 import json
 import logging
+from contextlib import contextmanager
 import helpers
 import updater
-import gspread
-from google.oauth2.service_account import Credentials
+import flood_control
+import url_checker
+import allowlist
+import shortener
+import analysis_pool
+import edit_memo
+import policy
+import analytics
+import models
+import snapshots
+import schedule
+import sheets_mirror
+import query_export
+import doubt_router
 
-def load_channels_data():
-    try:
-        with open(helpers.get_latest_file(), "r") as f:
-            data = json.load(f)
-            if "channels" not in data:
-                data["channels"] = []
-    except Exception:
-        data = {"channels": []}
-    return data
-
-def save_channels_data(data):
-    with open(helpers.get_latest_file(), "w") as f:
-        json.dump(data, f, indent=4)
+def load_channels_data() -> models.ChannelsData:
+    # An invalid file raises instead of being treated as empty, so the next save can't wipe it.
+    file_path = helpers.get_latest_file()
+    if file_path is None or not os.path.exists(file_path):
+        return models.ChannelsData()
+    with open(file_path, "r") as f:
+        return models.ChannelsData.from_dict(json.load(f))
+
+def save_channels_data(data: models.ChannelsData):
+    # Writes a new version and moves slots_info/CURRENT to it, the previous version stays for /rollbackVersion.
+    snapshots.SNAPSHOTS.save(data.to_dict())
+
+@contextmanager
+def editing_channels_data():
+    """
+    Loads the groups data for a command that changes and saves it. Other bot workers can't save
+    until the with block ends, so Google Sheets calls belong after it.
+    """
+    with snapshots.SNAPSHOTS.lock:
+        yield load_channels_data()
 
 # Existing command: /updateChannels
 def handle_update_channels(args: list, chat_id) -> str:
@@ -38,40 +59,28 @@ def handle_update_channels(args: list, chat_id) -> str:
     timings_str = args[2].strip()
 
     try:
-        timings = json.loads(timings_str)
-        if not isinstance(timings, list):
-            return "Error: Timings must be provided as a JSON array."
-        for item in timings:
-            if not all(key in item for key in ("time", "name", "user_id")):
-                return "Error: Each timing must contain 'time', 'name', and 'user_id' keys."
+        timings = models.parse_timings(json.loads(timings_str))
+    except ValueError as e:
+        return f"Error: {str(e)}"
     except Exception as e:
         return f"Error parsing timings JSON: {str(e)}"
     
-    channel_dict = {
-        "id": chat_id,
-        "name": channel_name,
-        "subject": subject,
-        "timings": timings
-    }
-    
-    data = load_channels_data()
-    channel_found = False
-    for idx, channel in enumerate(data["channels"]):
-        if str(channel.get("id")) == str(chat_id):
-            # Update the existing channel.
-            data["channels"][idx] = channel_dict
-            channel_found = True
-            break
-
-    if not channel_found:
-        data["channels"].append(channel_dict)
-    
     try:
-        save_channels_data(data)
+        with editing_channels_data() as data:
+            channel = data.get(chat_id)
+            channel_found = channel is not None
+            if channel_found:
+                # Update the existing channel, its policy is kept.
+                channel.name = channel_name
+                channel.subject = subject
+                channel.timings = timings
+            else:
+                data.add(models.Channel(chat_id, channel_name, subject, timings))
+            save_channels_data(data)
         status_msg = "Channel updated successfully." if channel_found else "Channel added successfully."
         timings_msg = "New Doubt Timings:\n"
         for timing in timings:
-            timings_msg += f" - {timing.get('time')}: {timing.get('name')} ({timing.get('user_id')})\n"
+            timings_msg += f" - {timing.time}: {timing.name} ({timing.user_id})\n"
         
         return f"{status_msg}\nChannel Name: {channel_name}\nSubject: {subject}\n{timings_msg}"
     except Exception as e:
@@ -81,11 +90,11 @@ def handle_update_channels(args: list, chat_id) -> str:
 # New command: /getGroupsList
 def handle_get_groups_list() -> str:
     data = load_channels_data()
-    if not data["channels"]:
+    if not data.channels:
         return "No groups found."
     response = "Groups List:\n"
-    for group in data["channels"]:
-        response += f" - ID: {group.get('id')}, Name: {group.get('name')}, Subject: {group.get('subject')}\n"
+    for group in data.channels:
+        response += f" - ID: {group.id}, Name: {group.name}, Subject: {group.subject}\n"
     return response
 
 # New command: /replaceGroupTimings GROUP_ID {new timings in JSON format}
@@ -95,27 +104,24 @@ def handle_replace_group_timings(args: list) -> str:
     group_id = args[0].strip()
     timings_str = args[1].strip()
     try:
-        new_timings = json.loads(timings_str)
-        if not isinstance(new_timings, list):
-            return "Error: Timings must be a JSON array."
-        for timing in new_timings:
-            if not all(key in timing for key in ("time", "name", "user_id")):
-                return "Error: Each timing must contain 'time', 'name', and 'user_id' keys."
+        new_timings = models.parse_timings(json.loads(timings_str))
+    except ValueError as e:
+        return f"Error: {str(e)}"
     except Exception as e:
         return f"Error parsing timings JSON: {str(e)}"
     
-    data = load_channels_data()
-    group_to_update = None
-    for group in data["channels"]:
-        if str(group.get("id")) == group_id:
-            group["timings"] = new_timings
-            group_to_update = group
-            break
-    if group_to_update is None:
-        return f"Group with ID {group_id} not found."
+    with editing_channels_data() as data:
+        group_to_update = data.get(group_id)
+        if group_to_update is None:
+            return f"Group with ID {group_id} not found."
+        group_to_update.timings = new_timings
+        try:
+            save_channels_data(data)
+        except Exception as e:
+            logging.error("Failed to save timings in replaceGroupTimings: %s", e)
+            return f"Failed to replace timings: {str(e)}"
     
     try:
-        save_channels_data(data)
         # --- Update Google Sheets for this group ---
         import gspread
         from google.oauth2.service_account import Credentials
@@ -127,12 +133,12 @@ def handle_replace_group_timings(args: list) -> str:
         workbook = client.open_by_key(sheet_id)
         
         # Determine the order of this group among those with the same subject.
-        subject = group_to_update.get("subject", "Unknown")
-        same_subject_groups = [g for g in data["channels"] if g.get("subject", "Unknown").lower() == subject.lower()]
+        subject = group_to_update.subject or "Unknown"
+        same_subject_groups = data.by_subject(subject)
         index_within_subject = same_subject_groups.index(group_to_update)
         # Calculate the starting column (e.g., each group occupies 4 columns, with an extra column gap if needed)
         start_col = updater.num_to_col((index_within_subject * 5) + 1)
-        channel_info = [[group_to_update.get("name"), group_to_update.get("id")]]
+        channel_info = [[group_to_update.name, group_to_update.id]]
         
         import helpers
         timings_list = helpers.convert_group_timings_from_json_to_list(group_to_update)
@@ -168,22 +174,21 @@ def handle_copy_group_timings(args: list) -> str:
     target_id = args[0].strip()
     source_id = args[1].strip()
     
-    data = load_channels_data()
-    source_group = None
-    target_group = None
-    for group in data["channels"]:
-        if str(group.get("id")) == source_id:
-            source_group = group
-        if str(group.get("id")) == target_id:
-            target_group = group
-    if source_group is None:
-        return f"Source group with ID {source_id} not found."
-    if target_group is None:
-        return f"Target group with ID {target_id} not found."
-    
-    target_group["timings"] = source_group.get("timings", [])
+    with editing_channels_data() as data:
+        source_group = data.get(source_id)
+        target_group = data.get(target_id)
+        if source_group is None:
+            return f"Source group with ID {source_id} not found."
+        if target_group is None:
+            return f"Target group with ID {target_id} not found."
+        
+        target_group.timings = [models.Slot.from_dict(slot.to_dict()) for slot in source_group.timings]
+        try:
+            save_channels_data(data)
+        except Exception as e:
+            logging.error("Failed to save timings in copyGroupTimings: %s", e)
+            return f"Failed to copy timings: {str(e)}"
     try:
-        save_channels_data(data)
         # --- Update Google Sheets for the target group ---
         import gspread
         from google.oauth2.service_account import Credentials
@@ -194,11 +199,11 @@ def handle_copy_group_timings(args: list) -> str:
         from config import google_sheet_id as sheet_id
         workbook = client.open_by_key(sheet_id)
         
-        subject = target_group.get("subject", "Unknown")
-        same_subject_groups = [g for g in data["channels"] if g.get("subject", "Unknown").lower() == subject.lower()]
+        subject = target_group.subject or "Unknown"
+        same_subject_groups = data.by_subject(subject)
         index_within_subject = same_subject_groups.index(target_group)
         start_col = updater.num_to_col((index_within_subject * 5) + 1)
-        channel_info = [[target_group.get("name"), target_group.get("id")]]
+        channel_info = [[target_group.name, target_group.id]]
         
         import helpers
         timings_list = helpers.convert_group_timings_from_json_to_list(target_group)
@@ -227,14 +232,14 @@ def handle_copy_group_timings(args: list) -> str:
 # New command: /getAllGroupsTimings
 def handle_get_all_groups_timings() -> str:
     data = load_channels_data()
-    if not data["channels"]:
+    if not data.channels:
         return "No groups found."
     response = "All Groups Timings:\n"
-    for group in data["channels"]:
-        response += f"Group ID: {group.get('id')}\nName: {group.get('name')}\nSubject: {group.get('subject')}\nTimings:\n"
-        if "timings" in group and group["timings"]:
-            for timing in group["timings"]:
-                response += f"  - {timing.get('time')}: {timing.get('name')} ({timing.get('user_id')})\n"
+    for group in data.channels:
+        response += f"Group ID: {group.id}\nName: {group.name}\nSubject: {group.subject}\nTimings:\n"
+        if group.timings:
+            for timing in group.timings:
+                response += f"  - {timing.time}: {timing.name} ({timing.user_id})\n"
         else:
             response += "  No timings available.\n"
         response += "\n"
@@ -245,17 +250,23 @@ def handle_get_group_timings(args: list) -> str:
     if len(args) != 1:
         return "Usage: /getGroupTimings GROUP_ID"
     group_id = args[0].strip()
-    data = load_channels_data()
-    for group in data["channels"]:
-        if str(group.get("id")) == group_id:
-            response = f"Timings for Group ID {group_id}:\n"
-            if "timings" in group and group["timings"]:
-                for timing in group["timings"]:
-                    response += f" - {timing.get('time')}: {timing.get('name')} ({timing.get('user_id')})\n"
-            else:
-                response += "No timings available."
-            return response
-    return f"Group with ID {group_id} not found."
+    group = load_channels_data().get(group_id)
+    if group is None:
+        return f"Group with ID {group_id} not found."
+    response = f"Timings for Group ID {group_id}:\n"
+    if group.timings:
+        for timing in group.timings:
+            days = f" [{timing.days_label}]" if timing.days_label else ""
+            response += f" - {timing.time}{days}: {timing.name} ({timing.user_id})\n"
+    else:
+        response += "No timings available."
+    if group.timezone:
+        response += f"\nTimezone: {group.timezone}"
+    for override in group.overrides or []:
+        period = str(override.first) if override.first == override.last else f"{override.first} to {override.last}"
+        slots = ", ".join(f"{timing.time}: {timing.name}" for timing in override.timings) or "no timings"
+        response += f"\nOverride {period}: {slots}"
+    return response
 
 # New command: /getAllSubjectTimings SUBJECT
 def handle_get_all_subject_timings(args: list) -> str:
@@ -263,15 +274,15 @@ def handle_get_all_subject_timings(args: list) -> str:
         return "Usage: /getAllSubjectTimings SUBJECT"
     subject = args[0].strip()
     data = load_channels_data()
-    matching_groups = [group for group in data["channels"] if group.get("subject", "").lower() == subject.lower()]
+    matching_groups = data.by_subject(subject)
     if not matching_groups:
         return f"No groups found for subject '{subject}'."
     response = f"Groups for subject '{subject}':\n"
     for group in matching_groups:
-        response += f"Group ID: {group.get('id')}\nName: {group.get('name')}\nTimings:\n"
-        if "timings" in group and group["timings"]:
-            for timing in group["timings"]:
-                response += f"  - {timing.get('time')}: {timing.get('name')} ({timing.get('user_id')})\n"
+        response += f"Group ID: {group.id}\nName: {group.name}\nTimings:\n"
+        if group.timings:
+            for timing in group.timings:
+                response += f"  - {timing.time}: {timing.name} ({timing.user_id})\n"
         else:
             response += "  No timings available.\n"
         response += "\n"
@@ -283,22 +294,20 @@ def handle_add_group_to_list(args: list, chat_id) -> str:
         return "Usage: /addGroupToList SUBJECT GROUP_NAME"
     subject = args[0].strip()
     name = args[1].strip()
-    data = load_channels_data()
-    group_found = False
-    group_updated = None
-    for group in data["channels"]:
-        if str(group.get("id")) == str(chat_id):
-            group["subject"] = subject
-            group_found = True
-            group_updated = group
-            break
-    if not group_found:
-        # If group not found, add a new group with the given name.
-        new_group = {"id": chat_id, "name": name, "subject": subject, "timings": []}
-        data["channels"].append(new_group)
-        group_updated = new_group
+    with editing_channels_data() as data:
+        group_updated = data.get(chat_id)
+        if group_updated is not None:
+            group_updated.subject = subject
+        else:
+            # If group not found, add a new group with the given name.
+            group_updated = models.Channel(chat_id, name, subject)
+            data.add(group_updated)
+        try:
+            save_channels_data(data)
+        except Exception as e:
+            logging.error("Failed to save group in addGroupToList: %s", e)
+            return f"Failed to update group: {str(e)}"
     try:
-        save_channels_data(data)
         # --- Update Google Sheets for this group ---
         import gspread
         from google.oauth2.service_account import Credentials
@@ -308,11 +317,11 @@ def handle_add_group_to_list(args: list, chat_id) -> str:
         from config import google_sheet_id as sheet_id
         workbook = client.open_by_key(sheet_id)
         
-        subject = group_updated.get("subject", "Unknown")
-        same_subject_groups = [g for g in data["channels"] if g.get("subject", "Unknown").lower() == subject.lower()]
+        subject = group_updated.subject or "Unknown"
+        same_subject_groups = data.by_subject(subject)
         index_within_subject = same_subject_groups.index(group_updated)
         start_col = updater.num_to_col((index_within_subject * 5) + 1)
-        channel_info = [[group_updated.get("name"), group_updated.get("id")]]
+        channel_info = [[group_updated.name, group_updated.id]]
         timings_list = helpers.convert_group_timings_from_json_to_list(group_updated)
         updater.create_table(workbook, subject, start_row=1, start_col=start_col, channel_info=channel_info, values=timings_list)
         
@@ -325,8 +334,11 @@ def handle_add_group_to_list(args: list, chat_id) -> str:
 # This command reads the groups data and updates (recreates) the Google Sheet accordingly.
 def handle_recreate_sheets() -> str:
     data = load_channels_data()
-    if not data["channels"]:
+    if not data.channels:
         return "No groups available to recreate sheets."
+    # Sheets libraries are imported on first use, most runs never need them.
+    import gspread
+    from google.oauth2.service_account import Credentials
     scopes = ["https://www.googleapis.com/auth/spreadsheets"]
     creds = Credentials.from_service_account_file("api_key.json", scopes=scopes)
     client = gspread.authorize(creds)
@@ -335,19 +347,39 @@ def handle_recreate_sheets() -> str:
     workbook = client.open_by_key(sheet_id)
     # We use a counter per subject to calculate the starting column.
     subject_counter = {}
-    for group in data["channels"]:
-        subject = group.get("subject", "Unknown")
+    for group in data.channels:
+        subject = group.subject or "Unknown"
         if subject not in subject_counter:
             subject_counter[subject] = 0
         start_col = updater.num_to_col((subject_counter[subject] * 5) + 1)
         # Prepare channel info without nested double-quote issues.
-        channel_info = [[group.get("name"), group.get("id")]]
+        channel_info = [[group.name, group.id]]
         timings_list = helpers.convert_group_timings_from_json_to_list(group)
         updater.create_table(workbook, subject, start_row=1, start_col=start_col, channel_info=channel_info, values=timings_list, force_clear=True)
         subject_counter[subject] += 1
 
     return "Google Sheets have been recreated with the current groups data."
 
+# New command: /diffSheets
+def handle_diff_sheets() -> str:
+    data = load_channels_data()
+    try:
+        import gspread
+        from google.oauth2.service_account import Credentials
+        scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive.metadata.readonly"]
+        creds = Credentials.from_service_account_file("api_key.json", scopes=scopes)
+        client = gspread.authorize(creds)
+        from config import google_sheet_id as sheet_id
+        workbook = client.open_by_key(sheet_id)
+        mirror = sheets_mirror.SHEETS_MIRROR
+        mirror.sync(workbook, [group.subject for group in data.channels if group.subject and group.subject != "Unknown"])
+    except Exception as e:
+        return f"Failed to read Google Sheets: {str(e)}"
+    lines = snapshots.diff_channels(data.to_dict(), mirror.channels_from_sheet(data))
+    if not lines:
+        return "Google Sheets match the local data."
+    return "Differences between the local data (-) and Google Sheets (+):\n" + "\n".join(lines)
+
 # New command: /docs COMMAND_NAME
 def handle_docs(args: list) -> str:
     if len(args) != 1:
@@ -362,7 +394,40 @@ def handle_docs(args: list) -> str:
         "/getAllSubjectTimings": "Usage: /getAllSubjectTimings SUBJECT - Returns groups for a subject with their timings.",
         "/addGroupToList": "Usage: /addGroupToList SUBJECT GROUP_NAME - Adds/updates the current group in the local data (without Google Sheet update).",
         "/recreateSheets": "Recreates/updates the Google Sheets for all groups based on local data.",
-        "/updateDatabase": "Updates database of bot based on the data provided in the sheets.",
+        "/updateDatabase": "Updates database of bot based on the data provided in the sheets. Skips the download when the sheets weren't edited since the last update.",
+        "/diffSheets": "Shows how the timings in Google Sheets differ from the bot's data, i.e. what /updateDatabase would change.",
+        "/floodStats": "Shows flood control limits and how many users/messages went over them.",
+        "/cacheStats": "Shows size and hit/miss statistics of the URL and message verdict caches (and of the shortener expansion cache when SHORTENER_EXPANSION is on).",
+        "/analysisStats": "Shows how many messages the URL analysis pool checked, and how many were checked inline instead.",
+        "/doubtStats": ("Shows how doubts are routed (DOUBT_ROUTING: all, least_loaded or round_robin), how many went to one mentor "
+                        "or to everyone, and per mentor the open doubts (older ones count less), assigned and answered doubts."),
+        "/addAllowedUrl": "Usage: /addAllowedUrl URL - Allows URL (and its sub-urls) in all groups, takes effect without a restart.",
+        "/removeAllowedUrl": "Usage: /removeAllowedUrl URL - Removes a URL that was added with /addAllowedUrl.",
+        "/reloadAllowedUrls": "Re-reads all *_allowed_urls.txt files and TLDs.txt. Edited allowlist files are also picked up automatically within a few seconds.",
+        "/setGroupPolicy": ("Usage: /setGroupPolicy GROUP_ID POLICY_JSON - Sets the link policy of a group, e.g. "
+                            "{\"allowed_hosts\": [\"nptel.ac.in\"], \"blocked_hosts\": [\"t.me\"], "
+                            "\"exempt_roles\": [\"creator\", \"administrator\"], \"action\": \"delete|warn|log\"}. "
+                            "All keys are optional, {} restores the default policy."),
+        "/showGroupPolicy": "Usage: /showGroupPolicy GROUP_ID - Shows the link policy of a group.",
+        "/setGroupSchedule": ("Usage: /setGroupSchedule GROUP_ID SCHEDULE_JSON - Sets the timezone and date overrides of a group, e.g. "
+                              "{\"timezone\": \"Asia/Kolkata\", \"overrides\": [{\"from\": \"2025-12-25\", \"to\": \"2025-12-26\", \"timings\": []}]}. "
+                              "Override timings replace the usual ones on those dates, [] means no doubt sessions. "
+                              "Timings can be limited to weekdays with a \"days\" key, e.g. \"days\": [\"mon-fri\"]. {} restores the defaults."),
+        "/listVersions": "Lists the saved versions of the groups data, the current one is marked.",
+        "/diffVersions": "Usage: /diffVersions OLD_VERSION [NEW_VERSION] - Shows which groups, timings and policies changed (NEW_VERSION defaults to the current one).",
+        "/rollbackVersion": "Usage: /rollbackVersion VERSION - Makes a copy of an older version the current one, the rollback can be undone the same way.",
+        "/stats": "Usage: /stats [PERIOD] [GROUP_ID] - Messages, deletions, doubts (per mentor), timings and queries for the current hour/day/week/month.",
+        "/exportQueries": ("Usage: /exportQueries FROM TO [csv|jsonl] [chat=GROUP_ID] [user=USER_ID] - Sends the queries raised "
+                           "from FROM to TO (YYYY-MM-DD) as a gzip compressed file, optionally only those of one group or user. "
+                           "Months older than QUERY_RETENTION_DAYS are read from queries/archive."),
+        "/exportStats": "Usage: /exportStats [PERIOD] [csv|parquet] - Sends event counts per period, chat, mentor and event type as a file.",
+        "/memStart": ("Usage: /memStart [FRAMES] - Starts tracing memory allocations with FRAMES frames each (default PROFILING_TRACE_FRAMES, 1 is the cheapest). "
+                      "Stops by itself after PROFILING_TRACE_SECONDS. Privileged users only."),
+        "/memTop": "Usage: /memTop [N] - Shows the N allocation sites holding the most memory while tracing. Privileged users only.",
+        "/memDiff": "Usage: /memDiff [N] - Shows the N allocation sites that grew most since /memStart or the previous /memDiff. Privileged users only.",
+        "/memStop": "Stops tracing memory allocations. Privileged users only.",
+        "/profileUpdates": ("Usage: /profileUpdates N - Runs the next N messages under cProfile and sends the report as a file, "
+                            "the raw stats stay in profiles/. Privileged users only."),
         "/docs": "Usage: /docs COMMAND_NAME - Provides detailed documentation for a command.",
         "/help": "Shows this help message."
     }
@@ -384,11 +449,320 @@ def handle_help() -> str:
         "7. /addGroupToList SUBJECT GROUP_NAME - Adds/updates current group with the provided subject (local data only).\n"
         "8. /recreateSheets - Recreates/updates the Google Sheets based on current groups.\n"
         "9. /updateDatabase - Updates database of bot based on the data provided in the sheets.\n"
-        "10. /docs COMMAND_NAME - Provides detailed documentation for a command.\n"
-        "11. /help - Shows this help message."
+        "10. /diffSheets - Shows what /updateDatabase would change.\n"
+        "11. /floodStats - Shows flood control statistics.\n"
+        "12. /cacheStats - Shows URL verdict cache statistics.\n"
+        "13. /analysisStats - Shows URL analysis pool statistics.\n"
+        "14. /doubtStats - Shows how doubts were spread over mentors.\n"
+        "15. /addAllowedUrl URL - Allows a URL without restarting the bot.\n"
+        "16. /removeAllowedUrl URL - Removes a URL added with /addAllowedUrl.\n"
+        "17. /reloadAllowedUrls - Re-reads the allowlist files and the TLD list.\n"
+        "18. /setGroupPolicy GROUP_ID POLICY_JSON - Sets the link policy of a group.\n"
+        "19. /showGroupPolicy GROUP_ID - Shows the link policy of a group.\n"
+        "20. /setGroupSchedule GROUP_ID SCHEDULE_JSON - Sets the timezone and date overrides of a group.\n"
+        "21. /stats [PERIOD] [GROUP_ID] - Shows doubt, deletion and query counts.\n"
+        "22. /exportStats [PERIOD] [csv|parquet] - Exports the counts as a file.\n"
+        "23. /exportQueries FROM TO [csv|jsonl] - Exports the queries of a date range as a file.\n"
+        "24. /listVersions - Lists saved versions of the groups data.\n"
+        "25. /diffVersions OLD_VERSION [NEW_VERSION] - Shows what changed between two versions.\n"
+        "26. /rollbackVersion VERSION - Restores an older version.\n"
+        "27. /memStart [FRAMES], /memTop [N], /memDiff [N], /memStop - Traces memory allocations (privileged users).\n"
+        "28. /profileUpdates N - Sends a profile of the next N messages (privileged users).\n"
+        "29. /docs COMMAND_NAME - Provides detailed documentation for a command.\n"
+        "30. /help - Shows this help message."
     )
     return help_text
 
+# New command: /floodStats
+def handle_flood_stats() -> str:
+    stats = flood_control.FLOOD_DETECTOR.stats()
+    return (f"Flood control ({flood_control.FLOOD_MAX_MESSAGES} msgs / {flood_control.FLOOD_WINDOW_SECONDS}s, "
+            f"action: {flood_control.FLOOD_ACTION}):\n"
+            f"Tracked users: {stats['tracked_users']}\n"
+            f"Currently flooding: {stats['flooding_users']}\n"
+            f"Messages over the limit: {stats['flood_messages']}")
+
+# New command: /cacheStats
+def handle_cache_stats() -> str:
+    stats = url_checker.VERDICT_CACHE.stats()
+    response = "URL verdict cache:\n"
+    for name in ("urls", "messages"):
+        cache_stats = stats[name]
+        response += (f" - {name}: {cache_stats['size']}/{cache_stats['max_size']} entries, "
+                     f"{cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                     f"({cache_stats['hit_rate']:.1%} hit rate)\n")
+    response += f"Invalidations: {stats['invalidations']}"
+    memo_stats = edit_memo.EDIT_MEMO.stats()
+    response += (f"\nEdited messages: {memo_stats['edits']} ({memo_stats['edits_without_new_urls']} without new URLs, "
+                 f"{memo_stats['edits_of_unknown_messages']} of messages not remembered), "
+                 f"{memo_stats['remembered']} messages remembered")
+    if shortener.SHORTENER_RESOLVER is not None:
+        shortener_stats = shortener.SHORTENER_RESOLVER.stats()
+        cache_stats = shortener_stats["cache"]
+        response += (f"\nShortener expansions: {cache_stats['size']} cached, {cache_stats['hits']} hits, "
+                     f"{cache_stats['misses']} misses ({cache_stats['hit_rate']:.1%} hit rate), "
+                     f"{shortener_stats['network_requests']} requests, {shortener_stats['coalesced']} coalesced")
+    return response
+
+# New command: /analysisStats
+def handle_analysis_stats() -> str:
+    pool = analysis_pool.ANALYSIS_POOL
+    if pool is None:
+        return "URL analysis runs inline, set ANALYSIS_BACKEND = \"pool\" in config.py to use worker processes."
+    stats = pool.stats()
+    return (f"Analysis pool ({stats['workers']} workers, {'ready' if stats['ready'] else 'starting'}, "
+            f"messages from {pool.min_length} characters or {pool.min_dots} dots):\n"
+            f"Checked in the pool: {stats['pool']}\n"
+            f"Checked inline: {stats['inline']} (short), {stats['warming_up']} (pool starting), {stats['saturated']} (pool busy)\n"
+            f"Timeouts: {stats['timeouts']}\n"
+            f"Pending: {stats['pending']}\n"
+            f"Pool starts: {stats['restarts']}")
+
+# New command: /doubtStats
+def handle_doubt_stats() -> str:
+    stats = doubt_router.DOUBT_ROUTER.stats()
+    if stats["mode"] == "all":
+        return "Every active mentor is tagged on #doubt, set DOUBT_ROUTING = \"least_loaded\" or \"round_robin\" in config.py to spread doubts."
+    average = stats["average_answer_seconds"]
+    response = (f"Doubt routing ({stats['mode']}, open doubts halve every {doubt_router.DOUBT_LOAD_HALF_LIFE}s, "
+                f"busy from {doubt_router.DOUBT_MAX_OPEN}):\n"
+                f"Routed to one mentor: {stats['routed']}\n"
+                f"Everyone tagged (all busy): {stats['tagged_all']}\n"
+                f"Answered by reply: {stats['answered']}"
+                + (f" (after {average / 60:.1f} min on average)" if average is not None else "") + "\n"
+                f"Open: {stats['open']}")
+    for handle, mentor in sorted(stats["mentors"].items(), key=lambda item: -item[1]["assigned"]):
+        response += f"\n - {handle}: {mentor['load']:.1f} open, {mentor['assigned']} assigned, {mentor['answered']} answered"
+    return response
+
+# New command: /addAllowedUrl URL
+def handle_add_allowed_url(args: list) -> str:
+    if len(args) != 1:
+        return "Usage: /addAllowedUrl URL"
+    url = args[0].strip()
+    if not allowlist.add_url(url):
+        return f"'{url}' is already in {allowlist.MANUAL_ALLOWLIST_FILE}."
+    return f"'{url}' added to {allowlist.MANUAL_ALLOWLIST_FILE}."
+
+# New command: /removeAllowedUrl URL
+def handle_remove_allowed_url(args: list) -> str:
+    if len(args) != 1:
+        return "Usage: /removeAllowedUrl URL"
+    url = args[0].strip()
+    if not allowlist.remove_url(url):
+        return (f"'{url}' is not in {allowlist.MANUAL_ALLOWLIST_FILE}. "
+                "URLs from other *_allowed_urls.txt files have to be removed from those files.")
+    return f"'{url}' removed from {allowlist.MANUAL_ALLOWLIST_FILE}."
+
+# New command: /reloadAllowedUrls
+def handle_reload_allowed_urls() -> str:
+    # TLDs first: the analysis pool notices them with the new matcher the forced reload builds, and restarts if they changed.
+    url_checker.reload_tlds()
+    allowlist.ALLOWLIST.reload_if_changed(force=True)
+    return f"Allowlist reloaded with {len(allowlist.ALLOWLIST.matcher)} URLs and {len(url_checker.VALID_TLDS)} TLDs."
+
+# New command: /setGroupPolicy GROUP_ID POLICY_JSON
+def handle_set_group_policy(args: list) -> str:
+    if len(args) != 2:
+        return "Usage: /setGroupPolicy GROUP_ID POLICY_JSON"
+    group_id = args[0].strip()
+    try:
+        new_policy = json.loads(args[1].strip())
+    except Exception as e:
+        return f"Error parsing policy JSON: {str(e)}"
+    error = policy.validate_policy(new_policy)
+    if error:
+        return f"Error: {error}"
+    for key in ("allowed_hosts", "blocked_hosts"):
+        if key in new_policy:
+            new_policy[key] = policy.normalize_hosts(new_policy[key])
+
+    with editing_channels_data() as data:
+        group = data.get(group_id)
+        if group is None:
+            return f"Group with ID {group_id} not found."
+        if new_policy:
+            group.extra["policy"] = new_policy
+        else:
+            group.extra.pop("policy", None)
+        try:
+            save_channels_data(data)
+        except Exception as e:
+            logging.error("Failed to save policy: %s", e)
+            return f"Failed to save policy: {str(e)}"
+    return f"Policy for group {group_id} set to: {json.dumps(new_policy)}"
+
+# New command: /showGroupPolicy GROUP_ID
+def handle_show_group_policy(args: list) -> str:
+    if len(args) != 1:
+        return "Usage: /showGroupPolicy GROUP_ID"
+    group_id = args[0].strip()
+    group = load_channels_data().get(group_id)
+    if group is None:
+        return f"Group with ID {group_id} not found."
+    if not group.policy:
+        return f"Group {group_id} uses the default policy (global allowlist, only members are moderated, action: delete)."
+    return f"Policy for group {group_id}: {json.dumps(group.policy, indent=2)}"
+
+# New command: /setGroupSchedule GROUP_ID SCHEDULE_JSON
+def handle_set_group_schedule(args: list) -> str:
+    if len(args) != 2:
+        return "Usage: /setGroupSchedule GROUP_ID SCHEDULE_JSON"
+    group_id = args[0].strip()
+    try:
+        new_schedule = json.loads(args[1].strip())
+    except Exception as e:
+        return f"Error parsing schedule JSON: {str(e)}"
+    if not isinstance(new_schedule, dict) or set(new_schedule) - {"timezone", "overrides"}:
+        return "Error: The schedule must be a JSON object with optional 'timezone' and 'overrides' keys."
+    try:
+        timezone = new_schedule.get("timezone")
+        if timezone is not None:
+            schedule.get_timezone(timezone)
+        overrides = new_schedule.get("overrides")
+        if overrides is not None:
+            overrides = models.parse_overrides(overrides)
+    except ValueError as e:
+        return f"Error: {str(e)}"
+
+    with editing_channels_data() as data:
+        group = data.get(group_id)
+        if group is None:
+            return f"Group with ID {group_id} not found."
+        group.timezone = timezone
+        group.overrides = overrides or None
+        try:
+            save_channels_data(data)
+        except Exception as e:
+            logging.error("Failed to save schedule: %s", e)
+            return f"Failed to save schedule: {str(e)}"
+    return (f"Schedule for group {group_id} set: timezone {timezone or schedule.SCHEDULE_TIMEZONE}, "
+            f"{len(overrides or [])} override(s).")
+
+# New command: /listVersions
+def handle_list_versions() -> str:
+    store = snapshots.SNAPSHOTS
+    versions = store.versions()
+    if not versions:
+        return "No versions found."
+    current = store.current()
+    response = f"Versions in {store.directory} (newest first, keeping last {store.keep_last} plus one per day for {store.keep_daily} days):\n"
+    for version in reversed(versions):
+        response += f" - {snapshots.describe_version(version)}{'  <- current' if version == current else ''}\n"
+    return response
+
+# New command: /diffVersions OLD_VERSION [NEW_VERSION]
+def handle_diff_versions(args: list) -> str:
+    if len(args) not in (1, 2):
+        return "Usage: /diffVersions OLD_VERSION [NEW_VERSION]"
+    store = snapshots.SNAPSHOTS
+    old_version = args[0].strip()
+    new_version = args[1].strip() if len(args) == 2 else store.current()
+    versions = store.versions()
+    for version in (old_version, new_version):
+        if version not in versions:
+            return f"Version {version} not found, see /listVersions."
+    lines = snapshots.diff_channels(store.load(old_version), store.load(new_version))
+    if not lines:
+        return f"No differences between {old_version} and {new_version}."
+    return f"Changes from {old_version} to {new_version}:\n" + "\n".join(lines)
+
+# New command: /rollbackVersion VERSION
+def handle_rollback_version(args: list) -> str:
+    if len(args) != 1:
+        return "Usage: /rollbackVersion VERSION"
+    version = args[0].strip()
+    if version not in snapshots.SNAPSHOTS.versions():
+        return f"Version {version} not found, see /listVersions."
+    try:
+        models.ChannelsData.from_dict(snapshots.SNAPSHOTS.load(version))
+        new_version = snapshots.SNAPSHOTS.rollback(version)
+    except Exception as e:
+        logging.error("Failed to roll back to %s: %s", version, e)
+        return f"Failed to roll back: {str(e)}"
+    return (f"Rolled back to {version}, saved as new version {new_version}. "
+            "Run /recreateSheets to update the Google Sheet.")
+
+STATS_PERIODS = ("hour", "day", "week", "month")
+
+# New command: /stats [PERIOD] [GROUP_ID]
+def handle_stats(args: list) -> str:
+    if len(args) > 2:
+        return "Usage: /stats [PERIOD] [GROUP_ID]"
+    period = args[0].strip() if args else "week"
+    if period not in STATS_PERIODS:
+        return f"PERIOD must be one of: {', '.join(STATS_PERIODS)}."
+    group_id = args[1].strip() if len(args) == 2 else None
+    return analytics.ANALYTICS.summary(period, group_id)
+
+# New command: /exportStats [PERIOD] [csv|parquet]
+def handle_export_stats(args: list):
+    """Returns (caption, file_path), file_path is None when there is only an error message to send."""
+    if len(args) > 2:
+        return "Usage: /exportStats [PERIOD] [csv|parquet]", None
+    period = args[0].strip() if args else "day"
+    file_format = args[1].strip().lower() if len(args) == 2 else "csv"
+    if period not in STATS_PERIODS:
+        return f"PERIOD must be one of: {', '.join(STATS_PERIODS)}.", None
+    if file_format not in ("csv", "parquet"):
+        return "Format must be csv or parquet.", None
+    try:
+        path = analytics.ANALYTICS.export(period, file_format)
+    except ImportError:
+        return "Parquet export needs pyarrow installed, use csv instead.", None
+    return f"Event counts per {period}, chat, mentor and event type.", path
+
+# Bots can't send documents larger than this.
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+# New command: /exportQueries FROM TO [csv|jsonl] [chat=GROUP_ID] [user=USER_ID]
+def handle_export_queries(args: list):
+    """Returns (caption, file_path), file_path is None when there is only an error message to send."""
+    usage = "Usage: /exportQueries FROM TO [csv|jsonl] [chat=GROUP_ID] [user=USER_ID]"
+    if len(args) < 2:
+        return usage, None
+    file_format, filters = "csv", {}
+    for arg in args[2:]:
+        key, separator, value = arg.strip().partition("=")
+        if separator and key in ("chat", "user") and value.strip():
+            filters[key] = value.strip()
+        elif not separator and arg.strip().lower() in query_export.EXPORT_FORMATS:
+            file_format = arg.strip().lower()
+        else:
+            return usage, None
+    try:
+        start, end = query_export.parse_day(args[0]), query_export.parse_day(args[1])
+    except ValueError as e:
+        return f"Error: {str(e)}", None
+    if end < start:
+        return "FROM must not be after TO.", None
+    path, count = query_export.export_queries(start, end, file_format, filters.get("chat"), filters.get("user"))
+    if os.path.getsize(path) > MAX_DOCUMENT_BYTES:
+        os.remove(path)
+        return f"The export is too large to send ({count} queries), narrow the dates or filter by chat or user.", None
+    return f"{count} queries from {start} to {end}.", path
+
+# Commands that answer with a file. Returns (caption, file_path) or None if message is not one of them.
+# file_path is a temporary file, the caller deletes it once it's sent.
+def handle_document_commands(message: str, chat_id):
+    try:
+        if message.startswith("/exportStats"):
+            parts = message.split("$$$")
+            args = [part.strip() for part in parts if part.strip()]
+            if args and args[0].startswith("/exportStats"):
+                args = args[1:]
+            return handle_export_stats(args)
+        if message.startswith("/exportQueries"):
+            parts = message.split("$$$")
+            args = [part.strip() for part in parts if part.strip()]
+            if args and args[0].startswith("/exportQueries"):
+                args = args[1:]
+            return handle_export_queries(args)
+    except Exception as e:
+        logging.exception("Error handling command: %s", e)
+        return f"An unexpected error occurred: {str(e)}", None
+    return None
+
 # Fallback for unknown commands
 def handle_unknown_command(message: str) -> str:
     return "Unknown command. Please check your input and try again."
@@ -400,6 +774,7 @@ def handle_commands(message: str, chat_id) -> str:
     and returns the response message that the bot should send.
 
     The $$$ delimiter is used to split the message into arguments.
+    Commands that change the groups data hold its lock while they do (see editing_channels_data).
     """
     try:
         if message.startswith("/updateChannels"):
@@ -453,9 +828,86 @@ def handle_commands(message: str, chat_id) -> str:
         elif message.startswith("/recreateSheets"):
             return handle_recreate_sheets()
         
+        elif message.startswith("/diffSheets"):
+            return handle_diff_sheets()
+
         elif message.startswith("/updateDatabase"):
             return handle_update_database()
 
+        elif message.startswith("/floodStats"):
+            return handle_flood_stats()
+
+        elif message.startswith("/analysisStats"):
+            return handle_analysis_stats()
+
+        elif message.startswith("/cacheStats"):
+            return handle_cache_stats()
+
+        elif message.startswith("/doubtStats"):
+            return handle_doubt_stats()
+
+        elif message.startswith("/addAllowedUrl"):
+            parts = message.split("$$$")
+            args = [part.strip() for part in parts if part.strip()]
+            if args and args[0].startswith("/addAllowedUrl"):
+                args = args[1:]
+            return handle_add_allowed_url(args)
+
+        elif message.startswith("/removeAllowedUrl"):
+            parts = message.split("$$$")
+            args = [part.strip() for part in parts if part.strip()]
+            if args and args[0].startswith("/removeAllowedUrl"):
+                args = args[1:]
+            return handle_remove_allowed_url(args)
+
+        elif message.startswith("/reloadAllowedUrls"):
+            return handle_reload_allowed_urls()
+
+        elif message.startswith("/setGroupPolicy"):
+            parts = message.split("$$$")
+            args = [part.strip() for part in parts if part.strip()]
+            if args and args[0].startswith("/setGroupPolicy"):
+                args = args[1:]
+            return handle_set_group_policy(args)
+
+        elif message.startswith("/showGroupPolicy"):
+            parts = message.split("$$$")
+            args = [part.strip() for part in parts if part.strip()]
+            if args and args[0].startswith("/showGroupPolicy"):
+                args = args[1:]
+            return handle_show_group_policy(args)
+
+        elif message.startswith("/setGroupSchedule"):
+            parts = message.split("$$$")
+            args = [part.strip() for part in parts if part.strip()]
+            if args and args[0].startswith("/setGroupSchedule"):
+                args = args[1:]
+            return handle_set_group_schedule(args)
+
+        elif message.startswith("/listVersions"):
+            return handle_list_versions()
+
+        elif message.startswith("/diffVersions"):
+            parts = message.split("$$$")
+            args = [part.strip() for part in parts if part.strip()]
+            if args and args[0].startswith("/diffVersions"):
+                args = args[1:]
+            return handle_diff_versions(args)
+
+        elif message.startswith("/rollbackVersion"):
+            parts = message.split("$$$")
+            args = [part.strip() for part in parts if part.strip()]
+            if args and args[0].startswith("/rollbackVersion"):
+                args = args[1:]
+            return handle_rollback_version(args)
+
+        elif message.startswith("/stats"):
+            parts = message.split("$$$")
+            args = [part.strip() for part in parts if part.strip()]
+            if args and args[0].startswith("/stats"):
+                args = args[1:]
+            return handle_stats(args)
+
         elif message.startswith("/docs"):
             parts = message.split("$$$")
             args = [part.strip() for part in parts if part.strip()]
@@ -478,16 +930,19 @@ def handle_update_database() -> str:
     Only groups that exist in the local JSON are updated;
     groups not present in JSON are ignored.
     
-    For each group in the JSON, its subject is used to open the corresponding sheet,
+    For each group in the JSON, its subject is used to find the corresponding sheet,
     and the group’s block is determined by its ordering (using the same (index*5)+1 formula).
-    The timings table is read from the group's block (data rows starting from row 4)
-    and converted into a list of timing dictionaries.
-    Finally, the JSON is updated with the new timings and the updated data is returned.
+    The worksheets are read through sheets_mirror.SHEETS_MIRROR, which only downloads them
+    when the spreadsheet changed since the last sync. If neither the sheet nor the local JSON
+    changed since then, nothing is parsed or saved.
     """
     data = load_channels_data()
     
     try:
-        scopes = ["https://www.googleapis.com/auth/spreadsheets"]
+        import gspread
+        from google.oauth2.service_account import Credentials
+        # The Drive scope lets the mirror read the spreadsheet's revision, it works without it too.
+        scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive.metadata.readonly"]
         creds = Credentials.from_service_account_file("api_key.json", scopes=scopes)
         client = gspread.authorize(creds)
         from config import google_sheet_id as sheet_id
@@ -495,63 +950,56 @@ def handle_update_database() -> str:
     except Exception as e:
         return f"Failed to access Google Sheets: {str(e)}"
     
-    updated_count = 0
-    for group in data["channels"]:
-        subject = group.get("subject", "Unknown")
-        if subject == "Unknown":
-            continue  # Skip if no proper subject.
-        try:
-            sheet = workbook.worksheet(subject)
-        except Exception:
-            continue
+    mirror = sheets_mirror.SHEETS_MIRROR
+    subjects = [group.subject for group in data.channels if group.subject and group.subject != "Unknown"]
+    try:
+        _, checked_by = mirror.sync(workbook, subjects)
+    except Exception as e:
+        return f"Failed to read Google Sheets: {str(e)}"
+    # The sheets are in the mirror now, only applying them to the groups data needs the lock.
+    with editing_channels_data() as data:
+        current_version = snapshots.SNAPSHOTS.current()
+        if mirror.is_applied(current_version):
+            return f"Google Sheets unchanged since the last update (checked by {checked_by}), nothing to update."
         
-        same_subject_groups = [g for g in data["channels"] if g.get("subject", "").lower() == subject.lower()]
-        try:
-            index_within_subject = same_subject_groups.index(group)
-        except Exception:
-            continue
+        updated_count = 0
+        for group in data.channels:
+            subject = group.subject or "Unknown"
+            if subject == "Unknown":
+                continue  # Skip if no proper subject.
+            
+            same_subject_groups = data.by_subject(subject)
+            try:
+                index_within_subject = same_subject_groups.index(group)
+            except Exception:
+                continue
+            
+            sheet_timings = mirror.timings(subject, index_within_subject)
+            if sheet_timings is None:
+                continue  # No worksheet for this subject.
+            # Unchanged timings keep what the sheet doesn't show, like weekdays.
+            if [(slot.time, slot.name, slot.user_id) for slot in group.timings] == \
+                    [(timing["time"], timing["name"], timing["user_id"]) for timing in sheet_timings]:
+                continue
+            group.timings = [models.Slot.from_dict(timing) for timing in sheet_timings]
+            updated_count += 1
         
-        start_col = updater.num_to_col((index_within_subject * 5) + 1)
-        start_data_row = 4  
-        start_col_idx = updater.col_to_num(start_col)
-        end_col = updater.num_to_col(start_col_idx + 3)
+        if not updated_count:
+            mirror.mark_applied(current_version)
+            return f"Google Sheets match the local data (checked by {checked_by}), nothing to update."
         
-        data_range = f"{start_col}{start_data_row}:{end_col}{sheet.row_count}"
         try:
-            values = sheet.get(data_range)
-        except Exception:
-            values = []
-        
-        new_timings = []
-        for row in values:
-            if len(row) < 4 or row[0].strip() == "":
-                continue
-            from_time = row[0].strip()
-            to_time = row[1].strip()
-            time_range_str = f"{from_time} - {to_time}"
-            mentor_id = row[2].strip()
-            if mentor_id and not mentor_id.startswith("@"):
-                mentor_id = "@" + mentor_id
-            mentor_name = row[3].strip()
-            new_timings.append({
-                "time": time_range_str,
-                "name": mentor_name,
-                "user_id": mentor_id
-            })
-        group["timings"] = new_timings
-        updated_count += 1
-    
-    try:
-        save_channels_data(data)
-    except Exception as e:
-        return f"Failed to save updated JSON: {str(e)}"
+            save_channels_data(data)
+            mirror.mark_applied(snapshots.SNAPSHOTS.current())
+        except Exception as e:
+            return f"Failed to save updated JSON: {str(e)}"
 
     response = f"Database update complete. Timings updated for {updated_count} groups.\n\n"
-    for group in data["channels"]:
-        response += f"Group ID: {group.get('id')}, Name: {group.get('name')}, Subject: {group.get('subject')}\n"
-        if group.get("timings"):
-            for timing in group["timings"]:
-                response += f"    - {timing.get('time')}: {timing.get('name')} ({timing.get('user_id')})\n"
+    for group in data.channels:
+        response += f"Group ID: {group.id}, Name: {group.name}, Subject: {group.subject}\n"
+        if group.timings:
+            for timing in group.timings:
+                response += f"    - {timing.time}: {timing.name} ({timing.user_id})\n"
         else:
             response += "    No timings available.\n"
         response += "\n"
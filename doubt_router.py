@@ -0,0 +1,179 @@
+"""
+Picks which of the active mentors a #doubt is tagged for.
+
+With DOUBT_ROUTING = "all" (the default) every active mentor is tagged, as before. With
+"least_loaded" the doubt goes to the active mentor with the fewest open doubts, with
+"round_robin" the active mentors of a group take turns. A doubt stays open until one of the
+mentors replies to it (or to the bot's message tagging them), and the open doubts of a mentor
+count less and less as they age (DOUBT_LOAD_HALF_LIFE), so doubts answered without a reply
+stop weighing on them. When every active mentor already has DOUBT_MAX_OPEN open doubts,
+everyone is tagged again.
+
+Loads are kept in memory per process, with several workers (update_router.py) each worker
+balances the groups it handles.
+"""
+import time
+from collections import OrderedDict
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+DOUBT_ROUTING = getattr(_config, "DOUBT_ROUTING", "all")
+# Seconds after which an open doubt only counts half.
+DOUBT_LOAD_HALF_LIFE = getattr(_config, "DOUBT_LOAD_HALF_LIFE", 1800)
+# Open doubts (after decay) at which a mentor counts as busy.
+DOUBT_MAX_OPEN = getattr(_config, "DOUBT_MAX_OPEN", 5)
+# Hard cap on the number of open doubts remembered for replies.
+DOUBT_MAX_TRACKED = getattr(_config, "DOUBT_MAX_TRACKED", 10000)
+
+ROUTING_MODES = ("all", "least_loaded", "round_robin")
+
+
+def mentor_key(handle) -> str:
+    return str(handle or "").strip().lstrip("@").lower()
+
+
+class _Mentor:
+    __slots__ = ("load", "updated", "last_assigned", "assigned", "answered")
+
+    def __init__(self):
+        self.load = 0.0
+        self.updated = 0.0
+        self.last_assigned = float("-inf")
+        self.assigned = 0
+        self.answered = 0
+
+
+class DoubtRouter:
+    def __init__(self, mode=DOUBT_ROUTING, half_life=DOUBT_LOAD_HALF_LIFE, max_open=DOUBT_MAX_OPEN,
+                 max_tracked=DOUBT_MAX_TRACKED, clock=time.monotonic):
+        if mode not in ROUTING_MODES:
+            raise ValueError(f"DOUBT_ROUTING must be one of: {', '.join(ROUTING_MODES)}.")
+        self.mode = mode
+        self.half_life = half_life
+        self.max_open = max_open
+        self.max_tracked = max_tracked
+        self.clock = clock
+        self._mentors = {}
+        # (chat_id, message_id) -> (mentor key, assigned at, keys of all messages of the doubt), oldest first
+        self._open = OrderedDict()
+        self._turns = {}
+        self.routed = 0
+        self.tagged_all = 0
+        self.answer_seconds = 0.0
+
+    def _decay(self, mentor: _Mentor, now: float):
+        if mentor.load and self.half_life:
+            mentor.load *= 0.5 ** ((now - mentor.updated) / self.half_life)
+        mentor.updated = now
+
+    def load(self, handle) -> float:
+        """Open doubts of a mentor, each weighted by how recent it is."""
+        mentor = self._mentors.get(mentor_key(handle))
+        if mentor is None:
+            return 0.0
+        self._decay(mentor, self.clock())
+        return mentor.load
+
+    def route(self, chat_id, handles: list) -> list:
+        """The handles to tag for a doubt in chat_id, one of handles or all of them."""
+        if self.mode == "all" or len(handles) < 2:
+            return list(handles)
+        now = self.clock()
+        candidates = []
+        for order, handle in enumerate(handles):
+            key = mentor_key(handle)
+            if not key:
+                continue
+            mentor = self._mentors.get(key)
+            if mentor is None:
+                mentor = self._mentors[key] = _Mentor()
+            self._decay(mentor, now)
+            candidates.append((order, handle, mentor))
+        available = [candidate for candidate in candidates if candidate[2].load < self.max_open]
+        if not available:
+            self.tagged_all += 1
+            return list(handles)
+
+        if self.mode == "round_robin":
+            turn = self._turns.get(chat_id, 0)
+            self._turns[chat_id] = turn + 1
+            _, handle, mentor = available[turn % len(available)]
+        else:
+            # Ties go to whoever got a doubt least recently, then to the order of the timings.
+            _, handle, mentor = min(available, key=lambda c: (round(c[2].load, 6), c[2].last_assigned, c[0]))
+        mentor.load += 1
+        mentor.last_assigned = now
+        mentor.assigned += 1
+        self.routed += 1
+        return [handle]
+
+    def track(self, chat_id, message_ids, handle):
+        """Remembers the messages of a doubt routed to handle, so a reply to any of them answers it."""
+        keys = tuple((chat_id, message_id) for message_id in message_ids if message_id is not None)
+        doubt = (mentor_key(handle), self.clock(), keys)
+        for doubt_key in keys:
+            self._open[doubt_key] = doubt
+        while len(self._open) > self.max_tracked:
+            self._open.popitem(last=False)
+
+    def answered(self, chat_id, message_id, username) -> bool:
+        """Call for replies, closes the doubt replied to if username is a mentor. True if it did."""
+        entry = self._open.get((chat_id, message_id))
+        if entry is None or mentor_key(username) not in self._mentors:
+            return False
+        key, assigned_at, keys = entry
+        for doubt_key in keys:
+            self._open.pop(doubt_key, None)
+        now = self.clock()
+        mentor = self._mentors[key]
+        self._decay(mentor, now)
+        weight = 0.5 ** ((now - assigned_at) / self.half_life) if self.half_life else 1.0
+        mentor.load = max(0.0, mentor.load - weight)
+        mentor.answered += 1
+        self.answer_seconds += now - assigned_at
+        return True
+
+    def stats(self) -> dict:
+        now = self.clock()
+        mentors = {}
+        answered = 0
+        for key, mentor in self._mentors.items():
+            self._decay(mentor, now)
+            answered += mentor.answered
+            mentors["@" + key] = {"load": mentor.load, "assigned": mentor.assigned, "answered": mentor.answered}
+        return {
+            "mode": self.mode,
+            "routed": self.routed,
+            "tagged_all": self.tagged_all,
+            "answered": answered,
+            "average_answer_seconds": self.answer_seconds / answered if answered else None,
+            "open": sum(1 for doubt_key, doubt in self._open.items() if doubt_key == doubt[2][0]),
+            "mentors": mentors,
+        }
+
+
+DOUBT_ROUTER = DoubtRouter()
+
+if __name__ == "__main__":
+    fake_now = [0.0]
+    mentors = ["@het", "@aman", "@riya"]
+    for mode in ("least_loaded", "round_robin"):
+        router = DoubtRouter(mode=mode, half_life=600, max_open=3, clock=lambda: fake_now[0])
+        fake_now[0] = 0.0
+        picks = []
+        for message_id in range(1, 13):
+            fake_now[0] += 30
+            tagged = router.route(-100, mentors)
+            picks.append(" ".join(tagged) if len(tagged) == 1 else "everyone")
+            if len(tagged) == 1:
+                router.track(-100, [message_id], tagged[0])
+            # @het answers everything they get right away.
+            if tagged == ["@het"]:
+                router.answered(-100, message_id, "het")
+        print(f"{mode}: {', '.join(picks)}")
+        print({handle: round(values["load"], 2) for handle, values in router.stats()["mentors"].items()})
+        fake_now[0] += 3600
+        print(f"an hour later: {router.load('@aman'):.2f} open for @aman")
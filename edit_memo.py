@@ -0,0 +1,88 @@
+import time
+from collections import OrderedDict
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Messages whose last version was seen longer ago than this are forgotten, edits to them are checked from scratch.
+EDIT_MEMO_MAX_AGE = getattr(_config, "EDIT_MEMO_MAX_AGE", 48 * 3600)
+# Hard cap on the number of messages remembered.
+EDIT_MEMO_MAX_ENTRIES = getattr(_config, "EDIT_MEMO_MAX_ENTRIES", 20000)
+
+
+class SeenMessage:
+    __slots__ = ("urls", "prohibited", "status", "last_seen")
+
+    def __init__(self, urls, prohibited: bool, status: str, last_seen: float):
+        # URL candidates of the last version, None if the sender is exempt.
+        self.urls = urls
+        self.prohibited = prohibited
+        self.status = status
+        self.last_seen = last_seen
+
+
+class EditMemo:
+    """
+    What the bot last saw of each recent message: its URL candidates, verdict and the sender's
+    member status. Edits only classify URLs that weren't in the previous version and reuse the
+    status instead of asking Telegram again. Entries are kept in least-recently-seen order so
+    old ones can be evicted from the front, like flood_control.FloodDetector's windows.
+    """
+
+    def __init__(self, max_age=EDIT_MEMO_MAX_AGE, max_entries=EDIT_MEMO_MAX_ENTRIES, clock=time.monotonic):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.clock = clock
+        self._seen = OrderedDict()
+        self.edits = 0
+        self.edits_without_new_urls = 0
+        self.edits_unknown = 0
+
+    def _evict(self, now: float):
+        while self._seen:
+            key, seen = next(iter(self._seen.items()))
+            if len(self._seen) <= self.max_entries and now - seen.last_seen < self.max_age:
+                break
+            del self._seen[key]
+
+    def get(self, chat_id, message_id):
+        seen = self._seen.get((chat_id, message_id))
+        if seen is not None and self.clock() - seen.last_seen >= self.max_age:
+            del self._seen[(chat_id, message_id)]
+            return None
+        return seen
+
+    def remember(self, chat_id, message_id, urls, prohibited: bool, status: str):
+        """urls is the frozenset of the message's URL candidates, None if its sender is exempt."""
+        now = self.clock()
+        key = (chat_id, message_id)
+        self._seen[key] = SeenMessage(urls, prohibited, status, now)
+        self._seen.move_to_end(key)
+        self._evict(now)
+
+    def forget(self, chat_id, message_id):
+        self._seen.pop((chat_id, message_id), None)
+
+    def stats(self) -> dict:
+        return {
+            "remembered": len(self._seen),
+            "edits": self.edits,
+            "edits_without_new_urls": self.edits_without_new_urls,
+            "edits_of_unknown_messages": self.edits_unknown,
+        }
+
+
+EDIT_MEMO = EditMemo()
+
+if __name__ == "__main__":
+    fake_now = [0.0]
+    memo = EditMemo(max_age=60, max_entries=2, clock=lambda: fake_now[0])
+    memo.remember(-100, 1, frozenset({"sciastra.com"}), False, "member")
+    memo.remember(-100, 2, frozenset({"example.com/notes"}), False, "member")
+    print(memo.get(-100, 1).urls, memo.get(-100, 2).urls)
+    memo.remember(-100, 3, None, False, "administrator")
+    print("after a third message:", memo.get(-100, 1), memo.stats())
+    fake_now[0] = 61
+    print("after max_age:", memo.get(-100, 3))
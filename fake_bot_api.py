@@ -0,0 +1,237 @@
+"""
+A local stand-in for the Telegram Bot API, used for load tests (see load_generator.py).
+
+It implements the methods the bot uses (getMe, getUpdates, getChatMember, sendMessage,
+deleteMessage(s), getChatAdministrators, restrictChatMember, ...) with configurable latency and
+error injection, and records how long every update took from being queued until the bot
+acted on it (a reply to it or its deletion).
+
+Point the bot at it with BOT_API_BASE_URL=http://127.0.0.1:8081/bot (environment or config.py).
+Run standalone with: python fake_bot_api.py --port 8081 --latency 0.05 --error-rate 0.01
+"""
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from collections import Counter
+from urllib.parse import urlparse, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "Fake", "username": "fake_sciastra_bot"}
+
+def _decode_value(value: str):
+    # python-telegram-bot sends non string parameters JSON encoded inside the form.
+    if value[:1] in "[{" or value in ("true", "false", "null") or value.lstrip("-").isdigit():
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+class FakeBotApi:
+    """State of the fake server: queued updates, members, call counters and latency records."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, method_latency=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.method_latency = method_latency or {}
+        self.admins = set()
+        self.calls = Counter()
+        self.errors = Counter()
+        self._lock = threading.Condition()
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1000000
+        self._enqueued_at = {}
+        self._acked_at = {}
+        self._acted_at = {}
+        self._message_update = {}
+
+    # --- used by the load generator ---
+    def enqueue(self, message: dict) -> int:
+        """Queues a message update and returns its update_id."""
+        with self._lock:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append({"update_id": update_id, "message": message})
+            now = time.perf_counter()
+            self._enqueued_at[update_id] = now
+            self._message_update[(message["chat"]["id"], message["message_id"])] = update_id
+            self._lock.notify_all()
+        return update_id
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._updates)
+
+    def latencies(self):
+        """(ack latencies, action latencies) in seconds, keyed by update_id."""
+        with self._lock:
+            acked = {uid: t - self._enqueued_at[uid] for uid, t in self._acked_at.items()}
+            acted = {uid: t - self._enqueued_at[uid] for uid, t in self._acted_at.items()}
+        return acked, acted
+
+    # --- API methods ---
+    def _record_action(self, chat_id, message_id):
+        if message_id is None:
+            return
+        update_id = self._message_update.get((chat_id, int(message_id)))
+        if update_id is not None and update_id not in self._acted_at:
+            self._acted_at[update_id] = time.perf_counter()
+
+    def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            if offset:
+                now = time.perf_counter()
+                while self._updates and self._updates[0]["update_id"] < offset:
+                    self._acked_at[self._updates.pop(0)["update_id"]] = now
+            while not self._updates and time.monotonic() < deadline:
+                self._lock.wait(deadline - time.monotonic())
+            return self._updates[:limit]
+
+    def send_message(self, params):
+        chat_id = params.get("chat_id")
+        reply_to = params.get("reply_to_message_id")
+        reply_parameters = params.get("reply_parameters")
+        if isinstance(reply_parameters, dict):
+            reply_to = reply_parameters.get("message_id", reply_to)
+        with self._lock:
+            self._record_action(chat_id, reply_to)
+            message_id = self._next_message_id
+            self._next_message_id += 1
+        return {"message_id": message_id, "date": int(time.time()), "from": BOT_USER,
+                "chat": {"id": chat_id, "type": "supergroup", "title": "load test"}, "text": params.get("text", "")}
+
+    def delete_messages(self, params):
+        chat_id = params.get("chat_id")
+        message_ids = params.get("message_ids") or [params.get("message_id")]
+        with self._lock:
+            for message_id in message_ids:
+                self._record_action(chat_id, message_id)
+        return True
+
+    def get_chat_member(self, params):
+        user_id = int(params.get("user_id"))
+        status = "administrator" if user_id in self.admins else "member"
+        member = {"status": status, "user": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}}
+        if status == "administrator":
+            member.update({"can_be_edited": False, "is_anonymous": False, "can_manage_chat": True,
+                           "can_delete_messages": True, "can_manage_video_chats": True,
+                           "can_restrict_members": True, "can_promote_members": False, "can_change_info": True,
+                           "can_invite_users": True, "can_post_stories": False, "can_edit_stories": False,
+                           "can_delete_stories": False})
+        return member
+
+    def get_chat_administrators(self, params):
+        return [self.get_chat_member({"user_id": user_id}) for user_id in sorted(self.admins)]
+
+    def call(self, method: str, params: dict):
+        """Returns the JSON response body for an API call."""
+        with self._lock:
+            self.calls[method] += 1
+        delay = self.method_latency.get(method, self.latency)
+        if method != "getUpdates" and (delay or self.jitter):
+            time.sleep(max(0.0, delay + random.uniform(-self.jitter, self.jitter)))
+        if method != "getUpdates" and self.error_rate and random.random() < self.error_rate:
+            with self._lock:
+                self.errors[method] += 1
+            return {"ok": False, "error_code": 500, "description": "Internal Server Error: injected"}
+        handlers = {
+            "getMe": lambda p: BOT_USER,
+            "getUpdates": self.get_updates,
+            "sendMessage": self.send_message,
+            "deleteMessage": self.delete_messages,
+            "deleteMessages": self.delete_messages,
+            "getChatMember": self.get_chat_member,
+            "getChatAdministrators": self.get_chat_administrators,
+        }
+        handler = handlers.get(method, lambda p: True)
+        return {"ok": True, "result": handler(params)}
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "errors": dict(self.errors), "pending_updates": self.pending()}
+
+class _Handler(BaseHTTPRequestHandler):
+    api: FakeBotApi = None
+
+    def log_message(self, format, *args):
+        logging.debug("fake api: " + format, *args)
+
+    def _params(self):
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        content_type = self.headers.get("Content-Type", "")
+        if body and "json" in content_type:
+            params.update(json.loads(body))
+        elif body:
+            params.update(parse_qsl(body.decode()))
+        return url.path, {key: _decode_value(value) if isinstance(value, str) and key not in ("text", "caption") else value
+                          for key, value in params.items()}
+
+    def _respond(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        path, params = self._params()
+        if path == "/control/stats":
+            return self._respond(200, self.api.stats())
+        if path == "/control/enqueue":
+            update_ids = [self.api.enqueue(message) for message in params.get("messages", [])]
+            return self._respond(200, {"update_ids": update_ids})
+        method = path.rstrip("/").rsplit("/", 1)[-1]
+        response = self.api.call(method, params)
+        self._respond(200 if response["ok"] else response["error_code"], response)
+
+    do_GET = _handle
+    do_POST = _handle
+
+class FakeBotApiServer:
+    def __init__(self, api: FakeBotApi, host="127.0.0.1", port=8081):
+        handler = type("Handler", (_Handler,), {"api": api})
+        self.api = api
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://{host}:{self.httpd.server_address[1]}/bot"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake Telegram Bot API server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +- seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls that fail with HTTP 500")
+    parser.add_argument("--admin", type=int, action="append", default=[], help="user id reported as administrator")
+    args = parser.parse_args()
+
+    api = FakeBotApi(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    api.admins.update(args.admin)
+    server = FakeBotApiServer(api, args.host, args.port)
+    print(f"Fake Bot API listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,115 @@
+import time
+from collections import deque, OrderedDict
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# A user may send at most FLOOD_MAX_MESSAGES messages in FLOOD_WINDOW_SECONDS in one chat.
+FLOOD_MAX_MESSAGES = getattr(_config, "FLOOD_MAX_MESSAGES", 6)
+FLOOD_WINDOW_SECONDS = getattr(_config, "FLOOD_WINDOW_SECONDS", 10)
+# What to do with messages over the limit: "throttle" (skip processing), "delete" or "mute".
+FLOOD_ACTION = getattr(_config, "FLOOD_ACTION", "delete")
+FLOOD_MUTE_SECONDS = getattr(_config, "FLOOD_MUTE_SECONDS", 300)
+# Windows of users that have been quiet this long are dropped.
+FLOOD_IDLE_SECONDS = getattr(_config, "FLOOD_IDLE_SECONDS", 600)
+# Hard cap on the number of (chat, user) windows kept in memory.
+FLOOD_MAX_TRACKED = getattr(_config, "FLOOD_MAX_TRACKED", 50000)
+
+# Values returned by FloodDetector.hit()
+FLOOD_START = "start"
+FLOOD_CONTINUE = "continue"
+
+
+class _Window:
+    __slots__ = ("times", "last_seen", "flooding", "exempt")
+
+    def __init__(self, size: int):
+        self.times = deque(maxlen=size)
+        self.last_seen = 0.0
+        self.flooding = False
+        self.exempt = False
+
+
+class FloodDetector:
+    """
+    Keeps a fixed size ring buffer of message timestamps per (chat, user).
+    A message is flooding when the ring buffer is full and its oldest entry
+    is still inside the window, so every check is O(1).
+    Windows are kept in least-recently-seen order so idle ones can be evicted from the front.
+    """
+
+    def __init__(self, max_messages=FLOOD_MAX_MESSAGES, window_seconds=FLOOD_WINDOW_SECONDS,
+                 idle_seconds=FLOOD_IDLE_SECONDS, max_tracked=FLOOD_MAX_TRACKED, clock=time.monotonic):
+        self.max_messages = max_messages
+        self.window_seconds = window_seconds
+        self.idle_seconds = idle_seconds
+        self.max_tracked = max_tracked
+        self.clock = clock
+        self._windows = OrderedDict()
+        self.flood_messages = 0
+
+    def _evict(self, now: float):
+        while self._windows:
+            key, window = next(iter(self._windows.items()))
+            if len(self._windows) <= self.max_tracked and now - window.last_seen < self.idle_seconds:
+                break
+            del self._windows[key]
+
+    def hit(self, chat_id, user_id):
+        """
+        Records a message from user_id in chat_id.
+        Returns None if the user is within the limit, FLOOD_START for the first
+        message over the limit and FLOOD_CONTINUE for the following ones.
+        """
+        now = self.clock()
+        key = (chat_id, user_id)
+        window = self._windows.get(key)
+        if window is None:
+            window = _Window(self.max_messages)
+            self._windows[key] = window
+        else:
+            self._windows.move_to_end(key)
+        window.last_seen = now
+        self._evict(now)
+
+        times = window.times
+        over_limit = len(times) == times.maxlen and now - times[0] < self.window_seconds
+        times.append(now)
+        if window.exempt:
+            return None
+        if not over_limit:
+            window.flooding = False
+            return None
+        self.flood_messages += 1
+        if window.flooding:
+            return FLOOD_CONTINUE
+        window.flooding = True
+        return FLOOD_START
+
+    def exempt(self, chat_id, user_id):
+        """Stops flagging the user (e.g. an admin) until their window is evicted."""
+        window = self._windows.get((chat_id, user_id))
+        if window is not None:
+            window.exempt = True
+
+    def stats(self) -> dict:
+        return {
+            "tracked_users": len(self._windows),
+            "flooding_users": sum(1 for window in self._windows.values() if window.flooding),
+            "flood_messages": self.flood_messages,
+        }
+
+
+FLOOD_DETECTOR = FloodDetector()
+
+if __name__ == "__main__":
+    fake_now = [0.0]
+    detector = FloodDetector(max_messages=3, window_seconds=10, clock=lambda: fake_now[0])
+    for i in range(6):
+        fake_now[0] = i
+        print(f"t={i}s: {detector.hit(-100, 42)}")
+    fake_now[0] = 30
+    print(f"t=30s: {detector.hit(-100, 42)}")
+    print(detector.stats())
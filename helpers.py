@@ -1,7 +1,11 @@
 import datetime
 import re
 import logging
-import os
+import json
+import models
+import schedule
+import snapshots
+import startup_cache
 
 def parse_time_string(time_str: str):
     """
@@ -51,70 +55,61 @@ def is_time_in_interval(start: datetime.time, end: datetime.time, current: datet
 
 def get_channel_by_chat_id(chat_id: str, channels_data):
     """
-    Finds the channel in channels_data with a matching chat id.
+    Finds the channel in channels_data (a models.ChannelsData) with a matching chat id.
     """
-    if not channels_data or "channels" not in channels_data:
+    if not channels_data:
         return None
-    for channel in channels_data["channels"]:
-        if str(channel.get("id")) == str(chat_id):
-            return channel
-    return None
+    return channels_data.get(chat_id)
+
+def _channel_now(channel, now):
+    """now as a datetime, a bare time (what callers used to pass) is taken as today's in the group's timezone."""
+    if isinstance(now, datetime.time):
+        return datetime.datetime.combine(datetime.datetime.now(channel.tzinfo).date(), now)
+    return now
 
-def get_active_incharges(channel, current_time: datetime.time):
+def get_active_incharges(channel, now):
     """
-    Returns a list of all timing slots in the channel that are active at the current time.
+    Returns a list of all timing slots in the channel that are active at now (an aware datetime,
+    or wall clock time of the group), honouring weekdays and overrides (see schedule.py).
     """
-    active_slots = []
-    for slot in channel.get("timings", []):
-        start, end = parse_time_range(slot["time"])
-        if start is None or end is None:
-            continue
-        if is_time_in_interval(start, end, current_time):
-            active_slots.append(slot)
-    return active_slots
+    return channel.schedule.active_at(_channel_now(channel, now))
 
-def get_next_incharges(channel, current_time: datetime.time):
+def get_next_incharges(channel, now):
     """
-    Returns a list of upcoming timing slots that share the earliest start time,
-    based on the current time. If none are upcoming, returns the first slot.
+    Returns a list of upcoming timing slots that share the earliest start after now,
+    on a later day if none start later today. Empty if the group has no timings at all.
     """
-    upcoming_slots = []
-    today = datetime.date.today()
-    current_datetime = datetime.datetime.combine(today, current_time)
-    for slot in channel.get("timings", []):
-        start, _ = parse_time_range(slot["time"])
-        if start is None:
-            continue
-        slot_datetime = datetime.datetime.combine(today, start)
-        if slot_datetime > current_datetime:
-            upcoming_slots.append((slot_datetime, slot))
-    if upcoming_slots:
-        upcoming_slots.sort(key=lambda x: x[0])
-        earliest_start = upcoming_slots[0][0]
-        # return all slots that have the earliest start time
-        next_slots = [slot for dt, slot in upcoming_slots if dt == earliest_start]
-        return next_slots
-    # if no upcoming slot, return the first slot (as a fallback)
-    if channel.get("timings", []):
-        return [channel["timings"][0]]
-    return []
+    return channel.schedule.next_at(_channel_now(channel, now))
 
 def get_latest_file(directory_path="slots_info"):
+    """Path of the current version in slots_info, read from its CURRENT pointer (see snapshots.py)."""
     try:
-        files = [f.replace(".json",'') for f in os.listdir(directory_path)
-                if os.path.isfile(os.path.join(directory_path, f))]
-        
-        if not files:
-            return None
-        
-        latest_file = max(files)
-        
-        return os.path.join("slots_info",latest_file+".json")
-    
+        if directory_path == snapshots.SLOTS_DIR:
+            return snapshots.SNAPSHOTS.current_path()
+        return snapshots.SnapshotStore(directory_path).current_path()
     except Exception as e:
         print(f"Error: {e}")
         return None
 
+def load_channels(file_path=None):
+    """
+    Loads and validates the latest channels data from slots_info as a models.ChannelsData,
+    returns None if it can't be read or is invalid.
+    """
+    try:
+        file_path = file_path or get_latest_file()
+        def build():
+            with open(file_path, "r") as f:
+                data = models.ChannelsData.from_dict(json.load(f))
+            for channel in data.channels:
+                channel.schedule
+            return data
+        # Parsed, validated and compiled schedules are reused across restarts until the file or the models change.
+        return startup_cache.cached("channels", [file_path, models.__file__, schedule.__file__, __file__], build)
+    except Exception as e:
+        logging.error(f"Error loading channels.json: {e}")
+        return None
+
 def format_time(t: datetime.time) -> str:
     """
     Formats a datetime.time object into a 12-hour time string with minutes.
@@ -126,9 +121,9 @@ def format_time(t: datetime.time) -> str:
         hour = 12
     return f"{hour}:{t.minute:02d} {'AM' if t.hour < 12 else 'PM'}"
 
-def convert_group_timings_from_json_to_list(group: dict) -> list:
+def convert_group_timings_from_json_to_list(group) -> list:
     """
-    Converts each timing entry in the group's 'timings' list into the format:
+    Converts each timing of the group (a models.Channel) into the format:
       [start_time_str, end_time_str, user_id_without_@, name]
     
     For example, given a timing like:
@@ -141,19 +136,14 @@ def convert_group_timings_from_json_to_list(group: dict) -> list:
         ['10:00 AM', '1:00 PM', 'iamhet7', 'Het']
     """
     results = []
-    timings = group.get("timings", [])
-    for slot in timings:
-        time_range_str = slot.get("time", "")
-        start, end = parse_time_range(time_range_str)
-        if not start or not end:
-            logging.warning(f"Could not parse time range: {time_range_str}")
+    for slot in group.timings:
+        if not slot.parsed:
+            logging.warning(f"Could not parse time range: {slot.time}")
             continue
-        start_formatted = format_time(start)
-        end_formatted = format_time(end)
+        start_formatted = format_time(slot.start_time)
+        end_formatted = format_time(slot.end_time)
         # Remove the leading '@' from the user_id, if present.
-        user_id = slot.get("user_id", "").lstrip("@")
-        name = slot.get("name", "")
-        results.append([start_formatted, end_formatted, user_id, name])
+        results.append([start_formatted, end_formatted, slot.user_id.lstrip("@"), slot.name])
     return results
 
 # Example usage of convert_group_timings_from_json_to_list:
@@ -183,7 +173,7 @@ if __name__ == "__main__":
         ]
     }
     '''
-    group = json.loads(group_json)
+    group = models.Channel.from_dict(json.loads(group_json))
     print(convert_group_timings_from_json_to_list(group))
 
 
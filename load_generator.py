@@ -0,0 +1,179 @@
+"""
+Replays a configurable mix of group traffic against the bot through fake_bot_api.py
+and reports throughput, end-to-end latency percentiles and API call counts.
+
+    python load_generator.py --spawn-bot --updates 2000 --rate 200 --latency 0.03
+
+--spawn-bot starts `python main.py` with BOT_API_BASE_URL pointing at the fake server
+(config.py still has to exist, any TOKEN works). Without it, start the bot yourself
+with BOT_API_BASE_URL set to the printed URL.
+The spawned bot runs in a scratch copy of slots_info and the allowlists, which is removed afterwards,
+so its #query rows, logs and shared state never reach the real ones.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import subprocess
+import statistics
+
+import helpers
+from fake_bot_api import FakeBotApi, FakeBotApiServer
+from replay import prepare_workdir
+
+ADMIN_COMMANDS = ["/getGroupsList", "/getAllGroupsTimings", "/floodStats", "/cacheStats", "/help"]
+ALLOWED_LINKS = ["sciastra.com/courses", "https://www.youtube.com/watch?v=67qgPFxt0QA", "t.me/+GS7bI6CYIU5jYWU9"]
+SPAM_LINKS = ["free-money.xyz/claim", "https://evil.example.com/x", "bit.ly/totally-safe", "join spam[.]top"]
+FILLER = ["sir", "please", "help", "in", "this", "question", "why", "is", "the", "answer", "option", "b", "ok", "thanks"]
+
+# Kinds of messages and whether the bot is expected to reply to or delete them.
+DEFAULT_MIX = {"plain": 50, "allowed_link": 10, "spam_link": 10, "doubt": 12, "timing": 5, "query": 5, "admin_command": 8}
+ACTIONABLE = {"spam_link", "doubt", "timing", "query", "admin_command"}
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+class TrafficGenerator:
+    def __init__(self, chat_ids, users, admins, mix, seed=0):
+        self.random = random.Random(seed)
+        self.chat_ids = chat_ids
+        self.users = list(range(10_000, 10_000 + users))
+        self.admins = list(range(1, admins + 1))
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.message_id = 1
+
+    def _sentence(self, extra=None):
+        words = self.random.choices(FILLER, k=self.random.randint(3, 15))
+        if extra:
+            words.insert(self.random.randint(0, len(words)), extra)
+        return " ".join(words)
+
+    def next_message(self):
+        kind = self.random.choices(self.kinds, self.weights)[0]
+        user_id = self.random.choice(self.admins if kind == "admin_command" else self.users)
+        text = {
+            "plain": lambda: self._sentence(),
+            "allowed_link": lambda: self._sentence(self.random.choice(ALLOWED_LINKS)),
+            "spam_link": lambda: self._sentence(self.random.choice(SPAM_LINKS)),
+            "doubt": lambda: self._sentence("#doubt"),
+            "timing": lambda: "#timing",
+            "query": lambda: self._sentence("#query"),
+            "admin_command": lambda: self.random.choice(ADMIN_COMMANDS),
+        }[kind]()
+        chat_id = self.random.choice(self.chat_ids)
+        self.message_id += 1
+        message = {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": f"Load test {chat_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"},
+            "text": text,
+        }
+        return kind, message
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the bot against a local fake Bot API.")
+    parser.add_argument("--updates", type=int, default=1000, help="number of messages to send")
+    parser.add_argument("--rate", type=float, default=100, help="messages per second to enqueue")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--admins", type=int, default=3)
+    parser.add_argument("--extra-chats", type=int, default=2, help="chats that are not in slots_info")
+    parser.add_argument("--mix", help='JSON weights, e.g. {"plain": 80, "spam_link": 20}')
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API call")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of API calls that fail")
+    parser.add_argument("--port", type=int, default=0, help="fake API port, 0 picks a free one")
+    parser.add_argument("--spawn-bot", action="store_true", help="start main.py against the fake API")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="seconds to wait for the bot to catch up")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    channels = helpers.load_channels()
+    chat_ids = [int(channel.id) for channel in channels.channels] if channels else []
+    chat_ids += [-1009000000000 - i for i in range(args.extra_chats)]
+    mix = json.loads(args.mix) if args.mix else DEFAULT_MIX
+
+    api = FakeBotApi(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    api.admins.update(range(1, args.admins + 1))
+    server = FakeBotApiServer(api, port=args.port).start()
+    print(f"Fake Bot API listening on {server.base_url}")
+
+    bot = None
+    if args.spawn_bot:
+        # Run from a scratch copy of the data files, so the load doesn't end up in the real queries/ and logs.
+        repo_dir = os.path.dirname(os.path.abspath(__file__))
+        bot_dir = prepare_workdir(repo_dir)
+        env = dict(os.environ, BOT_API_BASE_URL=server.base_url)
+        bot = subprocess.Popen([sys.executable, os.path.join(repo_dir, "main.py")], env=env, cwd=bot_dir)
+        while api.calls["getUpdates"] == 0:
+            if bot.poll() is not None:
+                sys.exit(f"The bot exited before it started polling, check {os.path.join(bot_dir, 'logs.log')}")
+            time.sleep(0.1)
+    else:
+        input("Start the bot with BOT_API_BASE_URL set to the URL above, then press enter...")
+
+    generator = TrafficGenerator(chat_ids, args.users, args.admins, mix, seed=args.seed)
+    kinds = {}
+    interval = 1 / args.rate if args.rate > 0 else 0
+    start = time.perf_counter()
+    for i in range(args.updates):
+        kind, message = generator.next_message()
+        kinds[api.enqueue(message)] = kind
+        sleep_for = start + (i + 1) * interval - time.perf_counter()
+        if sleep_for > 0:
+            time.sleep(sleep_for)
+    enqueue_done = time.perf_counter()
+
+    deadline = time.monotonic() + args.drain_timeout
+    while time.monotonic() < deadline:
+        acked, _ = api.latencies()
+        if len(acked) >= len(kinds) - 1:
+            break
+        time.sleep(0.1)
+    # Give the last batch a moment to be processed, its offset is only confirmed by the next getUpdates.
+    time.sleep(1)
+    elapsed = time.perf_counter() - start
+    acked, acted = api.latencies()
+
+    actionable = [uid for uid, kind in kinds.items() if kind in ACTIONABLE]
+    action_latencies = [acted[uid] for uid in actionable if uid in acted]
+    report = {
+        "updates_sent": len(kinds),
+        "updates_acknowledged": len(acked),
+        "enqueue_seconds": round(enqueue_done - start, 3),
+        "total_seconds": round(elapsed, 3),
+        "throughput_per_second": round(len(acked) / elapsed, 1) if elapsed else 0,
+        "actionable_updates": len(actionable),
+        "actionable_without_action": len(actionable) - len(action_latencies),
+        "action_latency_ms": {
+            "p50": round(percentile(action_latencies, 0.50) * 1000, 1),
+            "p90": round(percentile(action_latencies, 0.90) * 1000, 1),
+            "p99": round(percentile(action_latencies, 0.99) * 1000, 1),
+            "max": round(max(action_latencies, default=0) * 1000, 1),
+            "mean": round(statistics.fmean(action_latencies) * 1000, 1) if action_latencies else 0,
+        },
+        "ack_latency_ms_p50": round(percentile(list(acked.values()), 0.5) * 1000, 1),
+        "api_calls": dict(api.calls),
+        "api_errors_injected": dict(api.errors),
+    }
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if bot is not None:
+        bot.terminate()
+        bot.wait(timeout=10)
+        shutil.rmtree(bot_dir, ignore_errors=True)
+    server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,41 @@
+import time
+_import_start = time.perf_counter()
 import logging
+
+# Configure logging to a file, before importing modules that already log while they load
+logging.basicConfig(
+    filename='logs.log',
+    filemode='a',  # Append to the file
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+import startup_cache
 import re
 import datetime
-import json
 import helpers as h_func
-from url_checker import contains_prohibited_url
-from glob import glob as glob_glob
-from re import split as re_split
-from telegram import Update
+from url_checker import contains_prohibited_url, urls_prohibited, iter_url_candidates, scan_limit, MAX_URL_CANDIDATES, URL_CANDIDATES_OVER_LIMIT
+from telegram import Update, ChatPermissions
 from telegram.ext import Application, MessageHandler, filters, ContextTypes
 import commands as cmd
+from query_log import generate_query_id, log_query_to_csv
+import query_export
+from allowlist import ALLOWLIST
+from shortener import SHORTENER_RESOLVER
+from analysis_pool import ANALYSIS_POOL
+from edit_memo import EDIT_MEMO
+from policy import POLICIES
+from analytics import emit_event
+from shared_state import SHARED_STATE
+from snapshots import SNAPSHOTS
+from update_router import WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_PATH, worker_port
+from flood_control import FLOOD_DETECTOR, FLOOD_ACTION, FLOOD_MUTE_SECONDS, FLOOD_START
+from doubt_router import DOUBT_ROUTER
+from profiling import PROFILER, PROFILING_COMMANDS, is_privileged
+import asyncio
 import os
-import csv
-import hashlib
+import sys
+startup_cache.record("imports (including the loads above)", _import_start)
 
 try:
     from config import TOKEN, PRIVILEGED_USERS
@@ -20,85 +44,117 @@ except ImportError:
     print("config.py not found. Please create it with your Telegram bot token.")
     exit(1)
 
-def load_allowed_urls():
-    all_urls = []
-    for file_path in glob_glob("*_allowed_urls.txt"):
-        with open(file_path, 'r') as file:
-            urls = re_split(r'\n+', file.read().strip())
-            all_urls.extend(urls)
-    return all_urls
+try:
+    from config import BOT_API_BASE_URL
+except ImportError:
+    BOT_API_BASE_URL = None
+# Lets load tests point the bot at fake_bot_api.py instead of api.telegram.org.
+BOT_API_BASE_URL = os.environ.get("BOT_API_BASE_URL", BOT_API_BASE_URL)
 
-ALLOWED_URLS = load_allowed_urls()
+CHANNELS_VERSION = SNAPSHOTS.current()
+CHANNELS_DATA = h_func.load_channels()
+# python main.py --timing prints how long each startup step took, including startup cache hits and misses.
+SHOW_STARTUP_TIMING = "--timing" in sys.argv
+# python main.py --worker K runs as worker K behind update_router.py instead of polling.
+WORKER_ID = int(sys.argv[sys.argv.index("--worker") + 1]) if "--worker" in sys.argv else None
 
-def load_channels():
-    try:
-        with open(h_func.get_latest_file(), "r") as f:
-            return json.load(f)
-    except Exception as e:
-        logging.error(f"Error loading channels.json: {e}")
-        return None
+async def handle_flood(update: Update, chat, user, flood: str) -> bool:
+    """
+    Applies FLOOD_ACTION to a message that is over the flood limit.
+    Returns True if the message must not go through the rest of the pipeline.
+    """
+    if flood == FLOOD_START:
+        # Only the first message over the limit pays for a member lookup, admins are exempted after that.
+        member = await chat.get_member(user.id)
+        if member.status not in ['member']:
+            FLOOD_DETECTOR.exempt(chat.id, user.id)
+            return False
+        logging.info(f"{user.username} whose id is {user.id} is flooding chat id {chat.id}, action: {FLOOD_ACTION}")
+        if FLOOD_ACTION == "mute":
+            until = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=FLOOD_MUTE_SECONDS)
+            await chat.restrict_member(user.id, ChatPermissions(can_send_messages=False), until_date=until)
+    if FLOOD_ACTION in ("delete", "mute"):
+        await update.effective_message.delete()
+    return True
 
-CHANNELS_DATA = load_channels()
+def url_candidates(text: str) -> list:
+    """URL candidates of text in order, see url_checker.scan_limit for how many."""
+    return list(iter_url_candidates(text, scan_limit()))
 
-# Configure logging to a file
-logging.basicConfig(
-    filename='logs.log',
-    filemode='a',  # Append to the file
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+async def apply_link_policy(update: Update, policy, user, status: str, text: str, group_name: str):
+    """Deletes, warns about or only logs a message with a prohibited URL, depending on the group's policy."""
+    chat_id = update.effective_chat.id
+    if policy.action == "delete":
+        logging.info(f"deleting msg from {user.username} whose id is {user.id} who is a {status} whose msg was: {text.replace('\n', '\\n')}")
+        await update.effective_message.delete()
+        emit_event("deleted", chat_id, user.id)
+        logging.info(f"msg deleted from {user.username} whose id is {user.id} who is a {status} whose msg was: {text.replace('\n', '\\n')}")
+    elif policy.action == "warn":
+        await update.effective_message.reply_text("Please don't share external URLs in the channel!")
+        emit_event("warned", chat_id, user.id)
+        logging.info(f"warned {user.username} whose id is {user.id} who is a {status} whose msg was: {text.replace('\n', '\\n')}")
+    else:
+        logging.info(f"prohibited URL from {user.username} whose id is {user.id} who is a {status} in chat '{group_name}' (log only policy)")
+
+async def handle_edited_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Moderates edited messages and captions, so a link can't be added after a clean message passed.
+    Only URLs that weren't in the previous version are classified and the sender's status comes from
+    EDIT_MEMO, so most edits cost no API call. Commands and hashtags in edits are ignored.
+    """
+    message = update.edited_message
+    text = message.text if message.text is not None else message.caption
+    if text is None:
+        return
+    chat = update.effective_chat
+    user = message.from_user
+    chat_id = chat.id
+    group_name = chat.title if hasattr(chat, "title") and chat.title else "Private Chat"
+
+    EDIT_MEMO.edits += 1
+    seen = EDIT_MEMO.get(chat_id, message.message_id)
+    if seen is None:
+        # Too old, or sent before a restart: check the whole message.
+        EDIT_MEMO.edits_unknown += 1
+        status = (await chat.get_member(user.id)).status
+        old_urls = frozenset()
+    else:
+        status = seen.status
+        old_urls = seen.urls or frozenset()
+    logging.info(f"{user.username} whose id is {user.id} who is a {status} in chat '{group_name}' edited: {text.replace('\n', '\\n')}")
+
+    policy = POLICIES.get(chat_id, CHANNELS_DATA, ALLOWLIST.matcher)
+    if status in policy.exempt_roles:
+        EDIT_MEMO.remember(chat_id, message.message_id, None, False, status)
+        return
+    urls = url_candidates(text)
+    prohibited = len(urls) > MAX_URL_CANDIDATES and URL_CANDIDATES_OVER_LIMIT == "prohibit"
+    new_urls = [url for url in urls if url not in old_urls]
+    if not new_urls:
+        EDIT_MEMO.edits_without_new_urls += 1
+    elif not prohibited:
+        resolved = None
+        if SHORTENER_RESOLVER is not None:
+            resolved = await SHORTENER_RESOLVER.resolve_text(text, policy.matcher)
+        prohibited = urls_prohibited(new_urls, policy.matcher, policy.cache, resolved)
+
+    if prohibited and policy.action == "delete":
+        EDIT_MEMO.forget(chat_id, message.message_id)
+    else:
+        EDIT_MEMO.remember(chat_id, message.message_id, frozenset(urls), prohibited or (seen is not None and seen.prohibited), status)
+    if prohibited:
+        await apply_link_policy(update, policy, user, status, text, group_name)
 
-def generate_query_id(user_id, date_str):
-    """Generate a unique query ID based on date, time, and user ID"""
-    # Create queries directory if it doesn't exist
-    queries_dir = "queries"
-    os.makedirs(queries_dir, exist_ok=True)
-    
-    # Get count of queries for today
-    csv_path = os.path.join(queries_dir, f"{date_str}.csv")
-    query_count = 0
-    if os.path.exists(csv_path):
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            query_count = sum(1 for _ in f) - 1  # Subtract header row
-    
-    # Generate hash from current timestamp, user ID and query count
-    timestamp = datetime.datetime.now().timestamp()
-    hash_input = f"{timestamp}-{user_id}-{query_count}"
-    hash_object = hashlib.md5(hash_input.encode())
-    hash_hex = hash_object.hexdigest()[:8]  # Take first 8 chars of hash
-    
-    # Final ID format: YYYYMMDD-COUNT-HASH
-    return f"{date_str}-{query_count+1:03d}-{hash_hex}"
-
-def log_query_to_csv(query_id, user_id, username, date_str, time_str, 
-                    chat_id, chat_name, message_text):
-    """Log query details to a daily CSV file in the queries folder"""
-    # Create queries directory if it doesn't exist
-    queries_dir = "queries"
-    os.makedirs(queries_dir, exist_ok=True)
-    
-    csv_path = os.path.join(queries_dir, f"{date_str}.csv")
-    file_exists = os.path.exists(csv_path)
-    
-    with open(csv_path, 'a', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['query_id', 'date', 'time', 'user_id', 'username', 
-                    'chat_id', 'chat_name', 'message']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        
-        if not file_exists:
-            writer.writeheader()
-        
-        writer.writerow({
-            'query_id': query_id,
-            'date': date_str,
-            'time': time_str,
-            'user_id': user_id,
-            'username': username,
-            'chat_id': chat_id,
-            'chat_name': chat_name,
-            'message': message_text
-        })
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    PROFILER.expire()
+    with PROFILER.update():
+        await process_message(update, context)
+    if PROFILER.finished:
+        chat_id, caption, file_path = await asyncio.to_thread(PROFILER.dump)
+        with open(file_path, "rb") as f:
+            await context.bot.send_document(chat_id=chat_id, document=f, caption=caption)
+
+async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text: str = update.effective_message.text
     
     if text is None:
@@ -111,40 +167,100 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = chat.id
     group_name = chat.title if hasattr(chat, "title") and chat.title else "Private Chat"
 
+    #* cheap per user rate check before any API call or URL scan
+    flood = FLOOD_DETECTOR.hit(chat_id, user.id)
+    if flood is not None and await handle_flood(update, chat, user, flood):
+        emit_event("flood", chat_id, user.id)
+        return
+
     member = await chat.get_member(user.id)
     logging.info(f"{user.username} whose id is {user.id} who is a {member.status} in chat '{group_name}' sent: {text.replace('\n', '\\n')}")
+    emit_event("message", chat_id, user.id)
 
-    if contains_prohibited_url(text, exempt_patterns=ALLOWED_URLS) and member.status in ['member']:
-        # await update.effective_message.reply_text("Please don't share external URLs in the channel!")
-        logging.info(f"deleting msg from {user.username} whose id is {user.id} who is a {member.status} whose msg was: {text.replace('\n', '\\n')}")
-        await update.effective_message.delete()
-        logging.info(f"msg deleted from {user.username} whose id is {user.id} who is a {member.status} whose msg was: {text.replace('\n', '\\n')}")
+    policy = POLICIES.get(chat_id, CHANNELS_DATA, ALLOWLIST.matcher)
+    moderated = member.status not in policy.exempt_roles
+    #* scanned once, for the verdict and so edits of this message only need to classify URLs that are new
+    urls = url_candidates(text) if moderated else None
+    resolved = None
+    if moderated and SHORTENER_RESOLVER is not None:
+        #* short links are judged by where they point, expansions are cached so this rarely waits for the network
+        resolved = await SHORTENER_RESOLVER.resolve_text(text, policy.matcher)
+    prohibited = False
+    if moderated and ANALYSIS_POOL is not None:
+        #* long messages are analysed in worker processes so they don't hold up other updates
+        prohibited = await ANALYSIS_POOL.contains_prohibited_url(text, policy, resolved, CHANNELS_DATA, ALLOWLIST.matcher)
+    elif moderated:
+        prohibited = contains_prohibited_url(text, exempt_patterns=policy.matcher, cache=policy.cache, resolved=resolved,
+                                             urls=urls)
+    if not (prohibited and policy.action == "delete"):
+        EDIT_MEMO.remember(chat_id, update.effective_message.message_id, frozenset(urls) if moderated else None,
+                           prohibited, member.status)
+    if prohibited:
+        await apply_link_policy(update, policy, user, member.status, text, group_name)
         return
     
+    if text.startswith(PROFILING_COMMANDS):
+        #* these look into the whole process, so only PRIVILEGED_USERS get to use them
+        if not is_privileged(user, PRIVILEGED_USERS):
+            await update.effective_message.reply_text("Only privileged users can use profiling commands.")
+            return
+        #* snapshots of a big heap take a moment, keep the event loop free meanwhile
+        response = await asyncio.to_thread(PROFILER.handle_command, text, chat_id)
+        await update.effective_message.reply_text(response)
+        return
+
     if member.status not in ['member'] and text.startswith('/'):
-        msg = cmd.handle_commands(text, str(chat_id))
-        if "get" not in msg:
-            global CHANNELS_DATA
-            CHANNELS_DATA = load_channels()
+        #* exports stream whole date ranges to disk, keep the event loop free meanwhile
+        document = await asyncio.to_thread(cmd.handle_document_commands, text, str(chat_id))
+        if document is not None:
+            caption, file_path = document
+            if file_path:
+                #* exports hold message texts, they don't stay on disk once sent
+                try:
+                    with open(file_path, "rb") as f:
+                        await update.effective_message.reply_document(document=f, caption=caption)
+                finally:
+                    os.remove(file_path)
+            else:
+                await update.effective_message.reply_text(caption)
+            return
+        #* Sheets commands wait on the network and may wait for another worker's save
+        msg = await asyncio.to_thread(cmd.handle_commands, text, str(chat_id))
+        await asyncio.to_thread(reload_channels)
+        #* pick up allowlist edits made by the command right away instead of on the next poll
+        await asyncio.to_thread(ALLOWLIST.reload_if_changed)
         await update.effective_message.reply_text(msg)
         return
 
+    reply_to = update.effective_message.reply_to_message
+    if reply_to is not None and DOUBT_ROUTER.answered(chat_id, reply_to.message_id, user.username):
+        logging.info(f"Doubt {reply_to.message_id} answered by {user.username}")
+
     if "#doubt" in text:
-        current_time = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=5, minutes=30))).time()
+        #* an aware datetime, each group's schedule converts it to its own timezone
+        now = datetime.datetime.now(datetime.timezone.utc)
         channel = h_func.get_channel_by_chat_id(chat_id, CHANNELS_DATA)
         if channel:
-            active_slots = h_func.get_active_incharges(channel, current_time)
+            mentors = []
+            active_slots = h_func.get_active_incharges(channel, now)
             if active_slots:
-                tagged_users = " ".join([slot.get("user_id") for slot in active_slots])
+                #* one of several active mentors when DOUBT_ROUTING spreads doubts, otherwise all of them
+                mentors = DOUBT_ROUTER.route(chat_id, [slot.user_id for slot in active_slots])
+                tagged_users = " ".join(mentors)
                 reply_text = f"{tagged_users} please check this doubt."
             else:
-                next_slots = h_func.get_next_incharges(channel, current_time)
+                next_slots = h_func.get_next_incharges(channel, now)
                 if next_slots:
-                    tagged_users = " ".join([slot.get("user_id") for slot in next_slots])
+                    mentors = [slot.user_id for slot in next_slots]
+                    tagged_users = " ".join(mentors)
                     reply_text = f"No mentor is currently available. Mentor(s) from next slot: {tagged_users}, please be ready."
                 else:
                     reply_text = "No mentor schedule available at the moment."
-            await update.effective_message.reply_text(reply_text)
+            sent = await update.effective_message.reply_text(reply_text)
+            if active_slots and len(mentors) == 1 < len(active_slots):
+                #* a reply to the doubt or to the bot's message closes it
+                DOUBT_ROUTER.track(chat_id, [update.effective_message.message_id, getattr(sent, "message_id", None)], mentors[0])
+            emit_event("doubt", chat_id, user.id, mentors=mentors)
             logging.info(f"Replied to doubt message from {user.username} with: {reply_text}")
         else:
             logging.info(f"Channel with chat id {chat_id} not found in channels.json.")
@@ -153,21 +269,29 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if "#timing" in text:
         channel = h_func.get_channel_by_chat_id(chat_id, CHANNELS_DATA)
         if channel:
-            timings = channel.get("timings", [])
-            if timings:
-                reply_text = f"Timings for {channel.get("name")}:\n"
-                for slot in timings:
-                    start, end = h_func.parse_time_range(slot.get('time'))
-                    if start and end:
-                        formatted_time = f"{start.strftime('%I:%M %p')} - {end.strftime('%I:%M %p')}"
+            if channel.timings:
+                reply_text = f"Timings for {channel.name}:\n"
+                for slot in channel.timings:
+                    if slot.parsed:
+                        formatted_time = f"{slot.start_time.strftime('%I:%M %p')} - {slot.end_time.strftime('%I:%M %p')}"
                     else:
-                        formatted_time = f"Parsing failed: {slot.get('time')}"
-                    reply_text += f"• {formatted_time}: {slot.get('name')} ({slot.get('user_id')})\n"
+                        formatted_time = f"Parsing failed: {slot.time}"
+                    if slot.days_label:
+                        formatted_time += f" ({slot.days_label})"
+                    reply_text += f"• {formatted_time}: {slot.name} ({slot.user_id})\n"
+                today = datetime.datetime.now(channel.tzinfo).date()
+                for override in channel.overrides or []:
+                    if override.last >= today:
+                        period = override.first.strftime('%d %b') if override.first == override.last \
+                            else f"{override.first.strftime('%d %b')} - {override.last.strftime('%d %b')}"
+                        slots = ", ".join(f"{slot.time}: {slot.name}" for slot in override.timings) or "no doubt sessions"
+                        reply_text += f"Changed on {period}: {slots}\n"
             else:
                 reply_text = "No timings available for this channel."
         else:
             reply_text = "Channel configuration not found."
         await update.effective_message.reply_text(reply_text)
+        emit_event("timing", chat_id, user.id)
         logging.info(f"Replied with timings for chat id {chat_id}: {reply_text}")
     
     # Handle queries with hashtags #querry, #query, or #qur
@@ -195,19 +319,62 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Reply to the message
         reply_text = f"Query #{query_id} raised. Our support team will reach you out soon."
         await update.effective_message.reply_text(reply_text)
+        emit_event("query", chat_id, user.id)
         logging.info(f"Logged query #{query_id} from {user.username} in {group_name}: {text.replace('\n', '\\n')}")
 
+def reload_channels():
+    """
+    Reloads the groups data if a new version of it was saved. The data object is only replaced
+    then, so the policies compiled for it (see policy.PolicyStore) survive other commands.
+    """
+    global CHANNELS_DATA, CHANNELS_VERSION
+    version = SNAPSHOTS.current()
+    if version == CHANNELS_VERSION:
+        return
+    CHANNELS_VERSION = version
+    CHANNELS_DATA = h_func.load_channels()
+    logging.info(f"Reloaded the groups data, now at version {version}")
+
+async def post_init(application: Application):
+    application.create_task(ALLOWLIST.watch())
+    #* groups data saved by another worker (or a command in this one) is picked up within CHANGES_POLL_SECONDS
+    application.create_task(SHARED_STATE.watch("channels", reload_channels))
+    application.create_task(query_export.retention_loop())
+    if SHORTENER_RESOLVER is not None:
+        await asyncio.to_thread(SHORTENER_RESOLVER.cache.purge)
+
+async def post_shutdown(application: Application):
+    if SHORTENER_RESOLVER is not None:
+        await SHORTENER_RESOLVER.close()
+    if ANALYSIS_POOL is not None:
+        ANALYSIS_POOL.shutdown()
+
 async def error(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logging.error(f'Update {update} caused error {context.error}')
 
 if __name__ == '__main__':
-    app = Application.builder().token(TOKEN).build()
+    build_start = time.perf_counter()
+    builder = Application.builder().token(TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+    if BOT_API_BASE_URL:
+        builder = builder.base_url(BOT_API_BASE_URL)
+    app = builder.build()
 
-    app.add_handler(MessageHandler(filters.TEXT | filters.CAPTION, handle_message))
+    app.add_handler(MessageHandler(filters.UpdateType.MESSAGE & (filters.TEXT | filters.CAPTION), handle_message))
+    app.add_handler(MessageHandler(filters.UpdateType.EDITED_MESSAGE & (filters.TEXT | filters.CAPTION), handle_edited_message))
     app.add_error_handler(error)
+    startup_cache.record("build application", build_start)
+    if SHOW_STARTUP_TIMING:
+        print(startup_cache.report(_import_start))
+    logging.info(startup_cache.report(_import_start))
+    startup_cache.finish_startup()
 
     logging.info("Starting bot...")
     print("Starting bot...")
-    app.run_polling(poll_interval=0.05)
+    if WORKER_ID is None:
+        app.run_polling(poll_interval=0.05)
+    else:
+        # Every worker registers the same public URL, update_router.py hands it the updates of its chats.
+        app.run_webhook(listen="127.0.0.1", port=worker_port(WORKER_ID), url_path=WEBHOOK_PATH,
+                        secret_token=WEBHOOK_SECRET, webhook_url=WEBHOOK_URL)
     print("Bot started successfully!")
     logging.info("Bot started successfully!")
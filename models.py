@@ -0,0 +1,228 @@
+import logging
+import datetime
+from dataclasses import dataclass, field
+
+import helpers
+import schedule
+
+SLOT_KEYS = ("time", "name", "user_id")
+CHANNEL_KEYS = ("id", "name", "subject", "timings", "timezone", "overrides")
+
+def time_of(minutes: int) -> datetime.time:
+    return datetime.time(minutes // 60, minutes % 60)
+
+@dataclass(slots=True)
+class Slot:
+    """
+    One doubt timing of a group. start/end are minutes since midnight parsed from `time`
+    (None if it can't be parsed), days is the weekday mask parsed from the optional "days" key.
+    Keys this class doesn't know about are kept in `extra`, "days" included.
+    """
+    time: str
+    name: str
+    user_id: str
+    start: int | None = None
+    end: int | None = None
+    extra: dict = field(default_factory=dict)
+    days: int = schedule.ALL_DAYS
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Slot":
+        if not isinstance(data, dict) or not all(key in data for key in SLOT_KEYS):
+            raise ValueError("Each timing must contain 'time', 'name', and 'user_id' keys.")
+        start, end = helpers.parse_time_range(str(data["time"]))
+        if start is None or end is None:
+            logging.warning(f"Could not parse time range: {data['time']}")
+            start_minutes = end_minutes = None
+        else:
+            start_minutes = start.hour * 60 + start.minute
+            end_minutes = end.hour * 60 + end.minute
+        extra = {key: value for key, value in data.items() if key not in SLOT_KEYS}
+        return cls(data["time"], data["name"], data["user_id"], start_minutes, end_minutes, extra,
+                   schedule.parse_days(data.get("days")))
+
+    def to_dict(self) -> dict:
+        return {"time": self.time, "name": self.name, "user_id": self.user_id, **self.extra}
+
+    @property
+    def parsed(self) -> bool:
+        return self.start is not None and self.end is not None
+
+    @property
+    def start_time(self):
+        return time_of(self.start) if self.start is not None else None
+
+    @property
+    def end_time(self):
+        return time_of(self.end) if self.end is not None else None
+
+    @property
+    def days_label(self) -> str:
+        return schedule.format_days(self.days)
+
+@dataclass(slots=True)
+class Override:
+    """Timings replacing a group's usual ones from `first` to `last` (inclusive), e.g. a holiday with no timings."""
+    first: datetime.date
+    last: datetime.date
+    timings: list = field(default_factory=list)
+    extra: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Override":
+        if not isinstance(data, dict) or "from" not in data:
+            raise ValueError("Each override must have a 'from' date.")
+        first = schedule.parse_date(data["from"], "'from'")
+        last = schedule.parse_date(data["to"], "'to'") if data.get("to") is not None else first
+        if last < first:
+            raise ValueError(f"Override ending {last} starts after it ends.")
+        timings = data.get("timings") or []
+        if not isinstance(timings, list):
+            raise ValueError(f"Timings of the override from {first} must be a JSON array.")
+        extra = {key: value for key, value in data.items() if key != "timings"}
+        return cls(first, last, [Slot.from_dict(slot) for slot in timings], extra)
+
+    def to_dict(self) -> dict:
+        # "from"/"to" stay as they were written, they are in extra.
+        return {**self.extra, "timings": [slot.to_dict() for slot in self.timings]}
+
+@dataclass(slots=True)
+class Channel:
+    """
+    A group from slots_info. name/subject/timezone/overrides are None if the stored group doesn't have them.
+    The compiled schedule.Schedule is built on first use and rebuilt when timings, overrides or timezone are replaced.
+    """
+    id: str | int
+    name: str | None = None
+    subject: str | None = None
+    timings: list = field(default_factory=list)
+    extra: dict = field(default_factory=dict)
+    timezone: str | None = None
+    overrides: list | None = None
+    _schedule: schedule.Schedule | None = field(default=None, init=False, repr=False, compare=False)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Channel":
+        if not isinstance(data, dict) or "id" not in data:
+            raise ValueError("Each group must have an 'id'.")
+        timings = data.get("timings") or []
+        if not isinstance(timings, list):
+            raise ValueError(f"Timings of group {data['id']} must be a JSON array.")
+        overrides = data.get("overrides")
+        if overrides is not None:
+            if not isinstance(overrides, list):
+                raise ValueError(f"Overrides of group {data['id']} must be a JSON array.")
+            overrides = [Override.from_dict(override) for override in overrides]
+            check_overlaps(overrides)
+        timezone = data.get("timezone")
+        if timezone is not None:
+            schedule.get_timezone(timezone)
+        extra = {key: value for key, value in data.items() if key not in CHANNEL_KEYS}
+        return cls(data["id"], data.get("name"), data.get("subject"),
+                   [Slot.from_dict(slot) for slot in timings], extra, timezone, overrides)
+
+    def to_dict(self) -> dict:
+        data = {"id": self.id}
+        if self.name is not None:
+            data["name"] = self.name
+        if self.subject is not None:
+            data["subject"] = self.subject
+        data["timings"] = [slot.to_dict() for slot in self.timings]
+        if self.timezone is not None:
+            data["timezone"] = self.timezone
+        if self.overrides is not None:
+            data["overrides"] = [override.to_dict() for override in self.overrides]
+        data.update(self.extra)
+        return data
+
+    @property
+    def policy(self):
+        return self.extra.get("policy")
+
+    @property
+    def tzinfo(self):
+        return self.schedule.tzinfo
+
+    @property
+    def schedule(self) -> schedule.Schedule:
+        compiled = self._schedule
+        if (compiled is None or compiled.timings is not self.timings or compiled.overrides is not self.overrides
+                or compiled.tzinfo.key != (self.timezone or schedule.SCHEDULE_TIMEZONE)):
+            compiled = self._schedule = schedule.Schedule(self.timings, self.overrides, schedule.get_timezone(self.timezone))
+        return compiled
+
+@dataclass(slots=True)
+class ChannelsData:
+    """Everything in a slots_info file, with the groups indexed by chat id."""
+    channels: list = field(default_factory=list)
+    extra: dict = field(default_factory=dict)
+    _by_id: dict = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.reindex()
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ChannelsData":
+        if not isinstance(data, dict):
+            raise ValueError("Channels data must be a JSON object.")
+        channels = data.get("channels") or []
+        if not isinstance(channels, list):
+            raise ValueError("'channels' must be a JSON array.")
+        extra = {key: value for key, value in data.items() if key != "channels"}
+        return cls([Channel.from_dict(channel) for channel in channels], extra)
+
+    def to_dict(self) -> dict:
+        return {"channels": [channel.to_dict() for channel in self.channels], **self.extra}
+
+    def reindex(self):
+        """Has to be called after channels are added, removed or get a new id."""
+        self._by_id = {}
+        for channel in self.channels:
+            self._by_id.setdefault(str(channel.id), channel)
+
+    def get(self, chat_id):
+        return self._by_id.get(str(chat_id))
+
+    def add(self, channel: Channel):
+        self.channels.append(channel)
+        self._by_id.setdefault(str(channel.id), channel)
+
+    def by_subject(self, subject: str) -> list:
+        return [channel for channel in self.channels if (channel.subject or "").lower() == subject.lower()]
+
+def check_overlaps(overrides: list):
+    """Raises ValueError if two overrides share a date, it would be unclear which one applies."""
+    ordered = sorted(overrides, key=lambda override: override.first)
+    for previous, following in zip(ordered, ordered[1:]):
+        if following.first <= previous.last:
+            raise ValueError(f"Overrides from {previous.first} and {following.first} overlap.")
+
+def parse_overrides(overrides: list) -> list:
+    """Validates overrides given to a command, raises ValueError with a message meant for the user."""
+    if not isinstance(overrides, list):
+        raise ValueError("Overrides must be provided as a JSON array.")
+    parsed = [Override.from_dict(item) for item in overrides]
+    check_overlaps(parsed)
+    return parsed
+
+def parse_timings(timings: list) -> list:
+    """Validates timings given to a command, raises ValueError with a message meant for the user."""
+    if not isinstance(timings, list):
+        raise ValueError("Timings must be provided as a JSON array.")
+    return [Slot.from_dict(item) for item in timings]
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    path = helpers.get_latest_file()
+    with open(path) as f:
+        raw = json.load(f)
+    data = ChannelsData.from_dict(raw)
+    print(f"{path}: {len(data.channels)} groups, lossless round trip: {data.to_dict() == raw}")
+    for channel in data.channels:
+        for slot in channel.timings:
+            print(f"  {channel.name}: {slot.time!r} -> {slot.start_time} - {slot.end_time} {slot.days_label} {slot.user_id}")
+
+    slot = Slot.from_dict({"time": "10 AM - 1 PM", "name": "Het", "user_id": "@iamhet7"})
+    print(f"Slot: {sys.getsizeof(slot)} bytes, same data as a dict: {sys.getsizeof(slot.to_dict())} bytes")
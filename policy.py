@@ -0,0 +1,120 @@
+import logging
+import helpers
+from url_checker import AllowMatcher, VerdictCache, VERDICT_CACHE, split_url
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+POLICY_ACTIONS = ("delete", "warn", "log")
+# Every status except 'member' is exempt unless a group's policy says otherwise.
+DEFAULT_EXEMPT_ROLES = ("creator", "administrator", "restricted", "left", "kicked")
+POLICY_KEYS = ("allowed_hosts", "blocked_hosts", "exempt_roles", "action")
+# Verdict cache sizes for groups that have their own rules.
+CHAT_URL_CACHE_SIZE = getattr(_config, "CHAT_URL_CACHE_SIZE", 2000)
+CHAT_MESSAGE_CACHE_SIZE = getattr(_config, "CHAT_MESSAGE_CACHE_SIZE", 500)
+
+def validate_policy(policy) -> str:
+    """
+    Validates a group's "policy" object, for example:
+        {"allowed_hosts": ["nptel.ac.in"], "blocked_hosts": ["t.me"],
+         "exempt_roles": ["creator", "administrator"], "action": "warn"}
+    Every key is optional. Returns an error message or an empty string if the policy is valid.
+    """
+    if not isinstance(policy, dict):
+        return "Policy must be a JSON object."
+    unknown = [key for key in policy if key not in POLICY_KEYS]
+    if unknown:
+        return f"Unknown policy keys: {', '.join(unknown)}. Allowed keys: {', '.join(POLICY_KEYS)}."
+    for key in ("allowed_hosts", "blocked_hosts", "exempt_roles"):
+        value = policy.get(key, [])
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            return f"'{key}' must be a list of strings."
+    if policy.get("action", "delete") not in POLICY_ACTIONS:
+        return f"'action' must be one of: {', '.join(POLICY_ACTIONS)}."
+    return ""
+
+class PolicyMatcher:
+    """
+    Exempt patterns of one group: its blocked hosts win over everything,
+    then its own allowed hosts, then the global allowlist.
+    """
+
+    def __init__(self, global_matcher: AllowMatcher, allowed_hosts=(), blocked_hosts=()):
+        self.global_matcher = global_matcher
+        self.allowed = AllowMatcher(allowed_hosts)
+        self.blocked = AllowMatcher(blocked_hosts)
+        self.key = (global_matcher.key, self.allowed.key, self.blocked.key)
+
+    def __len__(self):
+        return len(self.global_matcher) + len(self.allowed)
+
+    def is_allowed(self, url: str) -> bool:
+        if self.blocked.is_allowed(url):
+            return False
+        return self.allowed.is_allowed(url) or self.global_matcher.is_allowed(url)
+
+class ChatPolicy:
+    __slots__ = ("matcher", "cache", "exempt_roles", "action", "global_matcher")
+
+    def __init__(self, matcher, cache, exempt_roles, action, global_matcher):
+        self.matcher = matcher
+        self.cache = cache
+        self.exempt_roles = frozenset(exempt_roles)
+        self.action = action
+        self.global_matcher = global_matcher
+
+def compile_policy(policy, global_matcher: AllowMatcher) -> ChatPolicy:
+    policy = policy or {}
+    allowed_hosts = policy.get("allowed_hosts", [])
+    blocked_hosts = policy.get("blocked_hosts", [])
+    if allowed_hosts or blocked_hosts:
+        matcher = PolicyMatcher(global_matcher, allowed_hosts, blocked_hosts)
+        cache = VerdictCache(CHAT_URL_CACHE_SIZE, CHAT_MESSAGE_CACHE_SIZE)
+    else:
+        # Groups without their own hosts share the global matcher and verdict cache.
+        matcher = global_matcher
+        cache = VERDICT_CACHE
+    return ChatPolicy(matcher, cache, policy.get("exempt_roles", DEFAULT_EXEMPT_ROLES),
+                      policy.get("action", "delete"), global_matcher)
+
+class PolicyStore:
+    """
+    Compiles each group's policy once and caches it by chat id.
+    Everything is recompiled when a new channels data object or a new global matcher is passed in.
+    """
+
+    def __init__(self):
+        self._compiled = {}
+        self._channels_data = None
+        self._global_matcher = None
+
+    def get(self, chat_id, channels_data, global_matcher: AllowMatcher) -> ChatPolicy:
+        if channels_data is not self._channels_data or global_matcher is not self._global_matcher:
+            self._compiled.clear()
+            self._channels_data = channels_data
+            self._global_matcher = global_matcher
+        key = str(chat_id)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            channel = helpers.get_channel_by_chat_id(key, channels_data)
+            policy = channel.policy if channel else None
+            error = validate_policy(policy) if policy is not None else ""
+            if error:
+                logging.error(f"Ignoring invalid policy of chat id {key}: {error}")
+                policy = None
+            compiled = compile_policy(policy, global_matcher)
+            self._compiled[key] = compiled
+        return compiled
+
+def normalize_hosts(hosts) -> list:
+    """'https://www.Example.com/x' -> 'example.com/x', so stored hosts look the same as the allowlist files."""
+    normalized = []
+    for host in hosts:
+        name, rest = split_url(host)
+        if name:
+            normalized.append(name + rest.rstrip("/"))
+    return normalized
+
+POLICIES = PolicyStore()
@@ -0,0 +1,272 @@
+"""
+Memory and CPU profiling of the running bot, for PRIVILEGED_USERS only.
+
+/memStart starts tracemalloc, which is off by default. It keeps PROFILING_TRACE_FRAMES frames
+per allocation (1, the allocating line, is the cheapest) and stops by itself after
+PROFILING_TRACE_SECONDS, so a forgotten trace can't slow the bot down for days. /memTop shows
+the lines holding the most memory, /memDiff what grew since /memStart or the previous /memDiff,
+/memStop ends the trace.
+
+/profileUpdates N runs the next N messages through handle_message under cProfile and sends the
+report as a file. Time spent awaiting Telegram counts towards the update, including whatever
+else the event loop did meanwhile.
+"""
+import io
+import os
+import time
+import pstats
+import cProfile
+import logging
+import datetime
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+PROFILING_TRACE_FRAMES = getattr(_config, "PROFILING_TRACE_FRAMES", 1)
+PROFILING_MAX_FRAMES = 25
+# A trace started with /memStart stops by itself after this many seconds.
+PROFILING_TRACE_SECONDS = getattr(_config, "PROFILING_TRACE_SECONDS", 3600)
+PROFILE_MAX_UPDATES = getattr(_config, "PROFILE_MAX_UPDATES", 1000)
+PROFILES_DIR = getattr(_config, "PROFILES_DIR", "profiles")
+# Functions listed in a /profileUpdates report, by cumulative and by own time.
+PROFILE_REPORT_LINES = 40
+# Telegram refuses longer text messages.
+MAX_REPLY_LENGTH = 4000
+
+PROFILING_COMMANDS = ("/memStart", "/memStop", "/memTop", "/memDiff", "/profileUpdates")
+
+_IGNORED_TRACES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+def is_privileged(user, privileged_users) -> bool:
+    """True if user's id or username is in privileged_users."""
+    names = {str(name).strip().lstrip("@").lower() for name in privileged_users or ()}
+    return str(user.id) in names or (user.username or "").lower() in names
+
+def _parse_count(args: list, default: int, maximum: int) -> int:
+    if not args:
+        return default
+    try:
+        count = int(args[0])
+    except ValueError:
+        raise ValueError(f"'{args[0]}' is not a number.") from None
+    return max(1, min(count, maximum))
+
+def _short_path(filename: str) -> str:
+    path = os.path.relpath(filename) if os.path.isabs(filename) else filename
+    if path.startswith(".."):
+        # Outside the bot's directory, e.g. site-packages/telegram/_message.py
+        path = os.path.join(*filename.split(os.sep)[-3:])
+    return path
+
+def _format_traceback(traceback) -> str:
+    return " < ".join(f"{_short_path(frame.filename)}:{frame.lineno}" for frame in reversed(traceback))
+
+def _size(size: int) -> str:
+    return f"{size / 1e6:.2f} MB" if abs(size) >= 1e6 else f"{size / 1e3:.1f} kB"
+
+class Profiler:
+    def __init__(self, profiles_dir=PROFILES_DIR, clock=time.monotonic):
+        self.profiles_dir = profiles_dir
+        self.clock = clock
+        self._baseline = None
+        self._trace_until = None
+        self._profile = None
+        self._remaining = 0
+        self._profiled = 0
+        self._depth = 0
+        self._requested_in = None
+        self._profile_started = None
+
+    # --- tracemalloc ---
+
+    def start_tracing(self, frames=PROFILING_TRACE_FRAMES, seconds=PROFILING_TRACE_SECONDS) -> str:
+        if tracemalloc.is_tracing():
+            return "Already tracing allocations, /memStop first to change the number of frames."
+        frames = max(1, min(frames, PROFILING_MAX_FRAMES))
+        tracemalloc.start(frames)
+        self._trace_until = self.clock() + seconds if seconds else None
+        self._baseline = self._snapshot()
+        return (f"Tracing allocations with {frames} frame(s) each" +
+                (f", stops by itself in {seconds}s." if seconds else ".") +
+                " Use /memTop and /memDiff to see where memory goes.")
+
+    def stop_tracing(self) -> str:
+        if not tracemalloc.is_tracing():
+            return "Not tracing allocations."
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self._baseline = None
+        self._trace_until = None
+        return f"Stopped tracing allocations, traced memory was {_size(current)} (peak {_size(peak)})."
+
+    def expire(self):
+        """Stops a trace that ran longer than it was started for. Called for every update, cheap otherwise."""
+        if self._trace_until is not None and self.clock() >= self._trace_until:
+            logging.info(f"Allocation tracing stopped after its time limit: {self.stop_tracing()}")
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces(_IGNORED_TRACES)
+
+    @staticmethod
+    def _group_by() -> str:
+        return "traceback" if tracemalloc.get_traceback_limit() > 1 else "lineno"
+
+    @staticmethod
+    def _header() -> str:
+        current, peak = tracemalloc.get_traced_memory()
+        return (f"Traced memory: {_size(current)} (peak {_size(peak)}), "
+                f"tracing itself uses {_size(tracemalloc.get_tracemalloc_memory())}")
+
+    def top(self, limit=10) -> str:
+        """The allocation sites holding the most memory right now."""
+        if not tracemalloc.is_tracing():
+            return "Not tracing allocations, start with /memStart."
+        stats = self._snapshot().statistics(self._group_by())
+        lines = [self._header(), f"Top {min(limit, len(stats))} of {len(stats)} allocation sites:"]
+        for stat in stats[:limit]:
+            lines.append(f"{_size(stat.size)} in {stat.count} blocks: {_format_traceback(stat.traceback)}")
+        return "\n".join(lines)
+
+    def diff(self, limit=10) -> str:
+        """The allocation sites that grew most since the previous diff (or the start of the trace)."""
+        if not tracemalloc.is_tracing():
+            return "Not tracing allocations, start with /memStart."
+        snapshot = self._snapshot()
+        stats = snapshot.compare_to(self._baseline, self._group_by())
+        self._baseline = snapshot
+        growth = sum(stat.size_diff for stat in stats)
+        grown = [stat for stat in stats if stat.size_diff > 0]
+        lines = [self._header(), f"Since the last snapshot: {'+' if growth >= 0 else ''}{_size(growth)} in total, "
+                                 f"{len(grown)} sites grew. Largest growth:"]
+        for stat in sorted(grown, key=lambda stat: stat.size_diff, reverse=True)[:limit]:
+            lines.append(f"+{_size(stat.size_diff)} (+{stat.count_diff} blocks, now {_size(stat.size)}): "
+                         f"{_format_traceback(stat.traceback)}")
+        return "\n".join(lines)
+
+    # --- cProfile ---
+
+    @property
+    def profiling(self) -> bool:
+        return self._profile is not None
+
+    def profile_updates(self, count: int, chat_id) -> str:
+        if self._profile is not None:
+            return f"Already profiling, {self._remaining} update(s) left."
+        self._profile = cProfile.Profile()
+        self._remaining = count
+        self._profiled = 0
+        self._requested_in = chat_id
+        self._profile_started = time.perf_counter()
+        return f"Profiling the next {count} update(s), the report will be sent here."
+
+    @contextmanager
+    def update(self):
+        """Profiles the update handled inside the with block if a profile still needs updates."""
+        profile = self._profile
+        if profile is None or self._remaining <= 0:
+            yield
+            return
+        self._remaining -= 1
+        # Updates handled concurrently share one enable/disable.
+        if self._depth == 0:
+            profile.enable()
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                profile.disable()
+            self._profiled += 1
+
+    @property
+    def finished(self) -> bool:
+        return self._profile is not None and self._remaining <= 0 and self._depth == 0
+
+    def dump(self) -> tuple:
+        """
+        Writes the finished profile as a text report and a .prof file (for snakeviz and the like).
+        Returns (chat_id it was requested in, caption, path of the report).
+        """
+        profile, chat_id = self._profile, self._requested_in
+        elapsed = time.perf_counter() - self._profile_started
+        self._profile = None
+        os.makedirs(self.profiles_dir, exist_ok=True)
+        base = os.path.join(self.profiles_dir, f"profile_{datetime.datetime.now():%Y%m%d%H%M%S}")
+        profile.dump_stats(base + ".prof")
+        report = io.StringIO()
+        report.write(f"{self._profiled} update(s) through handle_message over {elapsed:.1f}s\n\n")
+        stats = pstats.Stats(profile, stream=report).strip_dirs()
+        stats.sort_stats("cumulative").print_stats(PROFILE_REPORT_LINES)
+        stats.sort_stats("tottime").print_stats(PROFILE_REPORT_LINES)
+        with open(base + ".txt", "w") as f:
+            f.write(report.getvalue())
+        caption = f"Profile of {self._profiled} update(s), raw stats in {base}.prof"
+        return chat_id, caption, base + ".txt"
+
+    # --- commands ---
+
+    def handle_command(self, message: str, chat_id) -> str:
+        """Runs one of PROFILING_COMMANDS, the caller checks that the sender is privileged."""
+        parts = message.split("$$$")
+        args = [part.strip() for part in parts if part.strip()]
+        command = args[0].split()[0] if args else ""
+        args = args[1:]
+        try:
+            if command == "/memStart":
+                return self.start_tracing(_parse_count(args, PROFILING_TRACE_FRAMES, PROFILING_MAX_FRAMES))
+            if command == "/memStop":
+                return self.stop_tracing()
+            if command == "/memTop":
+                return self.top(_parse_count(args, 10, 50))[:MAX_REPLY_LENGTH]
+            if command == "/memDiff":
+                return self.diff(_parse_count(args, 10, 50))[:MAX_REPLY_LENGTH]
+            if command == "/profileUpdates":
+                if not args:
+                    return "Usage: /profileUpdates N"
+                return self.profile_updates(_parse_count(args, 1, PROFILE_MAX_UPDATES), chat_id)
+        except ValueError as e:
+            return str(e)
+        return "Unknown command. Please check your input and try again."
+
+PROFILER = Profiler()
+
+if __name__ == "__main__":
+    # A cache that keeps growing, found by /memDiff, and a few fake updates under /profileUpdates.
+    import tempfile
+
+    cache = {}
+
+    def handle(update_id):
+        for i in range(2000):
+            cache[(update_id, i)] = f"verdict {update_id} {i}" * 4
+        return sorted(cache)[-1]
+
+    with tempfile.TemporaryDirectory() as directory:
+        profiler = Profiler(profiles_dir=directory)
+        print(profiler.handle_command("/memStart", -100))
+        for update_id in range(5):
+            handle(update_id)
+        print(profiler.handle_command("/memDiff $$$3$$$", -100))
+        print(profiler.handle_command("/memTop $$$3$$$", -100))
+        print(profiler.handle_command("/memStop", -100))
+
+        print(profiler.handle_command("/profileUpdates $$$3$$$", -100))
+        for update_id in range(5, 10):
+            with profiler.update():
+                handle(update_id)
+            if profiler.finished:
+                chat_id, caption, path = profiler.dump()
+                print(caption.replace(directory, "<dir>"), "for chat", chat_id)
+                with open(path) as f:
+                    print("".join(f.readlines()[:12]))
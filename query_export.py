@@ -0,0 +1,219 @@
+"""
+Exports and retention of the query log (query_log.py).
+
+Daily queries/YYYYMMDD.csv files older than QUERY_RETENTION_DAYS are compacted, a whole month
+at a time, into queries/archive/YYYYMM.csv.gz. iter_queries() reads archives and daily files
+alike, one row at a time, and export_queries() streams the rows of a date range into a gzip
+compressed CSV or JSONL file, so memory use doesn't depend on how many queries are exported.
+Export files are temporary, whoever sends them deletes them afterwards.
+"""
+import os
+import csv
+import gzip
+import json
+import tempfile
+import asyncio
+import logging
+import datetime
+
+from query_log import QUERIES_DIR, FIELDNAMES
+from shared_state import file_lock
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+QUERY_RETENTION_DAYS = getattr(_config, "QUERY_RETENTION_DAYS", 60)
+# How often the bot looks for months to compact.
+QUERY_COMPACT_INTERVAL = getattr(_config, "QUERY_COMPACT_INTERVAL", 6 * 3600)
+ARCHIVE_DIR = "archive"
+EXPORT_FORMATS = ("csv", "jsonl")
+
+def parse_day(value: str) -> datetime.date:
+    """Accepts 2025-03-01 as well as the 20250301 of the daily file names."""
+    value = value.strip()
+    try:
+        if len(value) == 8 and value.isdigit():
+            return datetime.datetime.strptime(value, "%Y%m%d").date()
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid date '{value}', use YYYY-MM-DD.") from None
+
+def _daily_path(directory: str, day: datetime.date) -> str:
+    return os.path.join(directory, f"{day:%Y%m%d}.csv")
+
+def _archive_path(directory: str, year: int, month: int) -> str:
+    return os.path.join(directory, ARCHIVE_DIR, f"{year:04d}{month:02d}.csv.gz")
+
+def _months(start: datetime.date, end: datetime.date):
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+def _days_of_month(year: int, month: int):
+    day = datetime.date(year, month, 1)
+    while day.month == month:
+        yield day
+        day += datetime.timedelta(days=1)
+
+def _read_rows(file):
+    for row in csv.DictReader(file):
+        # Rows cut short by a crash while they were written.
+        if None in row.values():
+            continue
+        yield row
+
+def iter_month(directory: str, year: int, month: int):
+    """Rows of a month, oldest first: its archive if there is one, then daily files not in it."""
+    archived_dates = set()
+    archive = _archive_path(directory, year, month)
+    if os.path.exists(archive):
+        with gzip.open(archive, "rt", newline="", encoding="utf-8") as f:
+            for row in _read_rows(f):
+                archived_dates.add(row["date"])
+                yield row
+    for day in _days_of_month(year, month):
+        path = _daily_path(directory, day)
+        # A compaction that crashed before deleting its daily files leaves them next to the archive.
+        if f"{day:%Y%m%d}" in archived_dates or not os.path.exists(path):
+            continue
+        with open(path, "r", newline="", encoding="utf-8") as f:
+            yield from _read_rows(f)
+
+def stored_days(directory=QUERIES_DIR):
+    """(first, last) day that daily files and archives in directory can hold queries of, None if there are none."""
+    days = []
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        if len(name) == 12 and name.endswith(".csv") and name[:8].isdigit():
+            days.append(parse_day(name[:8]))
+    archive_dir = os.path.join(directory, ARCHIVE_DIR)
+    for name in os.listdir(archive_dir) if os.path.isdir(archive_dir) else []:
+        if len(name) == 13 and name.endswith(".csv.gz") and name[:6].isdigit():
+            year, month = int(name[:4]), int(name[4:6])
+            days.append(datetime.date(year, month, 1))
+            days.append(list(_days_of_month(year, month))[-1])
+    return (min(days), max(days)) if days else None
+
+def iter_queries(start: datetime.date, end: datetime.date, chat_id=None, user_id=None, directory=QUERIES_DIR):
+    """Queries from start to end (inclusive), optionally only those of one chat and/or user."""
+    first, last = f"{start:%Y%m%d}", f"{end:%Y%m%d}"
+    chat_id = str(chat_id) if chat_id is not None else None
+    user_id = str(user_id) if user_id is not None else None
+    for year, month in _months(start, end):
+        for row in iter_month(directory, year, month):
+            if not first <= row["date"] <= last:
+                continue
+            if chat_id is not None and row["chat_id"] != chat_id:
+                continue
+            if user_id is not None and row["user_id"] != user_id:
+                continue
+            yield row
+
+def export_queries(start: datetime.date, end: datetime.date, file_format="csv", chat_id=None, user_id=None,
+                   directory=QUERIES_DIR, export_dir=None) -> tuple:
+    """
+    Writes the matching queries to a new gzip file in export_dir (default: the system's temporary
+    directory) and returns (path, number of rows). The caller deletes the file when it's done with it.
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Format must be one of: {', '.join(EXPORT_FORMATS)}.")
+    fd, path = tempfile.mkstemp(prefix=f"queries_{start:%Y%m%d}_{end:%Y%m%d}_", suffix=f".{file_format}.gz", dir=export_dir)
+    os.close(fd)
+    count = 0
+    rows = iter_queries(start, end, chat_id, user_id, directory)
+    try:
+        with gzip.open(path, "wt", newline="", encoding="utf-8") as f:
+            if file_format == "csv":
+                writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+            else:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    count += 1
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, count
+
+def compact(directory=QUERIES_DIR, retention_days=QUERY_RETENTION_DAYS, today=None) -> list:
+    """
+    Moves the daily files of every month that ended more than retention_days ago into the
+    month's archive. Returns the archived months as "YYYYMM".
+    """
+    today = today or datetime.date.today()
+    cutoff = today - datetime.timedelta(days=retention_days)
+    months = set()
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        if len(name) == 12 and name.endswith(".csv") and name[:8].isdigit():
+            day = parse_day(name[:8])
+            last_day = (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1) - datetime.timedelta(days=1)
+            if last_day < cutoff:
+                months.add((day.year, day.month))
+    compacted = []
+    for year, month in sorted(months):
+        with file_lock("queries"):
+            archive = _archive_path(directory, year, month)
+            os.makedirs(os.path.dirname(archive), exist_ok=True)
+            tmp_path = archive + ".tmp"
+            # The month is rewritten as a whole, rows of an existing archive included, then swapped in.
+            with gzip.open(tmp_path, "wt", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+                writer.writeheader()
+                for row in iter_month(directory, year, month):
+                    writer.writerow(row)
+            os.replace(tmp_path, archive)
+            for day in _days_of_month(year, month):
+                path = _daily_path(directory, day)
+                if os.path.exists(path):
+                    os.remove(path)
+        compacted.append(f"{year:04d}{month:02d}")
+        logging.info(f"Compacted the queries of {year:04d}-{month:02d} into {archive}")
+    return compacted
+
+async def retention_loop(interval=QUERY_COMPACT_INTERVAL):
+    """Compacts old months in a worker thread now and then, forever."""
+    while True:
+        try:
+            await asyncio.to_thread(compact)
+        except Exception as e:
+            logging.error(f"Failed to compact queries: {e}")
+        await asyncio.sleep(interval)
+
+if __name__ == "__main__":
+    # Writes 120 days of fake queries, compacts them and exports a range, measuring peak memory.
+    import tempfile
+    import tracemalloc
+
+    with tempfile.TemporaryDirectory() as directory:
+        queries_dir = os.path.join(directory, "queries")
+        os.makedirs(queries_dir)
+        first_day = datetime.date(2025, 1, 1)
+        for offset in range(120):
+            day = first_day + datetime.timedelta(days=offset)
+            with open(_daily_path(queries_dir, day), "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+                writer.writeheader()
+                for i in range(500):
+                    writer.writerow({"query_id": f"{day:%Y%m%d}-{i + 1:03d}-abcdef12", "date": f"{day:%Y%m%d}",
+                                     "time": "12:00:00", "user_id": str(i % 50), "username": f"user{i % 50}",
+                                     "chat_id": str(-1000 - i % 3), "chat_name": "Physics",
+                                     "message": "#query how do I solve this integral? " * 3})
+        size = sum(os.path.getsize(os.path.join(queries_dir, name)) for name in os.listdir(queries_dir))
+        print(f"120 daily files, {size / 1e6:.1f} MB")
+        print("compacted:", compact(queries_dir, retention_days=30, today=datetime.date(2025, 5, 10)))
+        archive_dir = os.path.join(queries_dir, ARCHIVE_DIR)
+        archived = sum(os.path.getsize(os.path.join(archive_dir, name)) for name in os.listdir(archive_dir))
+        print(f"left: {len(os.listdir(queries_dir)) - 1} daily files, archives: {archived / 1e6:.1f} MB")
+
+        tracemalloc.start()
+        path, count = export_queries(datetime.date(2025, 1, 15), datetime.date(2025, 4, 20), "jsonl",
+                                     chat_id=-1001, directory=queries_dir, export_dir=directory)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"exported {count} rows to {os.path.basename(path)} ({os.path.getsize(path) / 1e6:.1f} MB), "
+              f"peak memory {peak / 1e3:.0f} kB")
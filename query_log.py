@@ -0,0 +1,60 @@
+import os
+import csv
+import hashlib
+import datetime
+from shared_state import SHARED_STATE, file_lock
+
+QUERIES_DIR = "queries"
+FIELDNAMES = ['query_id', 'date', 'time', 'user_id', 'username', 'chat_id', 'chat_name', 'message']
+
+def generate_query_id(user_id, date_str):
+    """Generate a unique query ID based on date, time, and user ID"""
+    # Create queries directory if it doesn't exist
+    queries_dir = QUERIES_DIR
+    os.makedirs(queries_dir, exist_ok=True)
+    
+    # Number of today's queries, from a sequence shared by all bot workers so ids never collide.
+    # The sequence of a new day starts from the rows already in its CSV.
+    csv_path = os.path.join(queries_dir, f"{date_str}.csv")
+    def rows_in_csv():
+        if not os.path.exists(csv_path):
+            return 0
+        with open(csv_path, 'r', encoding='utf-8') as f:
+            return max(sum(1 for _ in f) - 1, 0)  # Subtract header row
+    query_count = SHARED_STATE.next_value(f"queries/{date_str}", start=rows_in_csv) - 1
+    
+    # Generate hash from current timestamp, user ID and query count
+    timestamp = datetime.datetime.now().timestamp()
+    hash_input = f"{timestamp}-{user_id}-{query_count}"
+    hash_object = hashlib.md5(hash_input.encode())
+    hash_hex = hash_object.hexdigest()[:8]  # Take first 8 chars of hash
+    
+    # Final ID format: YYYYMMDD-COUNT-HASH
+    return f"{date_str}-{query_count+1:03d}-{hash_hex}"
+
+def log_query_to_csv(query_id, user_id, username, date_str, time_str, 
+                    chat_id, chat_name, message_text):
+    """Log query details to a daily CSV file in the queries folder"""
+    # Create queries directory if it doesn't exist
+    queries_dir = QUERIES_DIR
+    os.makedirs(queries_dir, exist_ok=True)
+    
+    csv_path = os.path.join(queries_dir, f"{date_str}.csv")
+    # Held so two workers can't both write the header or interleave rows.
+    with file_lock("queries"), open(csv_path, 'a', newline='', encoding='utf-8') as csvfile:
+        file_exists = csvfile.tell() > 0
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
+        
+        if not file_exists:
+            writer.writeheader()
+        
+        writer.writerow({
+            'query_id': query_id,
+            'date': date_str,
+            'time': time_str,
+            'user_id': user_id,
+            'username': username,
+            'chat_id': chat_id,
+            'chat_name': chat_name,
+            'message': message_text
+        })
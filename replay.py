@@ -0,0 +1,357 @@
+"""
+Replays recorded traffic (logs.log "sent:" lines, or the query log with its archived months) through
+main.handle_message with fake Telegram objects and records what the bot did with every message.
+
+    python replay.py run --build . --log logs.log --out new.jsonl
+    python replay.py diff old.jsonl new.jsonl
+    python replay.py compare --old ../bot-old --new . --log logs.log
+
+`run` imports main.py from --build inside a scratch copy of its data files (slots_info,
+*_allowed_urls.txt), so nothing in the build directory is modified. config.py has to be importable from --build.
+Time is virtual: datetime.now() in the bot returns the recorded timestamp of the message being replayed,
+so #doubt routing is evaluated at the original time. --speed N sleeps 1/N of the recorded gaps (default: no sleeping).
+Admin commands are skipped unless --include-commands is given, they may write to Google Sheets.
+"""
+import os
+import re
+import sys
+import csv
+import glob
+import json
+import time
+import types
+import shutil
+import asyncio
+import argparse
+import datetime
+import tempfile
+import subprocess
+import statistics
+
+LOG_LINE = re.compile(
+    r"^(?P<ts>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - INFO - (?P<username>.*?) whose id is (?P<user_id>-?\d+) "
+    r"who is a (?P<status>\w+) in chat '(?P<chat>.*)' sent: (?P<text>.*)$"
+)
+QUERY_ID = re.compile(r"\d{8}-\d{3}-[0-9a-f]{8}")
+
+# --- recorded traffic ---
+
+def _chat_ids_by_name(queries_dir, slots_dir):
+    """Chat names are all the log has, query CSVs and slots_info know which id belongs to which name."""
+    ids = {}
+    for path in glob.glob(os.path.join(slots_dir, "*.json")):
+        try:
+            with open(path) as f:
+                for channel in json.load(f).get("channels", []):
+                    ids[channel.get("name")] = int(channel["id"])
+        except (ValueError, KeyError, OSError):
+            continue
+    for row in _iter_query_rows(queries_dir):
+        ids[row["chat_name"]] = int(row["chat_id"])
+    return ids
+
+def _synthetic_chat_id(name: str) -> int:
+    return -1_000_000_000_000 - (sum(ord(char) * 31 ** i for i, char in enumerate(name[:16])) % 1_000_000_000)
+
+def iter_log_records(log_path, chat_ids):
+    """Yields one record per message logged by handle_message, in file order."""
+    with open(log_path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            match = LOG_LINE.match(line.rstrip("\n"))
+            if not match:
+                continue
+            chat = match.group("chat")
+            yield {
+                "timestamp": datetime.datetime.strptime(match.group("ts"), "%Y-%m-%d %H:%M:%S,%f"),
+                "username": match.group("username"),
+                "user_id": int(match.group("user_id")),
+                "status": match.group("status"),
+                "chat_name": chat,
+                "chat_id": chat_ids.get(chat) or _synthetic_chat_id(chat),
+                "text": match.group("text").replace("\\n", "\n"),
+            }
+
+def _iter_query_rows(queries_dir):
+    """Rows of the query log, archived months included. Only call once main is imported from the build."""
+    try:
+        import query_export
+    except ImportError:
+        # Builds from before the archives only have daily files.
+        for path in sorted(glob.glob(os.path.join(queries_dir, "*.csv"))):
+            with open(path, newline="", encoding="utf-8") as f:
+                yield from csv.DictReader(f)
+        return
+    days = query_export.stored_days(queries_dir)
+    if days:
+        yield from query_export.iter_queries(*days, directory=queries_dir)
+
+def iter_query_records(queries_dir):
+    """Yields the messages recorded in the query log (always sent by members)."""
+    for row in _iter_query_rows(queries_dir):
+        yield {
+            "timestamp": datetime.datetime.strptime(row["date"] + row["time"], "%Y%m%d%H:%M:%S"),
+            "username": row["username"],
+            "user_id": int(row["user_id"]),
+            "status": "member",
+            "chat_name": row["chat_name"],
+            "chat_id": int(row["chat_id"]),
+            "text": row["message"],
+        }
+
+# --- fake Telegram objects ---
+
+class ReplayClock:
+    def __init__(self):
+        self.current = datetime.datetime.now()
+        self.start = self.current
+
+    def monotonic(self) -> float:
+        return (self.current - self.start).total_seconds()
+
+def _datetime_shim(clock: ReplayClock):
+    class ReplayDateTime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            current = clock.current
+            return current if tz is None else current.astimezone(tz)
+
+    class ReplayDate(datetime.date):
+        @classmethod
+        def today(cls):
+            return clock.current.date()
+
+    return types.SimpleNamespace(datetime=ReplayDateTime, date=ReplayDate, time=datetime.time,
+                                 timedelta=datetime.timedelta, timezone=datetime.timezone)
+
+class FakeMember:
+    def __init__(self, status):
+        self.status = status
+
+class FakeUser:
+    def __init__(self, user_id, username):
+        self.id = user_id
+        self.username = None if username == "None" else username
+        self.is_bot = False
+
+class FakeChat:
+    type = "supergroup"
+
+    def __init__(self, chat_id, title, status, result):
+        self.id = chat_id
+        self.title = title
+        self._status = status
+        self._result = result
+
+    async def get_member(self, user_id):
+        self._result["api_calls"] += 1
+        return FakeMember(self._status)
+
+    async def restrict_member(self, *args, **kwargs):
+        self._result["api_calls"] += 1
+        self._result["muted"] = True
+
+class FakeMessage:
+    def __init__(self, message_id, record, chat, result):
+        self.message_id = message_id
+        self.text = record["text"]
+        self.caption = None
+        self.chat = chat
+        self.chat_id = chat.id
+        self.from_user = FakeUser(record["user_id"], record["username"])
+        self.date = record["timestamp"]
+        # Logs don't record which message a message replied to.
+        self.reply_to_message = None
+        self._result = result
+
+    async def reply_text(self, text, **kwargs):
+        self._result["api_calls"] += 1
+        self._result["replies"].append(text)
+
+    async def reply_document(self, document=None, caption=None, **kwargs):
+        self._result["api_calls"] += 1
+        self._result["replies"].append(f"<document> {caption or ''}".strip())
+
+    async def delete(self):
+        self._result["api_calls"] += 1
+        self._result["deleted"] = True
+        return True
+
+class FakeUpdate:
+    def __init__(self, message):
+        self.message = message
+        self.edited_message = None
+        self.effective_message = message
+        self.effective_chat = message.chat
+        self.effective_user = message.from_user
+
+# --- commands ---
+
+def prepare_workdir(build_dir):
+    """Scratch directory with copies of the data files of build_dir, for a bot that must not touch them."""
+    work_dir = tempfile.mkdtemp(prefix="bot_replay_")
+    for path in glob.glob(os.path.join(build_dir, "*_allowed_urls.txt")):
+        shutil.copy(path, work_dir)
+    if os.path.isdir(os.path.join(build_dir, "slots_info")):
+        shutil.copytree(os.path.join(build_dir, "slots_info"), os.path.join(work_dir, "slots_info"))
+    return work_dir
+
+async def _replay(records, main_module, clock, out, speed, include_commands, limit):
+    count = 0
+    previous = None
+    for record in records:
+        if limit and count >= limit:
+            break
+        if record["text"].startswith("/") and not include_commands:
+            continue
+        if speed and previous is not None:
+            gap = (record["timestamp"] - previous).total_seconds() / speed
+            if gap > 0:
+                await asyncio.sleep(gap)
+        previous = record["timestamp"]
+        clock.current = record["timestamp"]
+
+        result = {"index": count, "timestamp": record["timestamp"].isoformat(), "chat_id": record["chat_id"],
+                  "user_id": record["user_id"], "text": record["text"], "deleted": False, "muted": False,
+                  "replies": [], "api_calls": 0, "error": None}
+        chat = FakeChat(record["chat_id"], record["chat_name"], record["status"], result)
+        update = FakeUpdate(FakeMessage(count + 1, record, chat, result))
+        start = time.perf_counter()
+        try:
+            await main_module.handle_message(update, None)
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["elapsed_us"] = round((time.perf_counter() - start) * 1e6, 1)
+        out.write(json.dumps(result) + "\n")
+        count += 1
+    return count
+
+def command_run(args):
+    build_dir = os.path.abspath(args.build)
+    log_path = os.path.abspath(args.log) if args.log else None
+    queries_dir = os.path.abspath(args.queries)
+    out_path = os.path.abspath(args.out)
+
+    work_dir = prepare_workdir(build_dir)
+    os.chdir(work_dir)
+    sys.path.insert(0, build_dir)
+    try:
+        import main as main_module
+    except SystemExit:
+        sys.exit(f"Could not import main.py from {build_dir} (is config.py there?)")
+    # The query log is read with the build's own query_export, so only now that main is imported.
+    chat_ids = _chat_ids_by_name(queries_dir, os.path.join(build_dir, "slots_info"))
+
+    clock = ReplayClock()
+    shim = _datetime_shim(clock)
+    for name in ("main", "helpers", "query_log"):
+        module = sys.modules.get(name)
+        if module is not None and getattr(module, "datetime", None) is datetime:
+            module.datetime = shim
+    flood_detector = getattr(main_module, "FLOOD_DETECTOR", None)
+    if flood_detector is not None:
+        flood_detector.clock = clock.monotonic
+
+    records = iter_log_records(log_path, chat_ids) if log_path else iter_query_records(queries_dir)
+    try:
+        with open(out_path, "w") as out:
+            count = asyncio.run(_replay(records, main_module, clock, out, args.speed,
+                                        args.include_commands, args.limit))
+    finally:
+        os.chdir("/")
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"Replayed {count} messages from {build_dir} into {out_path}")
+
+def _normalize_replies(replies):
+    return [QUERY_ID.sub("<query-id>", reply) for reply in replies]
+
+def _timing_summary(timings):
+    if not timings:
+        return "no messages"
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(0.99 * (len(timings) - 1)))]
+    return (f"total {sum(timings) / 1e3:.1f} ms, median {statistics.median(timings):.1f} us, "
+            f"p99 {p99:.1f} us, max {timings[-1]:.1f} us")
+
+def command_diff(args):
+    mismatches = 0
+    total = 0
+    old_timings, new_timings = [], []
+    with open(args.old_results) as old_file, open(args.new_results) as new_file:
+        for old_line, new_line in zip(old_file, new_file):
+            old, new = json.loads(old_line), json.loads(new_line)
+            total += 1
+            old_timings.append(old["elapsed_us"])
+            new_timings.append(new["elapsed_us"])
+            differences = []
+            for key in ("deleted", "muted", "error"):
+                if old[key] != new[key]:
+                    differences.append(f"{key}: {old[key]} -> {new[key]}")
+            if _normalize_replies(old["replies"]) != _normalize_replies(new["replies"]):
+                differences.append(f"replies: {old['replies']} -> {new['replies']}")
+            if differences:
+                mismatches += 1
+                if mismatches <= args.show:
+                    print(f"#{old['index']} {old['timestamp']} chat {old['chat_id']} user {old['user_id']}: "
+                          f"{old['text'][:120]!r}")
+                    for difference in differences:
+                        print(f"    {difference}")
+    print(f"\n{total} messages compared, {mismatches} with different behaviour.")
+    print(f"old: {_timing_summary(old_timings)}")
+    print(f"new: {_timing_summary(new_timings)}")
+    return 1 if mismatches else 0
+
+def command_compare(args):
+    results_dir = tempfile.mkdtemp(prefix="bot_replay_results_")
+    outputs = []
+    for name, build in (("old", args.old), ("new", args.new)):
+        out = os.path.join(results_dir, f"{name}.jsonl")
+        command = [sys.executable, os.path.abspath(__file__), "run", "--build", build,
+                   "--queries", args.queries, "--out", out, "--limit", str(args.limit)]
+        if args.log:
+            command += ["--log", args.log]
+        if args.include_commands:
+            command.append("--include-commands")
+        subprocess.run(command, check=True)
+        outputs.append(out)
+    diff_args = argparse.Namespace(old_results=outputs[0], new_results=outputs[1], show=args.show)
+    status = command_diff(diff_args)
+    print(f"Per message results kept in {results_dir}")
+    return status
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded traffic through the bot and compare builds.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_source_arguments(sub):
+        sub.add_argument("--log", help="logs.log to replay (default: replay the query log instead)")
+        sub.add_argument("--queries", default="queries", help="queries directory, also used to map chat names to ids")
+        sub.add_argument("--limit", type=int, default=0, help="stop after this many messages (0 = all)")
+        sub.add_argument("--include-commands", action="store_true", help="also replay admin commands")
+
+    run = subparsers.add_parser("run", help="replay traffic through one build")
+    run.add_argument("--build", default=".", help="directory containing the main.py to test")
+    run.add_argument("--out", required=True, help="JSON lines file with one result per message")
+    run.add_argument("--speed", type=float, default=0, help="replay N times faster than real time (0 = no waiting)")
+    add_source_arguments(run)
+
+    diff = subparsers.add_parser("diff", help="compare the results of two runs")
+    diff.add_argument("old_results")
+    diff.add_argument("new_results")
+    diff.add_argument("--show", type=int, default=20, help="how many differences to print")
+
+    compare = subparsers.add_parser("compare", help="run two builds on the same traffic and diff them")
+    compare.add_argument("--old", required=True, help="directory of the old build")
+    compare.add_argument("--new", default=".", help="directory of the new build")
+    compare.add_argument("--show", type=int, default=20)
+    add_source_arguments(compare)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        command_run(args)
+    elif args.command == "diff":
+        sys.exit(command_diff(args))
+    else:
+        sys.exit(command_compare(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Mentor schedules compiled for fast "who is on duty" lookups.
+
+A slot can be limited to some weekdays ("days": ["mon-fri"]) and a group can replace its
+usual timings on some dates ("overrides": [{"from": "2025-12-25", "to": "2025-12-26", "timings": []}]).
+Times are wall clock times in the group's "timezone" (SCHEDULE_TIMEZONE if it has none).
+
+Each distinct day is compiled once into a DayPlan: the boundaries where the set of active
+slots changes, with that set for every segment, and the sorted slot starts. A Schedule holds
+the plans of the seven weekdays, and of the weekdays of every override, found by bisecting
+the override dates. Looking up "active now" or "next up" is a couple of bisects, slots that
+run past midnight are found through the previous day's plan, so Sunday night slots carry
+over into Monday.
+"""
+import datetime
+from bisect import bisect_right
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+SCHEDULE_TIMEZONE = getattr(_config, "SCHEDULE_TIMEZONE", "Asia/Kolkata")
+
+DAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+ALL_DAYS = 0b1111111
+DAY_ALIASES = {"daily": ALL_DAYS, "weekdays": 0b0011111, "weekends": 0b1100000}
+DAY_MINUTES = 24 * 60
+
+def _day_index(name: str) -> int:
+    key = name.strip().lower()[:3]
+    if key not in DAY_NAMES:
+        raise ValueError(f"Unknown day '{name}', use mon, tue, wed, thu, fri, sat or sun.")
+    return DAY_NAMES.index(key)
+
+def parse_days(value) -> int:
+    """
+    Bit mask of the weekdays in value (bit 0 is Monday). value is a list or a comma separated
+    string of day names, ranges like "mon-fri" or daily/weekdays/weekends. None means every day.
+    """
+    if value is None:
+        return ALL_DAYS
+    items = value.split(",") if isinstance(value, str) else value
+    if not isinstance(items, list):
+        raise ValueError("'days' must be a list of day names.")
+    mask = 0
+    for item in items:
+        item = str(item).strip().lower()
+        if item in DAY_ALIASES:
+            mask |= DAY_ALIASES[item]
+        elif "-" in item:
+            first, last = (_day_index(part) for part in item.split("-", 1))
+            day = first
+            while True:
+                mask |= 1 << day
+                if day == last:
+                    break
+                day = (day + 1) % 7
+        else:
+            mask |= 1 << _day_index(item)
+    if not mask:
+        raise ValueError("'days' must name at least one day.")
+    return mask
+
+def format_days(mask: int) -> str:
+    """Short label for a day mask, "" for every day."""
+    if mask == ALL_DAYS:
+        return ""
+    for alias, alias_mask in DAY_ALIASES.items():
+        if mask == alias_mask:
+            return alias.capitalize()
+    return ", ".join(DAY_NAMES[day].capitalize() for day in range(7) if mask & (1 << day))
+
+def parse_date(value, what: str) -> datetime.date:
+    try:
+        return datetime.date.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f"{what} must be a date like 2025-12-25, got '{value}'.") from None
+
+def get_timezone(name):
+    """ZoneInfo for name (SCHEDULE_TIMEZONE if None), raises ValueError for unknown zones."""
+    name = name or SCHEDULE_TIMEZONE
+    try:
+        return ZoneInfo(str(name))
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone '{name}', use a name like Asia/Kolkata.") from None
+
+def _segment_index(intervals):
+    """Boundaries and active slots of every segment between them, for [start, end) intervals."""
+    changes = {}
+    for start, end, order, slot in intervals:
+        changes.setdefault(start, []).append((order, slot, True))
+        changes.setdefault(end, []).append((order, slot, False))
+    bounds = sorted(changes)
+    segments = []
+    active = {}
+    for point in bounds[:-1]:
+        for order, slot, starts in changes[point]:
+            if starts:
+                active[order] = slot
+            else:
+                active.pop(order, None)
+        segments.append(tuple(active[order] for order in sorted(active)))
+    return bounds, segments
+
+def _lookup(bounds, segments, minutes: float) -> tuple:
+    i = bisect_right(bounds, minutes) - 1
+    if 0 <= i < len(segments):
+        return segments[i]
+    return ()
+
+class DayPlan:
+    """The slots of one day, compiled. Slots ending before they start run past midnight into the next day."""
+    __slots__ = ("bounds", "segments", "spill_bounds", "spill_segments", "starts", "start_slots")
+
+    def __init__(self, slots):
+        today, spill, starts = [], [], {}
+        for order, slot in enumerate(slots):
+            if slot.start is None or slot.end is None:
+                continue
+            if slot.start < slot.end:
+                today.append((slot.start, slot.end, order, slot))
+            elif slot.start > slot.end:
+                today.append((slot.start, DAY_MINUTES, order, slot))
+                if slot.end:
+                    spill.append((0, slot.end, order, slot))
+            # start == end is an empty interval, same as helpers.is_time_in_interval.
+            starts.setdefault(slot.start, []).append(slot)
+        self.bounds, self.segments = _segment_index(today)
+        self.spill_bounds, self.spill_segments = _segment_index(spill)
+        self.starts = sorted(starts)
+        self.start_slots = [tuple(starts[start]) for start in self.starts]
+
+    def active(self, minutes: float) -> tuple:
+        """Slots of this day running at minutes since midnight."""
+        return _lookup(self.bounds, self.segments, minutes)
+
+    def spilled(self, minutes: float) -> tuple:
+        """Slots of this day still running at minutes since midnight of the next day."""
+        return _lookup(self.spill_bounds, self.spill_segments, minutes)
+
+    def next_after(self, minutes: float) -> tuple:
+        """Slots with the earliest start after minutes, () if none start later this day."""
+        i = bisect_right(self.starts, minutes)
+        return self.start_slots[i] if i < len(self.starts) else ()
+
+    def __bool__(self):
+        return bool(self.starts)
+
+class Schedule:
+    """
+    Compiled timings and overrides of a group. timings/overrides are the lists it was built
+    from, models.Channel compares them to its own to notice when the schedule is stale.
+    """
+    __slots__ = ("timings", "overrides", "tzinfo", "weekly", "override_starts", "override_ends", "override_plans")
+
+    def __init__(self, timings: list, overrides, tzinfo):
+        self.timings = timings
+        self.overrides = overrides
+        self.tzinfo = tzinfo
+        plans = {}
+        self.weekly = self._week(timings, plans)
+        ordered = sorted(overrides or [], key=lambda override: override.first)
+        self.override_starts = [override.first.toordinal() for override in ordered]
+        self.override_ends = [override.last.toordinal() for override in ordered]
+        self.override_plans = [self._week(override.timings, plans) for override in ordered]
+
+    @staticmethod
+    def _week(timings: list, plans: dict) -> list:
+        """DayPlans of the seven weekdays, days with the same slots share one."""
+        week = []
+        for day in range(7):
+            day_slots = [slot for slot in timings if slot.days & (1 << day)]
+            key = tuple(map(id, day_slots))
+            if key not in plans:
+                plans[key] = DayPlan(day_slots)
+            week.append(plans[key])
+        return week
+
+    def plan_for(self, date: datetime.date) -> DayPlan:
+        day = date.toordinal()
+        i = bisect_right(self.override_starts, day) - 1
+        if i >= 0 and day <= self.override_ends[i]:
+            return self.override_plans[i][date.weekday()]
+        return self.weekly[date.weekday()]
+
+    def local(self, now: datetime.datetime) -> datetime.datetime:
+        """now as wall clock time of the group, naive datetimes are taken to already be."""
+        return now.astimezone(self.tzinfo) if now.tzinfo is not None else now
+
+    def active_at(self, now: datetime.datetime) -> list:
+        local = self.local(now)
+        minutes = local.hour * 60 + local.minute + local.second / 60 + local.microsecond / 60_000_000
+        today = local.date()
+        return [*self.plan_for(today).active(minutes),
+                *self.plan_for(today - datetime.timedelta(days=1)).spilled(minutes)]
+
+    def next_at(self, now: datetime.datetime) -> list:
+        """Slots with the earliest start after now, looking ahead through the following days."""
+        local = self.local(now)
+        minutes = local.hour * 60 + local.minute + local.second / 60 + local.microsecond / 60_000_000
+        today = local.date()
+        slots = self.plan_for(today).next_after(minutes)
+        if slots:
+            return list(slots)
+        # Past the last override every week repeats, so a week after it there's nothing new to find.
+        horizon = max(self.override_ends, default=today.toordinal()) - today.toordinal() + 7
+        for offset in range(1, max(horizon, 7) + 1):
+            plan = self.plan_for(today + datetime.timedelta(days=offset))
+            if plan:
+                return list(plan.start_slots[0])
+        return []
+
+if __name__ == "__main__":
+    import time
+    import models
+
+    channel = models.Channel.from_dict({
+        "id": "-100", "name": "Physics", "timezone": "Asia/Kolkata",
+        "timings": [
+            {"time": "10 AM - 1 PM", "name": "Het", "user_id": "@het", "days": ["mon-fri"]},
+            {"time": "11 PM - 2 AM", "name": "Owl", "user_id": "@owl", "days": "sun"},
+            {"time": "6 PM - 8 PM", "name": "Sam", "user_id": "@sam", "days": "weekends"},
+        ],
+        "overrides": [{"from": "2025-12-25", "to": "2025-12-26", "timings": [], "note": "Holiday"}],
+    })
+    ist = channel.tzinfo
+    cases = [
+        datetime.datetime(2025, 12, 22, 11, 0, tzinfo=ist),   # Monday morning
+        datetime.datetime(2025, 12, 22, 1, 0, tzinfo=ist),    # Monday 1 AM, Sunday's night slot
+        datetime.datetime(2025, 12, 24, 14, 0, tzinfo=ist),   # Wednesday afternoon, holiday next
+        datetime.datetime(2025, 12, 21, 5, 30, tzinfo=datetime.timezone.utc),  # Sunday 11 AM IST
+    ]
+    for now in cases:
+        active = [slot.name for slot in channel.schedule.active_at(now)]
+        upcoming = [slot.name for slot in channel.schedule.next_at(now)]
+        print(f"{channel.schedule.local(now):%a %d %b %H:%M}: active {active}, next {upcoming}")
+
+    many = models.Channel.from_dict({"id": "-1", "timings": [
+        {"time": f"{i % 12 or 12} {'AM' if i % 24 < 12 else 'PM'} - {(i + 2) % 12 or 12} {'AM' if (i + 2) % 24 < 12 else 'PM'}",
+         "name": f"M{i}", "user_id": f"@m{i}", "days": [DAY_NAMES[i % 7]]} for i in range(500)]})
+    now = datetime.datetime(2025, 12, 22, 15, 7)
+    start = time.perf_counter()
+    for _ in range(10000):
+        many.schedule.active_at(now)
+        many.schedule.next_at(now)
+    print(f"{len(many.timings)} slots: {(time.perf_counter() - start) / 10000 * 1e6:.1f} us per active + next lookup")
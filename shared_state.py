@@ -0,0 +1,156 @@
+"""
+State shared by bot processes on the same machine, so several workers (see update_router.py)
+can run side by side without corrupting each other's files.
+
+file_lock() serializes read-modify-write cycles on plain files: the groups data in slots_info,
+the manual allowlist, the daily query CSVs and the analytics checkpoint. SharedState is a
+SQLite file in WAL mode with the query id sequences and a change counter per topic. Saving the
+groups data bumps "channels" and every worker reloads when it sees the counter move.
+"""
+import os
+import asyncio
+import sqlite3
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows, locks then only hold between threads of one process.
+    fcntl = None
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+SHARED_STATE_FILE = getattr(_config, "SHARED_STATE_FILE", "shared_state.sqlite3")
+LOCKS_DIR = getattr(_config, "LOCKS_DIR", ".locks")
+# How often workers check for changes made by other workers.
+CHANGES_POLL_SECONDS = getattr(_config, "CHANGES_POLL_SECONDS", 2)
+
+class FileLock:
+    """
+    Exclusive lock held through flock on LOCKS_DIR/<name>.lock. Reentrant within a thread, so a
+    command holding the groups data lock can still call code that takes it again.
+    """
+
+    def __init__(self, name: str):
+        self.path = os.path.join(LOCKS_DIR, name + ".lock")
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                os.makedirs(LOCKS_DIR, exist_ok=True)
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+def file_lock(name: str) -> FileLock:
+    """The process wide FileLock called name."""
+    with _file_locks_guard:
+        lock = _file_locks.get(name)
+        if lock is None:
+            lock = _file_locks[name] = FileLock(name)
+        return lock
+
+class SharedState:
+    def __init__(self, path=SHARED_STATE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        """The connection, opened on first use so that importing a module creates no file. Call with _lock held."""
+        if self._db is None:
+            # timeout: seconds to wait for another process's write transaction instead of failing.
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS changes (topic TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            self._db = db
+        return self._db
+
+    def next_value(self, name: str, start=0) -> int:
+        """
+        Increments sequence name and returns its new value, unique across processes. start is
+        the value before the first increment, or a function returning it (called only then).
+        """
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT value FROM sequences WHERE name = ?", (name,)).fetchone()
+                value = (row[0] if row else (start() if callable(start) else start)) + 1
+                db.execute("INSERT OR REPLACE INTO sequences (name, value) VALUES (?, ?)", (name, value))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return value
+
+    def publish(self, topic: str) -> int:
+        """Tells the other workers that topic changed."""
+        with self._lock:
+            return self._connect().execute(
+                "INSERT INTO changes (topic, version) VALUES (?, 1) "
+                "ON CONFLICT(topic) DO UPDATE SET version = version + 1 RETURNING version", (topic,)).fetchone()[0]
+
+    def version(self, topic: str) -> int:
+        with self._lock:
+            row = self._connect().execute("SELECT version FROM changes WHERE topic = ?", (topic,)).fetchone()
+        return row[0] if row else 0
+
+    async def watch(self, topic: str, callback, interval=CHANGES_POLL_SECONDS):
+        """Calls callback() in a worker thread whenever topic changes, forever."""
+        seen = await asyncio.to_thread(self.version, topic)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                version = await asyncio.to_thread(self.version, topic)
+                if version != seen:
+                    seen = version
+                    await asyncio.to_thread(callback)
+            except Exception as e:
+                logging.error(f"Failed to reload after a change of {topic}: {e}")
+
+SHARED_STATE = SharedState()
+
+if __name__ == "__main__":
+    # Several processes drawing from one sequence never get the same value.
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    def draw(path, count):
+        state = SharedState(path)
+        return [state.next_value("demo", start=100) for _ in range(count)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "state.sqlite3")
+        # Creates the file (and switches it to WAL) before the processes start drawing.
+        SharedState(path).version("demo")
+        with ProcessPoolExecutor(4) as executor:
+            values = [value for chunk in executor.map(draw, [path] * 4, [250] * 4) for value in chunk]
+        print(f"{len(values)} values from 4 processes, {len(set(values))} unique, range {min(values)}-{max(values)}")
+        state = SharedState(path)
+        print("channels version:", state.version("channels"), "->", state.publish("channels"), state.publish("channels"))
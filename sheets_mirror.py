@@ -0,0 +1,205 @@
+"""
+Local copy of the timing tables in the Google Sheet, so /updateDatabase only downloads them
+when somebody edited the spreadsheet since the last sync.
+
+sync() first asks Drive for the spreadsheet's modifiedTime (one small request). If it's the
+revision the mirror was taken at, nothing else is fetched. Otherwise, or when Drive can't be
+asked (the credentials lack a Drive scope), all subject worksheets are read with one batch
+request and compared by fingerprint, only worksheets whose fingerprint moved count as changed.
+The mirror is kept in SHEETS_MIRROR_FILE and also answers reads for /diffSheets.
+"""
+import os
+import json
+import hashlib
+import logging
+
+import updater
+from shared_state import file_lock
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+SHEETS_MIRROR_FILE = getattr(_config, "SHEETS_MIRROR_FILE", "sheets_mirror.json")
+# Layout written by updater.create_table: a group every 5 columns, its timings from row 4 on.
+BLOCK_WIDTH = 5
+DATA_START_ROW = 4
+
+def parse_block(rows: list) -> list:
+    """Timing dicts from the rows of a group's block (From, To, mentor id, mentor name)."""
+    timings = []
+    for row in rows:
+        if len(row) < 4 or row[0].strip() == "":
+            continue
+        from_time = row[0].strip()
+        to_time = row[1].strip()
+        mentor_id = row[2].strip()
+        if mentor_id and not mentor_id.startswith("@"):
+            mentor_id = "@" + mentor_id
+        timings.append({"time": f"{from_time} - {to_time}", "name": row[3].strip(), "user_id": mentor_id})
+    return timings
+
+def fingerprint(values: list) -> str:
+    return hashlib.blake2b(json.dumps(values, separators=(",", ":")).encode(), digest_size=16).hexdigest()
+
+def revision_of(workbook):
+    """modifiedTime of the spreadsheet from Drive, None if it can't be read."""
+    try:
+        getter = getattr(workbook, "get_lastUpdateTime", None)
+        return getter() if getter is not None else workbook.lastUpdateTime
+    except Exception as e:
+        logging.info(f"Spreadsheet revision unavailable, comparing fingerprints instead: {e}")
+        return None
+
+def _quote(title: str) -> str:
+    return "'" + title.replace("'", "''") + "'"
+
+class SheetsMirror:
+    def __init__(self, path=SHEETS_MIRROR_FILE):
+        self.path = path
+        self.revision = None
+        # {subject: {"fingerprint": ..., "rows": rows from DATA_START_ROW on, all columns}}
+        self.worksheets = {}
+        # Version of the groups data (snapshots.SNAPSHOTS) last made equal to the mirror,
+        # and the fingerprints the mirror had then.
+        self.applied = {"version": None, "fingerprints": {}}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.revision = state.get("revision")
+        self.worksheets = state.get("worksheets", {})
+        self.applied = state.get("applied", self.applied)
+
+    def save(self):
+        state = {"revision": self.revision, "applied": self.applied, "worksheets": self.worksheets}
+        with file_lock("sheets_mirror"):
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+
+    def sync(self, workbook, subjects, force=False) -> tuple:
+        """
+        Brings the mirror of subjects' worksheets up to date.
+        Returns (changed subjects, how it was checked: "revision" or "fingerprint").
+        """
+        subjects = sorted(set(subjects))
+        revision = None if force else revision_of(workbook)
+        if revision is not None and revision == self.revision and all(s in self.worksheets for s in subjects):
+            return [], "revision"
+
+        sheets = {sheet.title: sheet for sheet in workbook.worksheets()}
+        present = [subject for subject in subjects if subject in sheets]
+        ranges = [f"{_quote(subject)}!A{DATA_START_ROW}:{updater.num_to_col(sheets[subject].col_count)}"
+                  f"{max(sheets[subject].row_count, DATA_START_ROW)}" for subject in present]
+        value_ranges = workbook.values_batch_get(ranges).get("valueRanges", []) if ranges else []
+        changed = []
+        for subject, value_range in zip(present, value_ranges):
+            rows = value_range.get("values", [])
+            digest = fingerprint(rows)
+            if self.worksheets.get(subject, {}).get("fingerprint") != digest:
+                changed.append(subject)
+                self.worksheets[subject] = {"fingerprint": digest, "rows": rows}
+        for subject in list(self.worksheets):
+            if subject not in sheets:
+                del self.worksheets[subject]
+                changed.append(subject)
+        # Only trusted once the values it belongs to are in the mirror.
+        self.revision = revision
+        self.save()
+        return changed, "fingerprint"
+
+    def _fingerprints(self) -> dict:
+        return {subject: worksheet["fingerprint"] for subject, worksheet in self.worksheets.items()}
+
+    def mark_applied(self, version):
+        """Records that groups data version now matches the mirror."""
+        self.applied = {"version": version, "fingerprints": self._fingerprints()}
+        self.save()
+
+    def is_applied(self, version) -> bool:
+        """True if groups data version already matches the mirror, so there's nothing to apply."""
+        return self.applied["version"] == version and self.applied["fingerprints"] == self._fingerprints()
+
+    def block(self, subject: str, index_within_subject: int):
+        """Rows of a group's block as last seen in the sheet, None if the worksheet isn't mirrored."""
+        worksheet = self.worksheets.get(subject)
+        if worksheet is None:
+            return None
+        start = index_within_subject * BLOCK_WIDTH
+        return [row[start:start + 4] for row in worksheet["rows"]]
+
+    def timings(self, subject: str, index_within_subject: int):
+        rows = self.block(subject, index_within_subject)
+        return parse_block(rows) if rows is not None else None
+
+    def channels_from_sheet(self, data) -> dict:
+        """data (a models.ChannelsData) as a dict with every group's timings taken from the mirror."""
+        raw = data.to_dict()
+        for group, raw_group in zip(data.channels, raw["channels"]):
+            subject = group.subject or "Unknown"
+            timings = self.timings(subject, data.by_subject(subject).index(group))
+            if timings is not None:
+                raw_group["timings"] = timings
+        return raw
+
+SHEETS_MIRROR = SheetsMirror()
+
+if __name__ == "__main__":
+    # Syncs against an in-memory workbook that counts the requests it gets.
+    import tempfile
+    import models
+    import snapshots
+
+    class FakeWorksheet:
+        def __init__(self, title, rows):
+            self.title = title
+            self.rows = rows
+            self.row_count = 25
+            self.col_count = 500
+
+    class FakeWorkbook:
+        def __init__(self, sheets, with_drive=True):
+            self.sheets = {sheet.title: sheet for sheet in sheets}
+            self.with_drive = with_drive
+            self.modified = 1
+            self.requests = 0
+
+        def get_lastUpdateTime(self):
+            self.requests += 1
+            if not self.with_drive:
+                raise PermissionError("Request had insufficient authentication scopes.")
+            return f"2025-01-01T00:00:{self.modified:02d}Z"
+
+        def worksheets(self):
+            self.requests += 1
+            return list(self.sheets.values())
+
+        def values_batch_get(self, ranges):
+            self.requests += 1
+            titles = [r.split("!")[0].strip("'").replace("''", "'") for r in ranges]
+            return {"valueRanges": [{"range": r, "values": self.sheets[t].rows} for r, t in zip(ranges, titles)]}
+
+    data = models.ChannelsData.from_dict({"channels": [
+        {"id": "-1", "name": "Physics A", "subject": "Physics", "timings": []},
+        {"id": "-2", "name": "Physics B", "subject": "Physics", "timings": []},
+    ]})
+    with tempfile.TemporaryDirectory() as directory:
+        for with_drive in (True, False):
+            physics = FakeWorksheet("Physics", [["10 AM", "1 PM", "iamhet7", "Het", "", "5 PM", "7 PM", "aman0864", "Aman"]])
+            workbook = FakeWorkbook([physics], with_drive)
+            mirror = SheetsMirror(os.path.join(directory, f"mirror_{with_drive}.json"))
+            for step in ("first sync", "nothing edited", "edited"):
+                if step == "edited":
+                    physics.rows = [physics.rows[0][:5] + ["6 PM", "8 PM", "aman0864", "Aman"]]
+                    workbook.modified += 1
+                before = workbook.requests
+                changed, checked = mirror.sync(workbook, ["Physics"])
+                print(f"drive={with_drive} {step}: changed {changed} by {checked}, {workbook.requests - before} request(s)")
+        print("\n".join(snapshots.diff_channels(data.to_dict(), mirror.channels_from_sheet(data))))
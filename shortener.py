@@ -0,0 +1,310 @@
+"""
+Optional stage that expands shortener links (bit.ly, tinyurl.com, t.co, ...) before moderation,
+so a short link is judged by where it points instead of being blocked or allowed wholesale.
+
+Links are expanded with HEAD requests (GET if a shortener refuses HEAD) without downloading
+anything, following redirects only while they point to other shorteners. Expansions are kept
+in a SQLite file with a TTL, so only the first message with a given link waits for the network.
+Recent expansions are also kept in memory, the SQLite file is only read and written in worker threads.
+Enable it with SHORTENER_EXPANSION = True in config.py.
+"""
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from urllib.parse import urljoin, urlsplit
+
+from url_checker import deobfuscate, split_url, LRUCache, _HOST_RUN, MAX_SCAN_LENGTH, MAX_URL_LENGTH, MAX_URL_CANDIDATES
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+SHORTENER_EXPANSION = getattr(_config, "SHORTENER_EXPANSION", False)
+SHORTENER_HOSTS = frozenset(getattr(_config, "SHORTENER_HOSTS", (
+    "bit.ly", "tinyurl.com", "t.co", "goo.gl", "ow.ly", "is.gd", "buff.ly", "cutt.ly",
+    "rb.gy", "shorturl.at", "tiny.cc", "rebrand.ly", "t.ly", "s.id",
+)))
+# Seconds one whole expansion (all redirect hops) may take, after that the link stays unexpanded.
+SHORTENER_TIMEOUT = getattr(_config, "SHORTENER_TIMEOUT", 2.0)
+SHORTENER_MAX_CONCURRENCY = getattr(_config, "SHORTENER_MAX_CONCURRENCY", 8)
+SHORTENER_MAX_REDIRECTS = getattr(_config, "SHORTENER_MAX_REDIRECTS", 5)
+SHORTENER_CACHE_FILE = getattr(_config, "SHORTENER_CACHE_FILE", "shortener_cache.sqlite3")
+SHORTENER_CACHE_TTL = getattr(_config, "SHORTENER_CACHE_TTL", 7 * 24 * 3600)
+# Failed expansions are retried after this many seconds.
+SHORTENER_FAILURE_TTL = getattr(_config, "SHORTENER_FAILURE_TTL", 600)
+# Expansions kept in memory in front of the SQLite file.
+SHORTENER_MEMORY_CACHE_SIZE = getattr(_config, "SHORTENER_MEMORY_CACHE_SIZE", 10000)
+
+_MISSING = object()
+
+def find_short_links(text: str) -> dict:
+    """
+    Shortener links in text, as {candidate: url}. candidate is the normalized form
+    url_checker.iter_url_candidates yields for the link, url keeps the path's case
+    (short codes are case sensitive) and gets an https:// scheme.
+    """
+    links = {}
+    for token in deobfuscate(text[:MAX_SCAN_LENGTH]).split():
+        lowered = token.lower()
+        for run in _HOST_RUN.finditer(lowered):
+            host = run.group().strip('.-')
+            if host.startswith("www."):
+                host = host[4:]
+            end = run.end()
+            if host in SHORTENER_HOSTS and end < len(token) and token[end] == "/":
+                path = token[end:]
+                links[(host + path.lower())[:MAX_URL_LENGTH]] = f"https://{host}{path}"[:MAX_URL_LENGTH]
+                break
+        if len(links) > MAX_URL_CANDIDATES:
+            break
+    return links
+
+class ResolutionCache:
+    """
+    SQLite backed {short url: target url or None} with per entry expiry, None means the expansion failed.
+    The most recently used entries are also kept in memory: peek() only looks there and never blocks,
+    get() and put() use the SQLite file and belong in a worker thread.
+    """
+
+    def __init__(self, path=SHORTENER_CACHE_FILE, ttl=SHORTENER_CACHE_TTL, failure_ttl=SHORTENER_FAILURE_TTL,
+                 memory_size=SHORTENER_MEMORY_CACHE_SIZE):
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        # url -> (target, expires)
+        self._memory = LRUCache(memory_size)
+        self._lock = threading.Lock()
+        # The file can be shared by several bot workers, writers wait for each other instead of failing.
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS resolutions (url TEXT PRIMARY KEY, target TEXT, expires REAL NOT NULL)")
+        self.hits = 0
+        self.misses = 0
+
+    def peek(self, url: str):
+        """The target if it's cached in memory, otherwise _MISSING. Doesn't count as a miss, get() follows."""
+        entry = self._memory.get(url, None)
+        if entry is None or entry[1] < time.time():
+            return _MISSING
+        self.hits += 1
+        return entry[0]
+
+    def get(self, url: str):
+        """The cached target (None for a cached failure) or _MISSING."""
+        target = self.peek(url)
+        if target is not _MISSING:
+            return target
+        with self._lock:
+            row = self._db.execute("SELECT target, expires FROM resolutions WHERE url = ?", (url,)).fetchone()
+        if row is None or row[1] < time.time():
+            self.misses += 1
+            return _MISSING
+        self._memory.put(url, row)
+        self.hits += 1
+        return row[0]
+
+    def remember(self, url: str, target) -> float:
+        """Caches target in memory only, returns when it expires."""
+        expires = time.time() + (self.ttl if target is not None else self.failure_ttl)
+        self._memory.put(url, (target, expires))
+        return expires
+
+    def put(self, url: str, target, expires=None):
+        if expires is None:
+            expires = self.remember(url, target)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO resolutions (url, target, expires) VALUES (?, ?, ?)",
+                             (url, target, expires))
+
+    def purge(self) -> int:
+        """Deletes expired entries, returns how many."""
+        with self._lock:
+            return self._db.execute("DELETE FROM resolutions WHERE expires < ?", (time.time(),)).rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM resolutions").fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"size": len(self), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+class ShortenerResolver:
+    """
+    Expands shortener URLs. At most max_concurrency expansions run at once and
+    concurrent requests for the same URL share one expansion.
+    """
+
+    def __init__(self, cache: ResolutionCache, timeout=SHORTENER_TIMEOUT, max_concurrency=SHORTENER_MAX_CONCURRENCY,
+                 max_redirects=SHORTENER_MAX_REDIRECTS, transport=None):
+        self.cache = cache
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.max_concurrency = max_concurrency
+        self._transport = transport
+        self._semaphore = None
+        self._client = None
+        self._inflight = {}
+        self.network_requests = 0
+        self.coalesced = 0
+
+    def _get_client(self):
+        if self._client is None:
+            import httpx
+            # Created on first use so they belong to the running event loop.
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout), follow_redirects=False,
+                                             transport=self._transport,
+                                             headers={"User-Agent": "SciAstra-messaging-bot link checker"})
+        return self._client
+
+    async def _request_location(self, client, url: str):
+        self.network_requests += 1
+        response = await client.head(url)
+        if response.status_code in (403, 405, 501):
+            # Some shorteners only answer GET, the body is never read.
+            async with client.stream("GET", url) as response:
+                return response.status_code, response.headers.get("location")
+        return response.status_code, response.headers.get("location")
+
+    async def _expand(self, url: str):
+        client = self._get_client()
+        async with self._semaphore:
+            current = url
+            for _ in range(self.max_redirects):
+                status, location = await self._request_location(client, current)
+                if status not in (301, 302, 303, 307, 308) or not location:
+                    return None if current == url else current
+                current = urljoin(current, location)
+                host, _ = split_url(current)
+                if host not in SHORTENER_HOSTS:
+                    # The first hop off the shorteners is what gets moderated, it is never requested.
+                    return current
+            return None
+
+    async def resolve(self, url: str):
+        """Target of a shortener url, or None if it can't be expanded (in time)."""
+        cached = self.cache.peek(url)
+        if cached is not _MISSING:
+            return cached
+        future = self._inflight.get(url)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[url] = future
+        target = None
+        expires = None
+        try:
+            # The SQLite file is only touched in a worker thread, the event loop keeps moderating meanwhile.
+            cached = await asyncio.to_thread(self.cache.get, url)
+            if cached is not _MISSING:
+                target = cached
+                return cached
+            try:
+                target = await asyncio.wait_for(self._expand(url), self.timeout)
+            except Exception as e:
+                logging.info(f"Could not expand {url}: {e!r}")
+            expires = self.cache.remember(url, target)
+        finally:
+            future.set_result(target)
+            del self._inflight[url]
+        await asyncio.to_thread(self.cache.put, url, target, expires)
+        return target
+
+    async def resolve_text(self, text: str, matcher=None) -> dict:
+        """
+        Expands the shortener links of a message that matcher doesn't already allow.
+        Returns {candidate: target or None}, ready for contains_prohibited_url(resolved=...).
+        """
+        links = find_short_links(text)
+        if matcher is not None:
+            links = {candidate: url for candidate, url in links.items() if not matcher.is_allowed(candidate)}
+        if not links:
+            return {}
+        targets = await asyncio.gather(*(self.resolve(url) for url in links.values()))
+        return dict(zip(links, targets))
+
+    def stats(self) -> dict:
+        return {"cache": self.cache.stats(), "network_requests": self.network_requests,
+                "coalesced": self.coalesced, "in_flight": len(self._inflight)}
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+SHORTENER_RESOLVER = ShortenerResolver(ResolutionCache()) if SHORTENER_EXPANSION else None
+
+if __name__ == "__main__":
+    # Expands links against a local redirect server that pretends to be bit.ly and tinyurl.com.
+    import os
+    import tempfile
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    from url_checker import AllowMatcher, contains_prohibited_url
+
+    redirects = {
+        "/good": "https://www.sciastra.com/courses",
+        "/evil": "https://free-money.example.xyz/claim",
+        "/chain": "http://tinyurl.com/good",
+        "/Case": "https://www.youtube.com/watch?v=67qgPFxt0QA",
+    }
+    request_count = 0
+
+    class RedirectHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_HEAD(self):
+            global request_count
+            request_count += 1
+            path = urlsplit(self.path).path
+            if path == "/slow":
+                time.sleep(1)
+            if path in redirects:
+                self.send_response(301)
+                self.send_header("Location", redirects[path])
+            else:
+                self.send_response(404)
+            self.end_headers()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RedirectHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    import httpx
+
+    class LocalTransport(httpx.AsyncHTTPTransport):
+        # Sends every request to the local server, whatever host it is for.
+        async def handle_async_request(self, request):
+            request.url = request.url.copy_with(scheme="http", host="127.0.0.1", port=port)
+            return await super().handle_async_request(request)
+
+    async def demo():
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResolutionCache(os.path.join(directory, "cache.sqlite3"))
+            resolver = ShortenerResolver(cache, timeout=0.3, transport=LocalTransport())
+            matcher = AllowMatcher(["sciastra.com", "youtube.com/watch?v=67qgPFxt0QA", "bit.ly/allowed"])
+            texts = ["see bit.ly/good", "see bit.ly/evil", "see bit.ly/chain", "see bit.ly/Case", "see bit.ly/case",
+                     "see bit.ly/slow", "see bit.ly/allowed", "see bit.ly/missing"]
+            for text in texts:
+                start = time.perf_counter()
+                resolved = await resolver.resolve_text(text, matcher)
+                prohibited = contains_prohibited_url(text, exempt_patterns=matcher, resolved=resolved)
+                print(f"{text:22s} -> {resolved} prohibited: {prohibited} ({(time.perf_counter() - start) * 1000:.1f} ms)")
+
+            before = request_count
+            await asyncio.gather(*(resolver.resolve_text("bit.ly/good bit.ly/evil", matcher) for _ in range(50)))
+            print(f"50 cached lookups made {request_count - before} requests")
+            before = request_count
+            await asyncio.gather(*(resolver.resolve("https://bit.ly/good2") for _ in range(50)))
+            print(f"50 concurrent lookups of an uncached link made {request_count - before} request(s), "
+                  f"{resolver.coalesced} coalesced")
+            print(resolver.stats())
+            await resolver.close()
+
+    asyncio.run(demo())
+    server.shutdown()
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import logging
+import datetime
+
+from shared_state import SHARED_STATE, file_lock
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Every change to the groups data is written as a new slots_info/<unix time>.json and CURRENT names the live one.
+SLOTS_DIR = "slots_info"
+POINTER_FILE = "CURRENT"
+SNAPSHOT_KEEP_LAST = getattr(_config, "SNAPSHOT_KEEP_LAST", 20)
+SNAPSHOT_KEEP_DAILY = getattr(_config, "SNAPSHOT_KEEP_DAILY", 30)
+
+def _write_atomic(path: str, text: str):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class SnapshotStore:
+    """
+    Versions of the groups data in one directory. Versions are never edited in place,
+    save() writes a new one and then moves the CURRENT pointer to it, so a crash leaves
+    either the old or the new version live. Old versions are compacted after each save:
+    the newest keep_last are kept plus the newest one of each of the last keep_daily days.
+    Saves hold a file lock shared with the other bot workers and publish `topic` to them.
+    """
+
+    def __init__(self, directory=SLOTS_DIR, keep_last=SNAPSHOT_KEEP_LAST, keep_daily=SNAPSHOT_KEEP_DAILY, topic=None):
+        self.directory = directory
+        self.keep_last = keep_last
+        self.keep_daily = keep_daily
+        self.topic = topic
+        self.pointer_path = os.path.join(directory, POINTER_FILE)
+        self.lock = file_lock(os.path.basename(os.path.normpath(directory)))
+
+    def path_of(self, version: str) -> str:
+        return os.path.join(self.directory, version + ".json")
+
+    def versions(self) -> list:
+        """All version names, oldest first."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted(name[:-5] for name in names if name.endswith(".json"))
+
+    def current(self):
+        """Name of the live version. Only falls back to listing the directory if CURRENT is missing."""
+        try:
+            with open(self.pointer_path) as f:
+                version = f.read().strip()
+            if version and os.path.isfile(self.path_of(version)):
+                return version
+        except OSError:
+            pass
+        versions = self.versions()
+        if not versions:
+            return None
+        # Directories from before the pointer existed: the newest file is the live one, remember it.
+        try:
+            with self.lock:
+                _write_atomic(self.pointer_path, versions[-1])
+        except OSError as e:
+            logging.error(f"Failed to write {self.pointer_path}: {e}")
+        return versions[-1]
+
+    def current_path(self):
+        version = self.current()
+        return self.path_of(version) if version else None
+
+    def load(self, version: str) -> dict:
+        with open(self.path_of(version)) as f:
+            return json.load(f)
+
+    def _new_version_name(self, versions) -> str:
+        # Same format as the existing files, bumped if two saves happen within a second.
+        stamp = int(time.time())
+        latest = versions[-1] if versions else ""
+        if latest.isdigit():
+            stamp = max(stamp, int(latest) + 1)
+        return str(stamp)
+
+    def save(self, data: dict) -> str:
+        """Writes data as a new version, makes it current and compacts. Returns the new version."""
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            version = self._new_version_name(self.versions())
+            _write_atomic(self.path_of(version), json.dumps(data, indent=4))
+            _write_atomic(self.pointer_path, version)
+            self.compact()
+        if self.topic:
+            SHARED_STATE.publish(self.topic)
+        return version
+
+    def rollback(self, version: str) -> str:
+        """Saves a copy of an older version as a new one, so the rollback can itself be undone."""
+        return self.save(self.load(version))
+
+    def compact(self) -> list:
+        """Deletes the versions outside the retention rules and returns their names."""
+        versions = self.versions()
+        keep = set(versions[-self.keep_last:]) if self.keep_last > 0 else set()
+        current = self.current()
+        if current:
+            keep.add(current)
+        today = datetime.date.today()
+        newest_per_day = {}
+        for version in versions:
+            if not version.isdigit():
+                keep.add(version)  # hand named files are never deleted
+                continue
+            day = datetime.date.fromtimestamp(int(version))
+            if (today - day).days < self.keep_daily:
+                newest_per_day[day] = version
+        keep.update(newest_per_day.values())
+        removed = []
+        for version in versions:
+            if version in keep:
+                continue
+            try:
+                os.remove(self.path_of(version))
+                removed.append(version)
+            except OSError as e:
+                logging.error(f"Failed to remove snapshot {version}: {e}")
+        if removed:
+            logging.info(f"Compacted {len(removed)} old snapshot(s) from {self.directory}")
+        return removed
+
+def describe_version(version: str) -> str:
+    if version.isdigit():
+        return f"{version} ({datetime.datetime.fromtimestamp(int(version)).strftime('%Y-%m-%d %H:%M:%S')})"
+    return version
+
+def _timing_line(timing: dict) -> str:
+    return f"{timing.get('time')}: {timing.get('name')} ({timing.get('user_id')})"
+
+def diff_channels(old: dict, new: dict) -> list:
+    """Human readable differences between two versions of the groups data."""
+    old_groups = {str(group.get("id")): group for group in old.get("channels", [])}
+    new_groups = {str(group.get("id")): group for group in new.get("channels", [])}
+    lines = []
+    for group_id, group in old_groups.items():
+        if group_id not in new_groups:
+            lines.append(f"- group {group_id} ({group.get('name')}) removed")
+    for group_id, group in new_groups.items():
+        old_group = old_groups.get(group_id)
+        if old_group is None:
+            lines.append(f"+ group {group_id} ({group.get('name')}) added with {len(group.get('timings', []))} timing(s)")
+            continue
+        for key in sorted(set(old_group) | set(group)):
+            if key == "timings" or old_group.get(key) == group.get(key):
+                continue
+            lines.append(f"~ group {group_id}: {key} {json.dumps(old_group.get(key))} -> {json.dumps(group.get(key))}")
+        old_timings = [_timing_line(timing) for timing in old_group.get("timings", [])]
+        new_timings = [_timing_line(timing) for timing in group.get("timings", [])]
+        for timing in old_timings:
+            if timing not in new_timings:
+                lines.append(f"- group {group_id}: {timing}")
+        for timing in new_timings:
+            if timing not in old_timings:
+                lines.append(f"+ group {group_id}: {timing}")
+    return lines
+
+SNAPSHOTS = SnapshotStore(topic="channels")
+
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = SnapshotStore(directory, keep_last=3, keep_daily=0)
+        data = {"channels": [{"id": "-1", "name": "test", "subject": "test", "timings": []}]}
+        for i in range(5):
+            data["channels"][0]["timings"].append({"time": f"{i + 1} PM - {i + 2} PM", "name": f"M{i}", "user_id": f"@m{i}"})
+            store.save(data)
+        versions = store.versions()
+        print("Versions:", versions, "current:", store.current())
+        print("\n".join(diff_channels(store.load(versions[0]), store.load(versions[-1]))))
+        store.rollback(versions[0])
+        print("After rollback:", store.versions(), "current:", store.current())
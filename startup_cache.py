@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+import pickle
+import logging
+import hashlib
+import threading
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Structures derived from data files (TLD set, compiled allowlist, parsed schedules) are pickled here,
+# one file per structure, each under a key made from the hashes of the files it was built from.
+STARTUP_CACHE_DIR = getattr(_config, "STARTUP_CACHE_DIR", ".startup_cache")
+STARTUP_CACHE_ENABLED = getattr(_config, "STARTUP_CACHE_ENABLED", True)
+CACHE_FORMAT = 1
+# Processes that never call finish_startup() stop recording timings after this many steps.
+MAX_TIMINGS = 200
+
+_lock = threading.Lock()
+# Set by finish_startup(), after that values are built directly and nothing is timed.
+_started = False
+# (step, milliseconds, detail) of everything timed during startup, see report().
+_timings = []
+_process_start = time.perf_counter()
+
+def file_hash(path: str) -> str:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+    except OSError:
+        return "missing"
+
+def source_key(paths) -> tuple:
+    """Key of a cached value: the format, the Python version and the hash of every source file."""
+    return (CACHE_FORMAT, sys.version_info[:2]) + tuple((os.path.abspath(path), file_hash(path)) for path in paths)
+
+def entry_path(name: str) -> str:
+    return os.path.join(STARTUP_CACHE_DIR, hashlib.blake2b(name.encode(), digest_size=8).hexdigest() + ".pickle")
+
+def _load_entry(name: str):
+    """The (key, pickled value) cached under name, or None."""
+    path = entry_path(name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            entry = pickle.load(f)
+        if isinstance(entry, tuple) and len(entry) == 2:
+            return entry
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable startup cache entry {path}: {e}")
+    return None
+
+def _save_entry(name: str, entry: tuple):
+    path = entry_path(name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(STARTUP_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.warning(f"Failed to write startup cache entry {path}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def cached(name: str, source_paths, build):
+    """
+    Returns the value cached under name if none of source_paths changed since it was built,
+    otherwise calls build() and caches its result. The source files of the code that builds
+    the value belong in source_paths too, so a code change also invalidates it.
+    Every value returned is a fresh copy, callers may change it.
+    After finish_startup() the cache is bypassed, a reload then only costs the build.
+    """
+    if _started:
+        return build()
+    start = time.perf_counter()
+    if not STARTUP_CACHE_ENABLED:
+        value = build()
+        record(f"build {name}", start, "cache disabled")
+        return value
+    key = source_key(source_paths)
+    with _lock:
+        entry = _load_entry(name)
+    if entry is not None and entry[0] == key:
+        try:
+            value = pickle.loads(entry[1])
+            record(f"load {name}", start, "cache hit")
+            return value
+        except Exception as e:
+            logging.warning(f"Rebuilding {name}, cached copy is unreadable: {e}")
+    value = build()
+    with _lock:
+        _save_entry(name, (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+    record(f"build {name}", start, "cache miss")
+    return value
+
+def record(step: str, start: float, detail: str = ""):
+    """Records how long step took since start (a time.perf_counter() value)."""
+    if _started or len(_timings) >= MAX_TIMINGS:
+        return
+    _timings.append((step, (time.perf_counter() - start) * 1000, detail))
+
+def report(start: float = None) -> str:
+    """Table of the recorded steps, the total is measured from start (default: when this module was imported)."""
+    lines = ["Startup timings:"]
+    for step, ms, detail in _timings:
+        lines.append(f"  {step:40s} {ms:9.1f} ms  {detail}")
+    lines.append(f"  {'total':40s} {(time.perf_counter() - (start or _process_start)) * 1000:9.1f} ms")
+    return "\n".join(lines)
+
+def finish_startup():
+    """Call once the process is up: later loads skip the cache and nothing more is timed."""
+    global _started
+    _started = True
@@ -0,0 +1,146 @@
+"""
+Runs the bot as several worker processes behind one webhook.
+
+Telegram posts every update to WEBHOOK_URL, which has to reach this router (usually through a
+reverse proxy that terminates TLS). The router sends each update to worker chat_id % WORKER_COUNT,
+a `python main.py --worker K` listening on 127.0.0.1:WORKER_BASE_PORT + K. All updates of a chat
+go to the same worker, so the state kept per chat in memory (flood windows, the edit memo) stays
+correct. Everything the workers have to agree on lives in shared_state.py.
+
+    python update_router.py --spawn    starts the workers too and stops them on exit
+"""
+import sys
+import json
+import asyncio
+import logging
+import subprocess
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Public https URL Telegram sends updates to, forwarded to WEBHOOK_LISTEN:WEBHOOK_PORT.
+WEBHOOK_URL = getattr(_config, "WEBHOOK_URL", None)
+WEBHOOK_LISTEN = getattr(_config, "WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = getattr(_config, "WEBHOOK_PORT", 8440)
+WEBHOOK_PATH = getattr(_config, "WEBHOOK_PATH", "telegram")
+# Telegram sends it in the X-Telegram-Bot-Api-Secret-Token header, requests without it are refused.
+WEBHOOK_SECRET = getattr(_config, "WEBHOOK_SECRET", None)
+WORKER_COUNT = getattr(_config, "WORKER_COUNT", 4)
+WORKER_BASE_PORT = getattr(_config, "WORKER_BASE_PORT", 8441)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+# Update fields holding a chat, the first one present decides the worker.
+CHAT_FIELDS = ("message", "edited_message", "channel_post", "edited_channel_post", "my_chat_member",
+               "chat_member", "chat_join_request", "message_reaction", "business_message")
+
+def worker_port(worker_id: int) -> int:
+    return WORKER_BASE_PORT + worker_id
+
+def worker_of(update: dict, workers=WORKER_COUNT) -> int:
+    """Index of the worker handling update, updates without a chat go to worker 0."""
+    for key in CHAT_FIELDS:
+        chat = (update.get(key) or {}).get("chat")
+        if chat and "id" in chat:
+            return int(chat["id"]) % workers
+    message = (update.get("callback_query") or {}).get("message") or {}
+    if "chat" in message:
+        return int(message["chat"]["id"]) % workers
+    return 0
+
+class UpdateRouter:
+    def __init__(self, workers=WORKER_COUNT, secret=WEBHOOK_SECRET, path=WEBHOOK_PATH, transport=None):
+        self.workers = workers
+        self.secret = secret
+        self.path = "/" + path.strip("/")
+        self._transport = transport
+        self._client = None
+        self.forwarded = [0] * workers
+        self.failed = 0
+
+    async def forward(self, body: bytes) -> int:
+        """Sends an update to its worker, returns the HTTP status for Telegram (non 200 makes it retry)."""
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return 400
+        worker = worker_of(update, self.workers)
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(timeout=10, transport=self._transport)
+        headers = {"content-type": "application/json"}
+        if self.secret:
+            headers[SECRET_HEADER] = self.secret
+        try:
+            response = await self._client.post(f"http://127.0.0.1:{worker_port(worker)}{self.path}",
+                                               content=body, headers=headers)
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Worker {worker} is unreachable: {e!r}")
+            return 502
+        self.forwarded[worker] += 1
+        return response.status_code
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Minimal HTTP/1.1 server, all it needs to accept are Telegram's webhook POSTs (with keep-alive)."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                if method != "POST" or target.split("?")[0] != self.path:
+                    status = 404
+                elif self.secret and headers.get(SECRET_HEADER) != self.secret:
+                    status = 403
+                else:
+                    status = await self.forward(body)
+                writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                             f"Content-Length: 0\r\n\r\n".encode())
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+def spawn_workers(workers=WORKER_COUNT) -> list:
+    return [subprocess.Popen([sys.executable, "main.py", "--worker", str(worker)]) for worker in range(workers)]
+
+async def serve(router: UpdateRouter, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT):
+    server = await asyncio.start_server(router.handle_connection, host, port)
+    logging.info(f"Routing updates from {host}:{port}{router.path} to {router.workers} workers")
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            await router.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(filename='logs.log', filemode='a', format='%(asctime)s - %(levelname)s - %(message)s',
+                        level=logging.INFO)
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        print("Set WEBHOOK_URL and WEBHOOK_SECRET in config.py to run several workers.")
+        sys.exit(1)
+    processes = spawn_workers() if "--spawn" in sys.argv else []
+    router = UpdateRouter()
+    try:
+        asyncio.run(serve(router))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
@@ -1,6 +1,4 @@
-import gspread
-from google.oauth2.service_account import Credentials
-from gspread.utils import rowcol_to_a1
+# gspread is imported inside the functions that use it, so importing this module stays cheap.
 
 def col_to_num(col_str: str) -> int:
     """
@@ -69,6 +67,8 @@ def create_table(workbook, subject_name, start_row, start_col, channel_info=None
         values (list of list): The table data rows to be placed starting three rows below start_row.
         force_clear (bool): If True, after updating data, any leftover cells below the new data (in this group's column block) are cleared.
     """
+    from gspread.utils import rowcol_to_a1
+
     # Get or create the worksheet.
     if subject_name in map(lambda x: x.title, workbook.worksheets()):
         sheet = workbook.worksheet(subject_name)
@@ -119,6 +119,9 @@ def create_table(workbook, subject_name, start_row, start_col, channel_info=None
                 sheet.batch_clear([clear_range])
 
 if __name__ == "__main__":
+    import gspread
+    from google.oauth2.service_account import Credentials
+
     scopes = ["https://www.googleapis.com/auth/spreadsheets"]
     creds = Credentials.from_service_account_file("api_key.json", scopes=scopes)
     client = gspread.authorize(creds)
@@ -1,42 +1,312 @@
 import re
 import os
+import hashlib
+from collections import OrderedDict
+
+import startup_cache
+
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+# Number of URL verdicts and whole message verdicts to remember, 0 disables the message cache.
+URL_CACHE_SIZE = getattr(_config, "URL_CACHE_SIZE", 10000)
+MESSAGE_CACHE_SIZE = getattr(_config, "MESSAGE_CACHE_SIZE", 2000)
+
+_MISSING = object()
+
+TLD_FILE = os.path.join(os.path.dirname(__file__), "TLDs.txt")
 
 def load_tlds():
-    tld_file_path = os.path.join(os.path.dirname(__file__), "TLDs.txt")
-    with open(tld_file_path, 'r') as file:
+    with open(TLD_FILE, 'r') as file:
         # Skip comments and empty lines, convert to lowercase
         tlds = [line.strip().lower() for line in file if line.strip() and not line.strip().startswith('//')]
     return tlds
 
-VALID_TLDS = load_tlds()
+VALID_TLDS = startup_cache.cached("tlds", [TLD_FILE, __file__], lambda: frozenset(load_tlds()))
 
-def contains_prohibited_url(text, exempt_patterns=None):
-    if exempt_patterns is None:
-        exempt_patterns = []
-    
-    url_pattern = re.compile(
-        r'((?:(?:https?://)|(?:www\.)|(?:[a-zA-Z0-9-]+\.[a-zA-Z0-9-]+))\S*)', 
-        re.IGNORECASE
-    )
-    matches = url_pattern.findall(text)
-
-    for match in matches:
-        url = re.sub(r'\s+', '', match)
-
-        if url.lower().startswith("www."):
-            url = "http://" + url
-        
-        domain_match = re.search(r'(?:https?://)?(?:www\.)?([a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+)', url)
-        if domain_match:
-            domain = domain_match.group(1)
-            parts = domain.lower().split('.')
-            if len(parts) > 1 and parts[-1] in VALID_TLDS:
-                allowed = any(pattern.lower() in url.lower() for pattern in exempt_patterns)
-                if not allowed:
+def reload_tlds():
+    """Re-reads TLDs.txt. Every VerdictCache is invalidated on its next use."""
+    global VALID_TLDS
+    VALID_TLDS = frozenset(load_tlds())
+
+class LRUCache:
+    """A bounded mapping that drops the least recently used entry and counts hits and misses."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=_MISSING):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+class VerdictCache:
+    """
+    Remembers verdicts of contains_prohibited_url.
+    URL verdicts are keyed by the lower cased URL and message verdicts by a blake2b digest of the text.
+    Both are cleared whenever the call is made with a matcher whose key (see AllowMatcher) differs from the
+    last one or the TLDs were reloaded, so a matcher must be replaced (not mutated in place) when it changes.
+    """
+
+    def __init__(self, url_size=URL_CACHE_SIZE, message_size=MESSAGE_CACHE_SIZE):
+        self.urls = LRUCache(url_size)
+        self.messages = LRUCache(message_size)
+        self._exempt_patterns = None
+        self._key = None
+        self._tlds = None
+        self.invalidations = 0
+
+    def sync(self, exempt_patterns):
+        if exempt_patterns is self._exempt_patterns and VALID_TLDS is self._tlds:
+            return
+        # Matchers without a key are only equal to themselves.
+        key = getattr(exempt_patterns, "key", exempt_patterns)
+        if key != self._key or VALID_TLDS is not self._tlds:
+            if self._tlds is not None:
+                self.invalidations += 1
+            self.clear()
+            self._key = key
+            self._tlds = VALID_TLDS
+        self._exempt_patterns = exempt_patterns
+
+    def clear(self):
+        self.urls.clear()
+        self.messages.clear()
+
+    @staticmethod
+    def message_key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+    def stats(self) -> dict:
+        return {"urls": self.urls.stats(), "messages": self.messages.stats(), "invalidations": self.invalidations}
+
+VERDICT_CACHE = VerdictCache()
+
+_HOST_AND_REST = re.compile(r'([a-z0-9.-]*)(.*)', re.DOTALL)
+_PATH_BOUNDARY = re.compile(r'[/?#&=]')
+# Punctuation that follows a link in a sentence, e.g. 'see example.in/notes.' or '(example.in/notes)'.
+_TRAILING_PUNCTUATION = ".,;:!?)]}>'\""
+
+def split_url(url: str):
+    """
+    Lower cases the url, drops the scheme and a leading 'www.' and splits it into (host, rest).
+    For example 'https://www.YouTube.com/watch?v=x' -> ('youtube.com', '/watch?v=x')
+    """
+    url = url.strip().lower()
+    for prefix in ("https://", "http://"):
+        if url.startswith(prefix):
+            url = url[len(prefix):]
+            break
+    if url.startswith("www."):
+        url = url[4:]
+    host, rest = _HOST_AND_REST.match(url).groups()
+    return host.strip('.'), rest
+
+class AllowMatcher:
+    """
+    Compiled form of the allowed URL patterns.
+    Patterns are indexed by host, a URL is allowed when a pattern exists for its host (or a parent domain)
+    whose path is a prefix of the URL's path ending at a path boundary ('/', '?', '#', '&', '=' or the end).
+    Punctuation right after the URL (see _TRAILING_PUNCTUATION) is not part of its path.
+    So 'example.in' allows 'example.in/anything' and 'sub.example.in' but not 'example.in.evil.com'.
+    key is a digest of the pattern set, equal for matchers compiled from the same patterns.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = tuple(pattern.strip() for pattern in patterns if pattern.strip())
+        self.key = hashlib.blake2b("\n".join(sorted(set(self.patterns))).encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        self._index = {}
+        for pattern in self.patterns:
+            if any(char.isspace() for char in pattern):
+                continue
+            host, rest = split_url(pattern)
+            if host:
+                self._index.setdefault(host, set()).add(rest.rstrip("/"))
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def is_allowed(self, url: str) -> bool:
+        host, rest = split_url(url)
+        rest = rest.rstrip(_TRAILING_PUNCTUATION)
+        labels = host.split('.')
+        for i in range(len(labels) - 1):
+            rests = self._index.get('.'.join(labels[i:]))
+            if rests is None:
+                continue
+            if "" in rests or rest in rests:
+                return True
+            for boundary in _PATH_BOUNDARY.finditer(rest):
+                if rest[:boundary.start()] in rests or rest[:boundary.end()] in rests:
                     return True
+        return False
+
+# Guards that keep the scan of a single message bounded.
+# Telegram messages are at most 4096 characters, anything after MAX_SCAN_LENGTH is not scanned.
+MAX_SCAN_LENGTH = getattr(_config, "MAX_SCAN_LENGTH", 8192)
+# Longest possible DNS name, longer dotted runs can't be a host.
+MAX_HOST_LENGTH = 253
+# URLs are cut to this length before they are matched against the allowlist.
+MAX_URL_LENGTH = getattr(_config, "MAX_URL_LENGTH", 2048)
+# Most URL candidates a message may have before URL_CANDIDATES_OVER_LIMIT decides.
+MAX_URL_CANDIDATES = getattr(_config, "MAX_URL_CANDIDATES", 50)
+# What happens to a message with more candidates than that: "prohibit" treats it as prohibited
+# without checking the rest, "check" checks every candidate (the scan is still bounded by MAX_SCAN_LENGTH).
+URL_CANDIDATES_OVER_LIMIT = getattr(_config, "URL_CANDIDATES_OVER_LIMIT", "prohibit")
+
+_HOST_RUN = re.compile(r'[a-z0-9.-]+')
+# Between two label characters, '[.]' and '{dot}' with optional spaces around them, '(.)' and '(dot)'
+# only without spaces, so prose like 'I am (dot) in' stays as it is.
+_OBFUSCATED_DOT = re.compile(r'(?<=[a-z0-9])(?:\s*[\[{]\s*(?:\.|dot)\s*[\]}]\s*|\((?:\.|dot)\))(?=[a-z0-9])',
+                             re.IGNORECASE)
+_UNICODE_DOTS = str.maketrans({"\u3002": ".", "\uff0e": ".", "\uff61": "."})
+# Characters after a host that mean the rest of the token is the URL's path.
+_PATH_START = "/?#:"
+
+def deobfuscate(text: str) -> str:
+    """
+    Undoes common ways of hiding a dot, e.g. 'example [.] com', 'example(dot)com' or 'example。com' -> 'example.com'.
+    A single regex pass, so this is linear in the length of text.
+    """
+    text = text.translate(_UNICODE_DOTS)
+    if '[' not in text and '(' not in text and '{' not in text:
+        return text
+    return _OBFUSCATED_DOT.sub('.', text)
+
+def scan_limit():
+    """The limit for iter_url_candidates: MAX_URL_CANDIDATES if one more candidate already decides the verdict."""
+    return MAX_URL_CANDIDATES if URL_CANDIDATES_OVER_LIMIT == "prohibit" else None
 
+def iter_url_candidates(text: str, limit=MAX_URL_CANDIDATES):
+    """
+    Single pass scanner over text that yields every URL with a valid TLD as a normalized
+    (lower cased, scheme and 'www.' stripped) 'host/rest' string, in order of appearance.
+    Hosts are maximal runs of [a-z0-9.-], so no position of the text is scanned twice.
+    At most limit + 1 URLs are yielded, all of them if limit is None.
+    """
+    text = deobfuscate(text[:MAX_SCAN_LENGTH]).lower()
+    found = 0
+    for token in text.split():
+        position = 0
+        while True:
+            run = _HOST_RUN.search(token, position)
+            if run is None:
+                break
+            position = run.end()
+            host = run.group().strip('.-')
+            if '.' not in host or len(host) > MAX_HOST_LENGTH:
+                continue
+            labels = host.split('.')
+            if labels[-1] not in VALID_TLDS or not any(labels[:-1]):
+                continue
+            if host.startswith("www."):
+                host = host[4:]
+            if position < len(token) and token[position] in _PATH_START:
+                # The rest of the token is this URL's path, there is no other host in it.
+                yield (host + token[position:])[:MAX_URL_LENGTH]
+                found += 1
+                break
+            yield host
+            found += 1
+            if limit is not None and found > limit:
+                return
+        if limit is not None and found > limit:
+            return
+
+def is_prohibited_url(url: str, exempt_patterns) -> bool:
+    """Checks a single URL yielded by iter_url_candidates against the exempt patterns."""
+    return not exempt_patterns.is_allowed(url)
+
+def urls_prohibited(urls, exempt_patterns, cache=None, resolved=None) -> bool:
+    """
+    Checks URL candidates as yielded by iter_url_candidates and stops at the first prohibited one.
+    More than MAX_URL_CANDIDATES of them are prohibited as a whole if URL_CANDIDATES_OVER_LIMIT is "prohibit".
+    See contains_prohibited_url for resolved.
+    """
+    if cache is not None:
+        cache.sync(exempt_patterns)
+    for count, url in enumerate(urls, start=1):
+        if count > MAX_URL_CANDIDATES and URL_CANDIDATES_OVER_LIMIT == "prohibit":
+            return True
+        if resolved and url in resolved:
+            target = resolved[url]
+            prohibited = is_prohibited_url(url, exempt_patterns)
+            if prohibited and target:
+                prohibited = any(is_prohibited_url(candidate, exempt_patterns) for candidate in iter_url_candidates(target))
+        elif cache is None:
+            prohibited = is_prohibited_url(url, exempt_patterns)
+        else:
+            prohibited = cache.urls.get(url)
+            if prohibited is _MISSING:
+                prohibited = is_prohibited_url(url, exempt_patterns)
+                cache.urls.put(url, prohibited)
+        if prohibited:
+            return True
     return False
 
+def contains_prohibited_url(text, exempt_patterns=None, cache=None, resolved=None, urls=None):
+    """
+    exempt_patterns is either a matcher with an is_allowed(url) method (AllowMatcher, policy.PolicyMatcher)
+    or an iterable of allowed URL patterns (which is compiled on every call, so pass a matcher on hot paths).
+    resolved maps shortener links to where they point (see shortener.py), such a link is allowed if
+    the link itself or its target is, a link that couldn't be expanded (None) is checked as it is.
+    urls are the candidates of text if the caller already scanned it (iter_url_candidates(text, scan_limit())).
+    Stops at the first prohibited URL.
+    """
+    if exempt_patterns is None:
+        exempt_patterns = []
+    if not hasattr(exempt_patterns, "is_allowed"):
+        exempt_patterns = AllowMatcher(exempt_patterns)
+
+    message_key = None
+    if cache is not None:
+        cache.sync(exempt_patterns)
+        # Expansions can change between messages with the same text, so those verdicts aren't cached.
+        if cache.messages.max_size > 0 and not resolved:
+            message_key = cache.message_key(text)
+            verdict = cache.messages.get(message_key)
+            if verdict is not _MISSING:
+                return verdict
+
+    if urls is None:
+        urls = iter_url_candidates(text, scan_limit())
+    verdict = urls_prohibited(urls, exempt_patterns, cache, resolved)
+
+    if message_key is not None:
+        cache.messages.put(message_key, verdict)
+    return verdict
+
 if __name__ == "__main__":
     from glob import glob as glob_glob
     from re import split as re_split
@@ -51,9 +321,44 @@ if __name__ == "__main__":
         "linx.yodobashi",
         "x.y",
         "link.sinx.logx",
+        "see https://www.sciastra.com/courses",
+        "see https://sciastra.com.evil.com",
+        "join example[.]com now",
+        "join example [.] com or spam { dot } top",
+        "I am (dot) in class, what (dot) product means",
+        " ".join(["https://www.youtube.com/watch?v=67qgPFxt0QA"] * 60),
+        " ".join(["sciastra.com"] * 50 + ["evil-spam.xyz/claim"]),
+        "sciastra.com,evil.com",
+        "Watch https://www.youtube.com/watch?v=NPSWKDtEG_E.",
+        "(https://www.youtube.com/watch?v=67qgPFxt0QA)",
+        "Notes: https://www.youtube.com/watch?v=NPSWKDtEG_E, https://www.youtube.com/watch?v=67qgPFxt0QA!",
     ]
     
+    matcher = AllowMatcher(all_urls)
     print("Testing URL detection with valid TLDs:")
     for test in test_texts:
-        result = contains_prohibited_url(test, exempt_patterns=all_urls)
-        print(f"'{test}' - Contains prohibited URL: {result}")
\ No newline at end of file
+        result = contains_prohibited_url(test, exempt_patterns=matcher)
+        shown = test if len(test) <= 100 else test[:97] + "..."
+        print(f"'{shown}' - Contains prohibited URL: {result}")
+
+    cache = VerdictCache()
+    for _ in range(3):
+        for test in test_texts:
+            contains_prohibited_url(test, exempt_patterns=matcher, cache=cache)
+    print(f"Cache stats after 3 rounds: {cache.stats()}")
+
+    # Worst case inputs, the time per message should stay flat no matter how the text is built.
+    import time
+    worst_cases = {
+        "long dotted token": "a." * 2048,
+        "no spaces": "a" * 4096,
+        "open brackets": "[ " * 2048,
+        "obfuscated dots": "a[.]" * 1020,
+        "many allowed links": " ".join(["sciastra.com/x"] * 300),
+    }
+    print("Worst case timings:")
+    for name, text in worst_cases.items():
+        start = time.perf_counter()
+        for _ in range(20):
+            result = contains_prohibited_url(text, exempt_patterns=matcher)
+        print(f"  {name} ({len(text)} chars): {(time.perf_counter() - start) / 20 * 1000:.2f} ms, prohibited: {result}")
\ No newline at end of file